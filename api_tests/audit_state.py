@@ -0,0 +1,186 @@
+import os
+import sqlite3
+import threading
+import time
+from collections import namedtuple
+
+from api_tests.inventory import zone_name
+
+'''
+    ====================
+    Persistent audit state for incremental runs
+
+    Every audited resource is stored in SQLite with its fingerprint, every active rule with its
+    signature, and every failing (resource, rule) pair as a failure. On the next run a verdict is
+    reused as long as both fingerprint and signature still match, so only resources that changed
+    since the last audit (or rules whose definition / expectation changed) are evaluated again.
+
+    Compute instances are fingerprinted by fingerprint + label_fingerprint, buckets by
+    etag + metageneration. Resources without a fingerprint are always evaluated. A missing state
+    file, or one SQLite cannot read, means a full evaluation.
+
+    The failures are also what --reverify-failures re-checks (api_tests/reverify.py).
+    ====================
+'''
+
+DEFAULT_STATE_FILE = "audit_state.sqlite"
+
+# What the last run left behind for one project: {resource: fingerprint}, {rule: signature} and the
+# set of (resource, rule) pairs that failed. Every other recorded pair passed.
+AuditState = namedtuple("AuditState", ["fingerprints", "signatures", "failures"])
+
+_SCHEMA = (
+    """CREATE TABLE IF NOT EXISTS resources (
+        service TEXT NOT NULL, project_id TEXT NOT NULL, resource TEXT NOT NULL, fingerprint TEXT NOT NULL,
+        checked_at REAL NOT NULL, PRIMARY KEY (service, project_id, resource))""",
+    """CREATE TABLE IF NOT EXISTS rules (
+        service TEXT NOT NULL, project_id TEXT NOT NULL, rule TEXT NOT NULL, signature TEXT NOT NULL,
+        PRIMARY KEY (service, project_id, rule))""",
+    """CREATE TABLE IF NOT EXISTS failures (
+        service TEXT NOT NULL, project_id TEXT NOT NULL, resource TEXT NOT NULL, rule TEXT NOT NULL,
+        PRIMARY KEY (service, project_id, resource, rule))""",
+)
+
+
+def instance_resource(instance):
+    # Instance names are only unique per zone: "europe-west3-a/cdp-rubix-dev-m"
+    return f"{zone_name(instance.zone)}/{instance.name}"
+
+
+def instance_fingerprint(instance):
+    # fingerprint changes with the instance's metadata, label_fingerprint with its labels
+    if not instance.fingerprint:
+        return ""
+    return f"{instance.fingerprint}:{instance.label_fingerprint}"
+
+
+def bucket_fingerprint(bucket):
+    # The etag changes on every metadata / IAM update, metageneration on every metadata update
+    if not bucket.etag:
+        return ""
+    return f"{bucket.etag}:{bucket.metageneration}"
+
+
+class AuditStore:
+
+    def __init__(self, path=None):
+        self._path = path
+        self._connection = None
+        self._lock = threading.Lock()
+        self.reused = 0
+        self.evaluated = 0
+        # --reverify-failures: only the failures recorded by the last run are fetched and checked again
+        self.reverify = False
+        self.rechecked = 0
+        self.resolved = 0
+
+    @property
+    def path(self):
+        return self._path
+
+    @path.setter
+    def path(self, value):
+        self.close()
+        self._path = value
+
+    @property
+    def enabled(self):
+        return self._path is not None
+
+    def _open(self):
+        connection = sqlite3.connect(self._path, check_same_thread=False)
+        try:
+            for statement in _SCHEMA:
+                connection.execute(statement)
+        except sqlite3.DatabaseError:
+            connection.close()
+            raise
+        return connection
+
+    def _connect(self):
+        if self._connection is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self._path)), exist_ok=True)
+            try:
+                self._connection = self._open()
+            except sqlite3.DatabaseError:
+                # Not a readable state file (corrupt or truncated): it is set aside as <file>.corrupt and the
+                # run starts from an empty state, so every resource is evaluated again
+                os.replace(self._path, self._path + ".corrupt")
+                self._connection = self._open()
+        return self._connection
+
+    def load(self, service, project_id):
+        with self._lock:
+            connection = self._connect()
+            key = (service, project_id)
+            return AuditState(
+                dict(connection.execute(
+                    "SELECT resource, fingerprint FROM resources WHERE service = ? AND project_id = ?", key)),
+                dict(connection.execute(
+                    "SELECT rule, signature FROM rules WHERE service = ? AND project_id = ?", key)),
+                set(connection.execute(
+                    "SELECT resource, rule FROM failures WHERE service = ? AND project_id = ?", key)))
+
+    def record(self, service, project_id, fingerprints, signatures, changed_resources, changed_rules, failures):
+        # fingerprints / signatures: every current resource / active rule of the project.
+        # changed_resources were evaluated against every active rule, changed_rules against every resource;
+        # failures holds the (resource, rule) pairs among those that failed.
+        now = time.time()
+        key = (service, project_id)
+        with self._lock:
+            connection = self._connect()
+            with connection:
+                known = {resource for (resource,) in connection.execute(
+                    "SELECT resource FROM resources WHERE service = ? AND project_id = ?", key)}
+                gone = known - set(fingerprints)
+                connection.executemany(
+                    "DELETE FROM failures WHERE service = ? AND project_id = ? AND resource = ?",
+                    [key + (resource,) for resource in set(changed_resources) | gone])
+                connection.executemany(
+                    "DELETE FROM resources WHERE service = ? AND project_id = ? AND resource = ?",
+                    [key + (resource,) for resource in gone])
+                connection.executemany(
+                    "DELETE FROM failures WHERE service = ? AND project_id = ? AND rule = ?",
+                    [key + (rule,) for rule in changed_rules])
+                # Rules that are no longer active lose their signature, so they are re-evaluated if they come back
+                connection.execute(
+                    f"DELETE FROM rules WHERE service = ? AND project_id = ? AND rule NOT IN ({','.join('?' * len(signatures))})",
+                    key + tuple(signatures))
+
+                connection.executemany(
+                    "INSERT OR REPLACE INTO resources VALUES (?, ?, ?, ?, ?)",
+                    [key + (resource, fingerprints[resource], now) for resource in changed_resources])
+                connection.executemany(
+                    "INSERT OR REPLACE INTO rules VALUES (?, ?, ?, ?)",
+                    [key + (rule, signatures[rule]) for rule in changed_rules])
+                connection.executemany(
+                    "INSERT OR IGNORE INTO failures VALUES (?, ?, ?, ?)",
+                    [key + pair for pair in failures])
+            evaluated = len(fingerprints) if changed_rules else len(changed_resources)
+            self.evaluated += evaluated
+            self.reused += len(fingerprints) - evaluated
+
+    def resolve(self, service, project_id, passed, gone):
+        # After re-verification: passed (resource, rule) pairs are no longer failures, gone resources are forgotten.
+        # Fingerprints stay as they were, so the next incremental run still re-evaluates changed resources fully.
+        key = (service, project_id)
+        with self._lock:
+            connection = self._connect()
+            with connection:
+                connection.executemany(
+                    "DELETE FROM failures WHERE service = ? AND project_id = ? AND resource = ? AND rule = ?",
+                    [key + pair for pair in passed])
+                for table in ("failures", "resources"):
+                    connection.executemany(
+                        f"DELETE FROM {table} WHERE service = ? AND project_id = ? AND resource = ?",
+                        [key + (resource,) for resource in gone])
+
+    def close(self):
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+
+
+# Process-wide store; disabled until conftest.py points it at a file (--incremental)
+audit_store = AuditStore()
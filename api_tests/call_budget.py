@@ -0,0 +1,116 @@
+import json
+
+import google.auth
+import pytest
+import requests
+from google.auth.credentials import AnonymousCredentials
+from google.auth.transport.requests import AuthorizedSession
+
+from api_tests.cassettes import _build_response
+from api_tests.clients import registry
+from api_tests.emulator import DEFAULT_PAGE_SIZE, Emulator, Fleet
+from config.loader import config_store
+
+'''
+    ====================
+    API-call budgets
+
+    CountingTransport answers every AuthorizedSession request from an in-memory emulated fleet
+    (api_tests/emulator.py, no sockets involved) and counts the requests per endpoint. Loaded as a
+    plugin it runs whole suites against such a fleet and writes what they cost:
+
+        pytest -p api_tests.call_budget api_tests/test_compute_engine.py --fake-fleet 3,1,20,20 \
+            --config-dir <emulator config> --call-counts calls.json
+
+    calls.json holds the API calls per endpoint, the configuration files parsed and the clients
+    built. tests/test_call_budget.py asserts upper bounds on those numbers for every suite.
+    ====================
+'''
+
+
+class CountingTransport:
+
+    def __init__(self, emulator):
+        self.emulator = emulator
+        self._original_request = None
+        self._original_default = None
+
+    @property
+    def calls(self):
+        # endpoint ("instances.aggregatedList", "buckets.getIamPolicy", "not_found", ...) -> requests
+        return self.emulator.requests
+
+    def _request(self, session, method, url, data=None, headers=None, **kwargs):
+        prepared = requests.Request(method.upper(), url, params=kwargs.get("params")).prepare()
+        status, body = self.emulator.respond(prepared.path_url, headers)
+        return _build_response(method, prepared.url, {"status": status, "body": json.dumps(body),
+                                                      "headers": {"Content-Type": "application/json"}})
+
+    def activate(self):
+        if self._original_request is not None:
+            return
+        transport = self
+        self._original_request = AuthorizedSession.request
+        self._original_default = google.auth.default
+        AuthorizedSession.request = lambda session, *args, **kwargs: transport._request(session, *args, **kwargs)
+        # No credentials are needed for a fleet that only exists in memory
+        google.auth.default = lambda *args, **kwargs: (AnonymousCredentials(), None)
+
+    def deactivate(self):
+        if self._original_request is None:
+            return
+        AuthorizedSession.request = self._original_request
+        google.auth.default = self._original_default
+        self._original_request = self._original_default = None
+
+    def __enter__(self):
+        self.activate()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.deactivate()
+
+
+def fake_fleet(spec, page_size=DEFAULT_PAGE_SIZE):
+    # "PROJECTS,ZONES,INSTANCES,BUCKETS" -> a CountingTransport over a compliant fleet of that shape
+    projects, zones, instances, buckets = (int(value) for value in spec.split(","))
+    fleet = Fleet(projects, zones, instances, buckets, violation_rate=0.0)
+    return CountingTransport(Emulator(fleet, page_size=page_size))
+
+
+'''
+    ============
+    pytest plugin (-p api_tests.call_budget)
+    ============
+'''
+_transport = None
+
+
+def pytest_addoption(parser):
+    parser.addoption("--fake-fleet", action="store", default=None, metavar="PROJECTS,ZONES,INSTANCES,BUCKETS", help="Answer every Compute Engine / Cloud Storage call from an in-memory emulated fleet of this shape")
+    parser.addoption("--fake-page-size", action="store", type=int, default=DEFAULT_PAGE_SIZE, help="Largest page the in-memory fleet serves per listing request")
+    parser.addoption("--call-counts", action="store", default=None, metavar="FILE", help="Write the API calls, configuration parses and client constructions of the run to FILE as JSON")
+
+
+@pytest.hookimpl(tryfirst=True)
+def pytest_configure(config):
+    global _transport
+    if config.getoption("--fake-fleet"):
+        # Activated before conftest.py installs the scheduler, which then wraps the in-memory transport
+        _transport = fake_fleet(config.getoption("--fake-fleet"), config.getoption("--fake-page-size"))
+        _transport.activate()
+        # Reading the fleet's expectation profile is not part of the run being measured
+        config_store.parses.clear()
+
+
+@pytest.hookimpl(trylast=True)
+def pytest_unconfigure(config):
+    global _transport
+    if _transport is None:
+        return
+    if config.getoption("--call-counts"):
+        with open(config.getoption("--call-counts"), "w") as counts_file:
+            json.dump({"api_calls": dict(_transport.calls), "config_parses": dict(config_store.parses),
+                       "clients_built": dict(registry.built)}, counts_file, indent=2)
+    _transport.deactivate()
+    _transport = None
@@ -0,0 +1,194 @@
+import hashlib
+import json
+import os
+import re
+import threading
+from collections import defaultdict, deque
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+import google.auth
+import requests
+from google.auth.credentials import AnonymousCredentials
+from google.auth.transport.requests import AuthorizedSession
+
+'''
+    ====================
+    Record / replay cassettes for Google API traffic
+
+    Both compute_v1.InstancesClient (REST transport) and storage.Client send every call through
+    google.auth's AuthorizedSession.request, so that is the single point that gets wrapped.
+    --record stores each response on disk, --replay <dir> serves them back without network
+    or credentials.
+    ====================
+'''
+
+# Placeholder project for clients that infer their project from the environment, if none was recorded
+REPLAY_PROJECT = "cassette-replay"
+
+# Response headers that change on every call and would only add noise to the cassettes
+_VOLATILE_HEADERS = {"date", "expires", "server-timing", "alt-svc", "x-guploader-uploadid", "set-cookie"}
+
+
+# System parameter header selecting a partial response; requests that differ only in it get different responses
+FIELD_MASK_HEADER = "x-goog-fieldmask"
+
+# API name and version at the start of a Google API path
+_API_PATH = re.compile(r"/(?:upload/|batch/)?([a-z]+)/v\d")
+
+
+class CassetteMissError(RuntimeError):
+    pass
+
+
+def _service_name(url):
+    # /compute/v1/... -> compute, /storage/v1/... (or /upload/storage/v1/...) -> storage; the host
+    # (compute.googleapis.com -> compute) only when the path names no API, since an emulator serves both
+    match = _API_PATH.match(urlsplit(url).path)
+    if match:
+        return match.group(1)
+    host = urlsplit(url).hostname or "unknown"
+    return host.split(".", 1)[0]
+
+
+def request_key(method, url, params=None, data=None, headers=None):
+    prepared = requests.Request(method.upper(), url, params=params).prepare()
+    parts = urlsplit(prepared.url)
+    query = urlencode(sorted(parse_qsl(parts.query, keep_blank_values=True)))
+    key = f"{prepared.method} {urlunsplit((parts.scheme, parts.netloc, parts.path, query, ''))}"
+    field_mask = next((value for name, value in (headers or {}).items() if name.lower() == FIELD_MASK_HEADER), None)
+    if field_mask:
+        key += f" fields:{field_mask}"
+    if data:
+        body = data if isinstance(data, bytes) else str(data).encode("utf-8")
+        key += f" body:{hashlib.sha1(body).hexdigest()}"
+    return key
+
+
+def _build_response(method, url, recorded):
+    response = requests.Response()
+    response.status_code = recorded["status"]
+    response.headers.update(recorded["headers"])
+    response._content = recorded["body"].encode("utf-8")
+    response.encoding = "utf-8"
+    response.url = url
+    response.request = requests.Request(method.upper(), url).prepare()
+    return response
+
+
+class Cassette:
+
+    def __init__(self, directory, mode):
+        if mode not in ("record", "replay"):
+            raise ValueError(f"Unknown cassette mode '{mode}', expected 'record' or 'replay'")
+        self.directory = directory
+        self.mode = mode
+        self._interactions = defaultdict(list)  # service -> recorded interactions, in call order
+        self._replay = {}  # request key -> queue of recorded responses
+        self._lock = threading.Lock()
+        self._default_project = None  # project google.auth.default() resolved while recording
+        self._original_request = None
+        self._original_default = None
+
+        if mode == "replay":
+            self._load()
+
+    '''
+        ============
+        Loading and saving
+        ============
+    '''
+    def _load(self):
+        if not os.path.isdir(self.directory):
+            raise FileNotFoundError(f"Cassette directory '{self.directory}' does not exist")
+
+        for file_name in sorted(os.listdir(self.directory)):
+            if not file_name.endswith(".json"):
+                continue
+            with open(os.path.join(self.directory, file_name), "r") as cassette_file:
+                cassette = json.load(cassette_file)
+                self._default_project = self._default_project or cassette.get("default_project")
+                for interaction in cassette["interactions"]:
+                    self._replay.setdefault(interaction["key"], deque()).append(interaction["response"])
+
+    def save(self):
+        os.makedirs(self.directory, exist_ok=True)
+        with self._lock:
+            for service, interactions in self._interactions.items():
+                with open(os.path.join(self.directory, f"{service}.json"), "w") as cassette_file:
+                    json.dump({"default_project": self._default_project, "interactions": interactions},
+                              cassette_file, indent=2)
+
+    '''
+        ============
+        Serving a request
+        ============
+    '''
+    def _play(self, method, url, params, data, headers):
+        key = request_key(method, url, params, data, headers)
+        with self._lock:
+            responses = self._replay.get(key)
+            if not responses:
+                raise CassetteMissError(f"No recorded response for '{key}' in cassette '{self.directory}'")
+            # Repeated identical reads replay in recorded order; the last response keeps answering afterwards
+            recorded = responses.popleft() if len(responses) > 1 else responses[0]
+        return _build_response(method, url, recorded)
+
+    def _record(self, method, url, params, data, headers, response):
+        response_headers = {k: v for k, v in response.headers.items() if k.lower() not in _VOLATILE_HEADERS}
+        with self._lock:
+            self._interactions[_service_name(url)].append({
+                "key": request_key(method, url, params, data, headers),
+                "response": {"status": response.status_code, "headers": response_headers, "body": response.text},
+            })
+
+    def _wrap(self, original_request):
+        cassette = self
+
+        def request(session, method, url, data=None, headers=None, **kwargs):
+            if cassette.mode == "replay":
+                return cassette._play(method, url, kwargs.get("params"), data, headers)
+            response = original_request(session, method, url, data=data, headers=headers, **kwargs)
+            cassette._record(method, url, kwargs.get("params"), data, headers, response)
+            return response
+
+        return request
+
+    def _wrap_default(self, original_default):
+        cassette = self
+
+        def default(*args, **kwargs):
+            if cassette.mode == "replay":
+                # Clients still run credential discovery on construction; replay needs neither network nor ADC
+                return AnonymousCredentials(), cassette._default_project or REPLAY_PROJECT
+            credentials, project = original_default(*args, **kwargs)
+            # Remembered so that clients inferring their project build the same request keys on replay
+            cassette._default_project = cassette._default_project or project
+            return credentials, project
+
+        return default
+
+    '''
+        ============
+        Installing / removing the hook
+        ============
+    '''
+    def activate(self):
+        if self._original_request is not None:
+            return
+        self._original_request = AuthorizedSession.request
+        AuthorizedSession.request = self._wrap(self._original_request)
+
+        self._original_default = google.auth.default
+        google.auth.default = self._wrap_default(self._original_default)
+
+    def deactivate(self):
+        if self._original_request is None:
+            return
+        AuthorizedSession.request = self._original_request
+        self._original_request = None
+
+        google.auth.default = self._original_default
+        self._original_default = None
+
+        if self.mode == "record":
+            self.save()
@@ -0,0 +1,100 @@
+import os
+import threading
+from collections import Counter
+
+import google.auth
+from google.auth.credentials import AnonymousCredentials
+from google.auth.transport.requests import AuthorizedSession
+from google.cloud import compute_v1, storage
+from google.cloud.compute_v1.services.instances.transports.rest import InstancesRestTransport
+from requests.adapters import HTTPAdapter
+
+'''
+    ====================
+    Shared Google API client registry
+
+    Credentials are discovered once per process and every client is built once (Storage: once per
+    project) on top of a keep-alive connection pool sized for the concurrent inventory fetches.
+    Test modules ask the registry for clients instead of constructing their own.
+    With an endpoint set (--emulator) every client talks plain HTTP to that host without credentials.
+    ====================
+'''
+
+SCOPES = ["https://www.googleapis.com/auth/cloud-platform"]
+DEFAULT_POOL_SIZE = 8
+
+# Newer google-cloud-storage releases fetch every touched bucket again in the background to decorate
+# trace spans, which would add one GET per bucket back on top of the bulk listing
+STORAGE_BUCKET_METADATA_ENV = "DISABLE_GCS_PYTHON_CLIENT_OTEL_BUCKET_METADATA"
+
+
+class ClientRegistry:
+
+    def __init__(self, pool_size=DEFAULT_POOL_SIZE):
+        self.pool_size = pool_size
+        self.endpoint = None  # "host:port" of a local emulator; None targets the Google APIs
+        self._credentials = None
+        self._default_project = None
+        self._compute_instances = None
+        self._storage = {}
+        self._lock = threading.RLock()
+        self.built = Counter()  # "compute" / "storage" -> clients constructed
+
+    def _discover_credentials(self):
+        with self._lock:
+            if self._credentials is None and self.endpoint:
+                self._credentials = AnonymousCredentials()
+            elif self._credentials is None:
+                self._credentials, self._default_project = google.auth.default(scopes=SCOPES)
+            return self._credentials
+
+    def _pooled(self, session):
+        # One keep-alive pool per session, large enough that every fetch worker can hold a connection
+        adapter = HTTPAdapter(pool_connections=self.pool_size, pool_maxsize=self.pool_size)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        return session
+
+    @property
+    def default_project(self):
+        self._discover_credentials()
+        return self._default_project
+
+    def compute_instances(self):
+        # InstancesClient is not bound to a project, so a single client serves every project
+        with self._lock:
+            if self._compute_instances is None:
+                if self.endpoint:
+                    transport = InstancesRestTransport(credentials=self._discover_credentials(), host=self.endpoint,
+                                                       url_scheme="http")
+                else:
+                    transport = InstancesRestTransport(credentials=self._discover_credentials())
+                # The REST transport owns its AuthorizedSession and exposes no hook for the adapter
+                self._pooled(transport._session)
+                self._compute_instances = compute_v1.InstancesClient(transport=transport)
+                self.built["compute"] += 1
+            return self._compute_instances
+
+    def storage(self, project_id=None):
+        with self._lock:
+            project_id = project_id or self.default_project
+            if project_id not in self._storage:
+                os.environ.setdefault(STORAGE_BUCKET_METADATA_ENV, "true")
+                credentials = self._discover_credentials()
+                session = self._pooled(AuthorizedSession(credentials))
+                client_options = {"api_endpoint": f"http://{self.endpoint}"} if self.endpoint else None
+                self._storage[project_id] = storage.Client(project=project_id, credentials=credentials, _http=session,
+                                                           client_options=client_options)
+                self.built["storage"] += 1
+            return self._storage[project_id]
+
+    def clear(self):
+        with self._lock:
+            self._credentials = None
+            self._default_project = None
+            self._compute_instances = None
+            self._storage.clear()
+
+
+# Process-wide registry shared by every test module
+registry = ClientRegistry()
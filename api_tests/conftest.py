@@ -1,2 +1,242 @@
+import os
+import shutil
+import tempfile
+import time
+
+import pytest
+
+from api_tests import inventory
+from api_tests.audit_state import DEFAULT_STATE_FILE, audit_store
+from api_tests.cassettes import Cassette
+from api_tests.clients import registry
+from api_tests.instrumentation import Instrumentation
+from api_tests.inventory_cache import InventoryCache, SharedInventory, group_by_project
+from api_tests.scheduler import DEFAULT_CALL_TIMEOUT, DEFAULT_MAX_RETRIES, DEFAULT_RATE, scheduler
+from api_tests.sidecar import SidecarClient
+from api_tests.tracing import TracePlugin, tracer
+from config.loader import CONFIG_DIR_ENV, config_store
+
+cassette_key = pytest.StashKey[Cassette]()
+instrumentation_key = pytest.StashKey[Instrumentation]()
+trace_key = pytest.StashKey[TracePlugin]()
+shared_inventory_key = pytest.StashKey[SharedInventory]()
+inventory_cache_key = pytest.StashKey[InventoryCache]()
+
+
 def pytest_addoption(parser):
-    parser.addoption("--file", action="store", default="/Users/dpkprmr/PycharmProjects/Learning/GCP_Infratests/config/compute_response.json", help="Description of your custom argument")
+    parser.addoption("--file", action="store", default=None, help="Description of your custom argument (default: compute_response.json under the config root)")
+    parser.addoption("--config-dir", action="store", default=None, metavar="DIR", help=f"Directory holding the YAML configuration (default: ${CONFIG_DIR_ENV} or the config package)")
+    parser.addoption("--record", action="store_true", default=False, help="Record every Compute Engine / Cloud Storage API response into cassettes under --cassette-dir")
+    parser.addoption("--replay", action="store", default=None, metavar="DIR", help="Serve Compute Engine / Cloud Storage API responses from the cassettes in DIR instead of the network")
+    parser.addoption("--cassette-dir", action="store", default=None, metavar="DIR", help="Where --record writes its cassettes (default: reports/cassettes)")
+    parser.addoption("--incremental", action="store_true", default=False, help="Reuse verdicts of unchanged resources (by fingerprint / etag) recorded by earlier runs in --audit-state")
+    parser.addoption("--audit-state", action="store", default=None, metavar="FILE", help=f"SQLite file holding per-resource verdicts (default: reports/{DEFAULT_STATE_FILE})")
+    parser.addoption("--reverify-failures", action="store_true", default=False, help="Fetch only the instances that failed in the last --incremental run (--audit-state) with targeted gets and re-check only their failing rules")
+    parser.addoption("--violators-only", action="store_true", default=False, help="Push eligible Compute Engine rule expectations down as server-side list filters and list only candidate violators")
+    parser.addoption("--stream", action="store_true", default=False, help="Consume Compute Engine / Cloud Storage listings page by page and keep only verdicts, instead of holding full inventories")
+    parser.addoption("--api-rate", action="store", type=float, default=DEFAULT_RATE, help="Requests per second allowed per API and project (0 disables rate limiting)")
+    parser.addoption("--max-retries", action="store", type=int, default=DEFAULT_MAX_RETRIES, help="Retries, with jittered backoff, for throttled (429/503) or failed idempotent API calls")
+    parser.addoption("--call-timeout", action="store", type=float, default=DEFAULT_CALL_TIMEOUT, help="Deadline in seconds for every API call, retries included (0 disables it)")
+    parser.addoption("--run-budget", action="store", type=float, default=None, help="Overall budget in seconds for API calls; calls made after it is spent fail fast")
+    parser.addoption("--hedge", action="store_true", default=False, help="Send a duplicate of any idempotent read still outstanding after the API's observed p95 latency and use the first response")
+    parser.addoption("--emulator", action="store", default=None, metavar="HOST:PORT", help="Send every Compute Engine / Cloud Storage call to a local emulator (python -m api_tests.emulator) without credentials")
+    parser.addoption("--metrics-dir", action="store", default=None, metavar="DIR", help="Record every API call, fixture setup and test body and write metrics_summary.json and metrics.prom to DIR at session end")
+    parser.addoption("--inventory-ttl", action="store", type=float, default=None, metavar="SECONDS", help="Keep Compute Engine / Cloud Storage listings on disk across runs; older ones are served while they are re-listed in the background")
+    parser.addoption("--inventory-refresh", action="store_true", default=False, help="List every inventory shard again and rewrite the on-disk inventory cache")
+    parser.addoption("--inventory-cache-dir", action="store", default=None, metavar="DIR", help="Where --inventory-ttl keeps the listings (default: reports/inventory-cache)")
+    parser.addoption("--inventory-sidecar", action="store", default=None, metavar="SOCKET", help="Read Compute Engine / Cloud Storage listings from a running inventory sidecar (python -m api_tests.sidecar) on this Unix socket")
+    parser.addoption("--per-resource", action="store_true", default=False, help="Collect test_compute_resources.py: one test per (rule, VM instance), generated from the inventory at collection time")
+    parser.addoption("--trace-dir", action="store", default=None, metavar="DIR", help="Trace the session, fixtures, inventory fetches, API calls and rule checks and write trace.json (Chrome trace) and trace.folded (flamegraph stacks) to DIR")
+    parser.addoption("--fetch-workers", action="store", type=int, default=inventory.DEFAULT_MAX_WORKERS, help="Worker threads used to fetch project x zone / project x bucket inventory shards concurrently")
+
+
+def pytest_configure(config):
+    # Re-root the configuration before any test module loads its YAML at import time
+    if config.getoption("--config-dir"):
+        config_store.root = os.path.abspath(config.getoption("--config-dir"))
+    if config.getoption("--file") is None:
+        config.option.file = config_store.path("compute_response.json")
+
+    inventory.compute_inventory.max_workers = config.getoption("--fetch-workers")
+    inventory.storage_inventory.max_workers = config.getoption("--fetch-workers")
+    inventory.compute_inventory.streaming = config.getoption("--stream")
+    inventory.storage_inventory.streaming = config.getoption("--stream")
+    inventory.compute_inventory.pushdown = config.getoption("--violators-only")
+    # Size the shared connection pools so that every fetch worker keeps its own keep-alive connection
+    registry.pool_size = config.getoption("--fetch-workers")
+    registry.endpoint = config.getoption("--emulator")
+
+    if config.getoption("--violators-only") and config.getoption("--incremental"):
+        raise ValueError("--violators-only and --incremental cannot be used together")
+    if config.getoption("--reverify-failures") and any(
+            config.getoption(option) for option in ("--incremental", "--violators-only", "--stream")):
+        raise ValueError("--reverify-failures cannot be used together with --incremental, --violators-only or --stream")
+    if config.getoption("--incremental") or config.getoption("--reverify-failures"):
+        audit_store.path = config.getoption("--audit-state") or os.path.join(str(config.rootpath), "reports", DEFAULT_STATE_FILE)
+        audit_store.reverify = config.getoption("--reverify-failures")
+
+    replay_dir = config.getoption("--replay")
+    if config.getoption("--record") and replay_dir:
+        raise ValueError("--record and --replay cannot be used together")
+
+    cassette = None
+    if replay_dir:
+        cassette = Cassette(replay_dir, "replay")
+    elif config.getoption("--record"):
+        record_dir = config.getoption("--cassette-dir") or os.path.join(str(config.rootpath), "reports", "cassettes")
+        cassette = Cassette(record_dir, "record")
+
+    # Activated here so that API calls made while test modules are imported are covered as well
+    if cassette:
+        cassette.activate()
+        config.stash[cassette_key] = cassette
+
+    # Installed on top of the cassette so that retried attempts are recorded too; replayed calls need no pacing
+    if not replay_dir:
+        scheduler.rate = config.getoption("--api-rate")
+        scheduler.max_retries = config.getoption("--max-retries")
+        scheduler.max_concurrency = config.getoption("--fetch-workers")
+        scheduler.call_timeout = config.getoption("--call-timeout") or None
+        scheduler.hedge = config.getoption("--hedge")
+        scheduler.start_budget(config.getoption("--run-budget"))
+        scheduler.install()
+
+    if config.getoption("--metrics-dir"):
+        # Every xdist worker writes files of its own next to the controller's
+        instrumentation = Instrumentation(config.getoption("--metrics-dir"),
+                                          getattr(config, "workerinput", {}).get("workerid"))
+        scheduler.observers.append(instrumentation.record)
+        config.pluginmanager.register(instrumentation, "instrumentation")
+        config.stash[instrumentation_key] = instrumentation
+
+    # One cache shared across processes per run, assigned once: the sidecar, else the on-disk cache (--inventory-ttl),
+    # else under pytest-xdist the controller's cache for the run. The sidecar re-lists its shards itself, so it does
+    # not take the on-disk cache's options
+    sidecar_path = config.getoption("--inventory-sidecar")
+    persistent = config.getoption("--inventory-ttl") is not None or config.getoption("--inventory-refresh")
+    if sidecar_path and persistent:
+        raise pytest.UsageError("--inventory-sidecar cannot be combined with --inventory-ttl or --inventory-refresh")
+
+    workerinput = getattr(config, "workerinput", None)
+    if workerinput is None and config.pluginmanager.hasplugin("xdist") and config.getoption("numprocesses", None):
+        # Every worker gets the run's start (--inventory-refresh); the run's cache directory only when they list
+        # through it
+        shared = SharedInventory(None if sidecar_path or persistent else tempfile.mkdtemp(prefix="inventory-"))
+        config.pluginmanager.register(shared, "shared_inventory")
+        config.stash[shared_inventory_key] = shared
+
+    cache = None
+    if sidecar_path:
+        # Shared by every process on the machine, xdist workers included
+        cache = SidecarClient(sidecar_path, registry.endpoint)
+    elif persistent:
+        # Locked per shard, so xdist workers use it directly
+        started = workerinput["run_started"] if workerinput and "run_started" in workerinput else time.time()
+        cache = InventoryCache(
+            config.getoption("--inventory-cache-dir") or os.path.join(str(config.rootpath), "reports", "inventory-cache"),
+            ttl=config.getoption("--inventory-ttl"), refresh_since=started if config.getoption("--inventory-refresh") else None,
+            namespace=registry.endpoint or "googleapis")
+        config.stash[inventory_cache_key] = cache
+    elif workerinput is not None and "inventory_cache" in workerinput:
+        cache = InventoryCache(workerinput["inventory_cache"])
+    for service_inventory in (inventory.compute_inventory, inventory.storage_inventory):
+        service_inventory.shared = cache
+        service_inventory.partitioned = workerinput is not None
+
+    if config.getoption("--trace-dir"):
+        trace = TracePlugin(tracer, config.getoption("--trace-dir"))
+        tracer.enabled = True
+        scheduler.observers.append(trace.record_call)
+        config.pluginmanager.register(trace, "trace")
+        config.stash[trace_key] = trace
+
+
+def pytest_ignore_collect(collection_path, config):
+    # Collecting the per-resource suite lists the inventory, so it only runs when asked for
+    if collection_path.name == "test_compute_resources.py" and not config.getoption("--per-resource"):
+        return True
+    return None
+
+
+def pytest_collection_modifyitems(config, items):
+    # Projects rather than test functions are the unit of work handed to xdist workers (--dist loadgroup)
+    if config.pluginmanager.hasplugin("xdist"):
+        group_by_project(items)
+
+
+def pytest_unconfigure(config):
+    instrumentation = config.stash.get(instrumentation_key, None)
+    if instrumentation:
+        scheduler.observers.remove(instrumentation.record)
+    cache = config.stash.get(inventory_cache_key, None)
+    if cache:
+        # Stale shards served during the run are re-listed for the next one before the process exits
+        cache.wait()
+    shared = config.stash.get(shared_inventory_key, None)
+    if shared and shared.directory:
+        shutil.rmtree(shared.directory, ignore_errors=True)
+    trace = config.stash.get(trace_key, None)
+    if trace:
+        scheduler.observers.remove(trace.record_call)
+        tracer.enabled = False
+    scheduler.uninstall()
+    cassette = config.stash.get(cassette_key, None)
+    if cassette:
+        cassette.deactivate()
+    audit_store.close()
+
+
+@pytest.fixture(scope="session", autouse=True)
+def trace_attachment(request):
+    # Attaches the trace to the Allure report while the session is still open
+    yield
+    trace = request.config.stash.get(trace_key, None)
+    if trace:
+        trace.attach()
+
+
+def pytest_terminal_summary(terminalreporter, config):
+    instrumentation = config.stash.get(instrumentation_key, None)
+    if instrumentation:
+        terminalreporter.section("API call metrics")
+        terminalreporter.write_line(f"{len(instrumentation.calls)} API call(s) recorded; summary and Prometheus textfile in {instrumentation.directory}")
+
+    trace = config.stash.get(trace_key, None)
+    if trace:
+        terminalreporter.section("trace")
+        terminalreporter.write_line(f"{len(tracer.spans)} span(s); Chrome trace and folded stacks in {trace.directory}")
+
+    cache = config.stash.get(inventory_cache_key, None)
+    if cache and cache.stats:
+        terminalreporter.section("inventory cache")
+        terminalreporter.write_line(
+            f"{cache.stats['fresh']} shard(s) fresh, {cache.stats['stale']} stale (revalidated in the background), "
+            f"{cache.stats['missed']} listed, in {cache.directory}")
+
+    if audit_store.reverify:
+        terminalreporter.section("re-verification")
+        terminalreporter.write_line(f"{audit_store.rechecked} failure(s) of the last run re-checked, {audit_store.resolved} resolved, "
+                                    f"{audit_store.rechecked - audit_store.resolved} still failing ({audit_store.path})")
+    elif audit_store.enabled:
+        terminalreporter.section("incremental audit")
+        terminalreporter.write_line(f"{audit_store.evaluated} resource(s) evaluated, {audit_store.reused} reused from {audit_store.path}")
+
+    stats = scheduler.stats()
+    if stats:
+        terminalreporter.section("API scheduler")
+        for service, counters in sorted(stats.items()):
+            terminalreporter.write_line(
+                f"{service:<8} {counters.get('calls', 0)} call(s), {counters.get('throttled', 0)} throttled, "
+                f"{counters.get('retried', 0)} retried, {counters.get('failed', 0)} failed, "
+                f"{counters.get('timed_out', 0)} timed out, {counters.get('hedged', 0)} hedged "
+                f"({counters.get('hedge_won', 0)} won), concurrency limit {counters['concurrency']}, "
+                f"p95 {counters['p95'] or 0:.3f}s")
+
+    timings = inventory.shard_timings()
+    if not timings:
+        return
+
+    terminalreporter.section("inventory fetch latency per shard")
+    for timing in sorted(timings, key=lambda t: t.seconds, reverse=True):
+        status = f"FAILED {timing.error}" if timing.error else f"{timing.items} item(s)"
+        terminalreporter.write_line(f"{timing.seconds:8.3f}s  {timing.service:<8} {timing.project_id} / {timing.shard}  {status}")
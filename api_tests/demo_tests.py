@@ -1,31 +1,28 @@
 import allure
 import pytest
-import yaml
 import json
-from google.cloud import storage
+from api_tests import inventory
+from api_tests.clients import registry
+from config.loader import ProjectParams, lazy_config
 
-# Read configuration from the YAML file
-config_path = "/Users/dpkprmr/PycharmProjects/Learning/GCP_Infratests/config/gcs_test_config.yaml"
-with open(config_path, "r") as config_file:
-    config = yaml.safe_load(config_file)
+# Configuration from the YAML file, read on first use (validated once and cached by config.loader)
+config = lazy_config("gcs_test_config.yaml")
+
+# Only bucket names are listed here; the listing asks for nothing else
+BUCKET_NAME_FIELDS = ("name",)
 
 
 # Fixture to fetch GCS Buckets for each project and store them as class attributes
 def list_gcs_buckets(project_id):
-    project = next((p for p in config["projects"] if p["project_id"] == project_id), None)
-    if not project:
-        raise ValueError(f"Project with project_id '{project_id}' not found in the configuration YAML.")
-
-    zone = project.get("zone")
-    if not zone:
-        raise ValueError(f"Zone not specified for project with project_id '{project_id}' in the configuration YAML.")
+    # O(1) lookup; raises ValueError for a project that is not configured
+    config.project(project_id)
 
-    client = storage.Client(project=project_id)
-    buckets = list(client.list_buckets())
-    actual_buckets = []
-    for bucket in buckets:
-        bucket_name = str(bucket).replace("<Bucket: ", "").replace(">", "")
-        actual_buckets.append(bucket_name)
+    if inventory.storage_inventory.streaming:
+        # Only the names are kept while the listing is consumed page by page
+        actual_buckets = [bucket.name for page in inventory.storage_inventory.stream(project_id, BUCKET_NAME_FIELDS) for bucket in page]
+    else:
+        # Bucket names come from the session-wide snapshot, listed concurrently with the other projects
+        actual_buckets = inventory.storage_inventory.snapshot(project_id, BUCKET_NAME_FIELDS).names()
 
     return {"project_id": project_id, "buckets": actual_buckets}
 
@@ -35,6 +32,8 @@ class TestGCS:
 
     @pytest.fixture(scope="class")
     def project_buckets_list(self):
+        if not inventory.storage_inventory.streaming:
+            inventory.storage_inventory.prefetch([p["project_id"] for p in config["projects"]], BUCKET_NAME_FIELDS)
         for project in config["projects"]:
             project_id = project["project_id"]
             zone = project.get("zone")
@@ -48,7 +47,7 @@ class TestGCS:
             return buckets
 
     @allure.story("Verify tags are attached to every GCS Bucket")
-    @pytest.mark.parametrize("project_buckets_list", [(p["project_id"],) for p in config["projects"]], indirect=True)
+    @pytest.mark.parametrize("project_buckets_list", ProjectParams(config), indirect=True)
     @pytest.mark.severity("Medium")
     @allure.severity(allure.severity_level.NORMAL)
     @pytest.mark.smoke("Smoke")
@@ -74,7 +73,7 @@ class TestGCS:
             # print(f"Metadata Json: {bucket_meta_json}")
             # print(test_case_name)
             if bucket == "dp-multi-tenancy-poc-bkt":
-                client = storage.Client()
+                client = registry.storage()
                 current_bucket = client.get_bucket(bucket)
                 print(current_bucket)
                 bucket_config = {
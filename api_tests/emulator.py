@@ -0,0 +1,676 @@
+import argparse
+import base64
+import hashlib
+import json
+import os
+import random
+import re
+import shutil
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlsplit
+
+import yaml
+
+from config.loader import DEFAULT_CONFIG_DIR, config_store
+
+'''
+    ====================
+    Local Compute Engine / Cloud Storage emulator
+
+    Serves the instances and buckets / IAM endpoints the suites call, over plain HTTP, from a
+    synthetic fleet of N projects x M zones x K instances (and K buckets per project). Resources
+    are generated on demand from the templates in config/ (compute_response.json,
+    gcs_single_response.json), deterministically per index, so a fleet of 100k instances costs no
+    memory. Every generated resource satisfies the expectations of the first project in
+    config.yaml, except for the violations drawn at the configured rate.
+
+    Listings are paginated (maxResults / pageToken), honour partial responses (X-Goog-FieldMask /
+    fields) and the "(field != literal) OR ..." filters the query planner pushes down, and every
+    request can be delayed or throttled with a 429.
+
+        python -m api_tests.emulator --projects 10 --zones 3 --instances 1000 --config-out reports/emulator-config
+        pytest api_tests --emulator localhost:8089 --config-dir reports/emulator-config --api-rate 0
+    ====================
+'''
+
+DEFAULT_PORT = 8089
+DEFAULT_PAGE_SIZE = 500  # Compute's default (and maximum) maxResults
+REGIONS = ("europe-west3", "europe-west1", "europe-west4", "us-central1", "us-east1")
+ZONE_SUFFIXES = ("a", "b", "c")
+PROJECT_PREFIX = "emulated"
+INSTANCE_PREFIX = "vm"
+BUCKET_INFIX = "bkt"
+COMPUTE_BASE_URL = "https://www.googleapis.com/compute/v1"
+
+
+'''
+    ============
+    Templates
+    ============
+'''
+def instance_template(path=None):
+    # compute_response.json is a protobuf text dump of one Instance; served as the REST JSON of that Instance
+    from google.cloud import compute_v1
+    from google.protobuf import json_format, text_format
+
+    message = compute_v1.Instance.pb()()
+    with open(path or os.path.join(DEFAULT_CONFIG_DIR, "compute_response.json"), "r") as template_file:
+        text_format.Parse(template_file.read(), message)
+    return json_format.MessageToDict(message)
+
+
+def bucket_template(path=None):
+    # gcs_single_response.json is a bucket configuration report; mapped back onto the JSON API's Bucket resource
+    with open(path or os.path.join(DEFAULT_CONFIG_DIR, "gcs_single_response.json"), "r") as template_file:
+        report = json.load(template_file)
+
+    bucket = {
+        "kind": "storage#bucket",
+        "timeCreated": report.get("Created Date"),
+        "updated": report.get("Created Date"),
+        "location": report.get("Location"),
+        "locationType": report.get("Location Type"),
+        "storageClass": report.get("Default Storage Class"),
+        "labels": report.get("Labels") or {},
+        "versioning": {"enabled": bool(report.get("Object Versioning"))},
+        "billing": {"requesterPays": bool(report.get("Requester Pays"))},
+        "iamConfiguration": report.get("bucket_iam_config") or {},
+        "metageneration": str(report.get("Bucket Meta Generation") or 1),
+    }
+    if report.get("Lifecycle Rules"):
+        bucket["lifecycle"] = {"rule": report["Lifecycle Rules"]}
+    return {key: value for key, value in bucket.items() if value is not None}
+
+
+def expectation_profile(name="config.yaml"):
+    # The *_assertion values of the first configured project; generated instances comply with them
+    project = config_store.load(name).projects[0]
+    return {key: value for key, value in project.items() if key.endswith("_assertion")}
+
+
+'''
+    ============
+    Resource helpers
+    ============
+'''
+def _set_path(resource, path, value):
+    # Copy-on-write assignment of "a/b/c" (None removes the field); lists are assigned element-wise
+    if isinstance(resource, list):
+        return [_set_path(item, path, value) for item in resource]
+    head, _, rest = path.partition("/")
+    resource = dict(resource)
+    if rest:
+        resource[head] = _set_path(resource.get(head) or {}, rest, value)
+    elif value is None:
+        resource.pop(head, None)
+    else:
+        resource[head] = value
+    return resource
+
+
+def _get_path(resource, path):
+    # "scheduling.automaticRestart" in filter syntax
+    for part in path.split("."):
+        if not isinstance(resource, dict):
+            return None
+        resource = resource.get(part)
+    return resource
+
+
+def _other(expected, alternatives):
+    if isinstance(expected, bool):
+        return not expected
+    if isinstance(expected, int):
+        return expected + 1
+    return next(value for value in alternatives if value != expected)
+
+
+def _fingerprint(*parts):
+    return base64.b64encode(hashlib.sha1("/".join(map(str, parts)).encode()).digest()[:8]).decode()
+
+
+def _equality(path, alternatives=()):
+    # (conform, violate) for rules comparing one field with the expectation
+    return (lambda resource, expected: _set_path(resource, path, expected),
+            lambda resource, expected: _set_path(resource, path, _other(expected, alternatives)))
+
+
+def _presence(path, sample):
+    # (conform, violate) for rules checking that a field is set at all
+    return (lambda resource, expected: resource if expected else _set_path(resource, path, None),
+            lambda resource, expected: _set_path(resource, path, None if expected else sample))
+
+
+def _accelerators(count):
+    return [{"acceleratorType": "nvidia-tesla-t4", "acceleratorCount": 1}] * count or None
+
+
+# Compute rule name -> (conform, violate); rules without an entry (zone) are always satisfied
+INSTANCE_SETTINGS = {
+    "tags": _presence("tags", {"items": ["emulated"]}),
+    "labels": _presence("labels", {"environment": "emulated"}),
+    "deletion_protection": _equality("deletionProtection"),
+    "display_device": _equality("displayDevice/enableDisplay"),
+    "no_gpu": (lambda resource, expected: _set_path(resource, "guestAccelerators", _accelerators(expected)),
+               lambda resource, expected: _set_path(resource, "guestAccelerators", _accelerators(expected + 1))),
+    "persistent_boot_disk": _equality("disks/type", ("PERSISTENT", "SCRATCH")),
+    "secure_boot": _equality("shieldedInstanceConfig/enableSecureBoot"),
+    "vtpm": _equality("shieldedInstanceConfig/enableVtpm"),
+    "integrity_monitoring": _equality("shieldedInstanceConfig/enableIntegrityMonitoring"),
+    "vm_provisioning_model": _equality("scheduling/provisioningModel", ("STANDARD", "SPOT")),
+    "on_host_maintenance": _equality("scheduling/onHostMaintenance", ("MIGRATE", "TERMINATE")),
+    "automatic_restart": _equality("scheduling/automaticRestart"),
+}
+
+# Bucket violation name -> violate(bucket)
+BUCKET_VIOLATIONS = {
+    "labels": lambda bucket: _set_path(bucket, "labels", None),
+    "object_versioning": lambda bucket: _set_path(bucket, "versioning/enabled", not bucket["versioning"]["enabled"]),
+    "public_access": lambda bucket: _set_path(bucket, "iamConfiguration/publicAccessPrevention", "inherited"),
+    "access_control": lambda bucket: _set_path(
+        _set_path(_set_path(bucket, "iamConfiguration/uniformBucketLevelAccess", {"enabled": False}),
+                  "iamConfiguration/bucketPolicyOnly", {"enabled": False}),
+        "acl", [{"kind": "storage#bucketAccessControl", "entity": "allUsers", "role": "READER"}]),
+    "location": lambda bucket: _set_path(_set_path(bucket, "location", "US"), "locationType", "multi-region"),
+    "storage_class": lambda bucket: _set_path(bucket, "storageClass", "NEARLINE"),
+}
+# Drawn like the bucket violations, but applied to the bucket's IAM policy
+PUBLIC_IAM = "public_iam"
+
+
+'''
+    ============
+    Partial responses and list filters
+    ============
+'''
+def parse_field_mask(text):
+    # "items/*/instances(name,disks/type),nextPageToken" -> {"items": {"*": {"instances": {...}}}, "nextPageToken": None}
+    # (None selects the whole value)
+    tree, _ = _parse_selection(text, 0)
+    return tree
+
+
+def _parse_selection(text, i):
+    tree = {}
+    while i < len(text):
+        j = i
+        while j < len(text) and text[j] not in ",()":
+            j += 1
+        parts = [part for part in text[i:j].strip().split("/") if part]
+        selection = None
+        if j < len(text) and text[j] == "(":
+            selection, j = _parse_selection(text, j + 1)
+
+        node = tree
+        for part in parts[:-1]:
+            if part in node and node[part] is None:
+                break
+            node = node.setdefault(part, {})
+        else:
+            if parts:
+                last = parts[-1]
+                if selection is None or node.get(last, {}) is None:
+                    node[last] = None
+                else:
+                    node.setdefault(last, {}).update(selection)
+
+        if j < len(text) and text[j] == ")":
+            return tree, j + 1
+        i = j + 1
+    return tree, i
+
+
+def apply_field_mask(value, tree):
+    if tree is None:
+        return value
+    if isinstance(value, list):
+        return [apply_field_mask(item, tree) for item in value]
+    if not isinstance(value, dict):
+        return value
+    selected = {}
+    for key, selection in tree.items():
+        if key == "*":
+            for name, item in value.items():
+                selected[name] = apply_field_mask(item, selection)
+        elif key in value:
+            selected[key] = apply_field_mask(value[key], selection)
+    return selected
+
+
+_FILTER_TERM = re.compile(r'\(\s*([\w.]+)\s*(!=|=)\s*("(?:[^"\\]|\\.)*"|[\w.-]+)\s*\)')
+
+
+def _filter_value(literal):
+    if literal.startswith('"'):
+        return literal[1:-1].replace('\\"', '"')
+    if literal in ("true", "false"):
+        return literal == "true"
+    return int(literal) if literal.lstrip("-").isdigit() else literal
+
+
+def parse_filter(text):
+    # "(a.b != true) OR (c = \"X\")" -> [("a.b", "!=", True), ("c", "=", "X")]; None for anything else
+    # (the emulator then lists everything, a superset the suites re-check client-side anyway)
+    terms = re.split(r"\s+OR\s+", text.strip())
+    parsed = [_FILTER_TERM.fullmatch(term.strip()) for term in terms]
+    if not all(parsed):
+        return None
+    return [(m.group(1), m.group(2), _filter_value(m.group(3))) for m in parsed]
+
+
+def matches_filter(resource, terms):
+    for path, operator, expected in terms:
+        actual = _get_path(resource, path)
+        if actual is None:
+            # The strict reading of the API: an unset field matches neither = nor !=
+            continue
+        if (actual == expected) == (operator == "="):
+            return True
+    return False
+
+
+'''
+    ============
+    Synthetic fleet
+    ============
+'''
+def zones(count):
+    # europe-west3-a, europe-west3-b, europe-west3-c, europe-west1-a, ...
+    return [f"{region}-{suffix}" for region in REGIONS for suffix in ZONE_SUFFIXES][:count]
+
+
+class Fleet:
+
+    def __init__(self, projects=3, zones_per_project=1, instances=100, buckets=10, violation_rate=0.01, seed=0,
+                 profile=None, instance_resource=None, bucket_resource=None):
+        # instances: per project and zone, buckets: per project, violation_rate: chance that any one
+        # resource violates any one rule
+        self.project_ids = [f"{PROJECT_PREFIX}-{i:05d}" for i in range(projects)]
+        self.zones = zones(zones_per_project)
+        if len(self.zones) < zones_per_project:
+            raise ValueError(f"At most {len(self.zones)} zones per project can be emulated")
+        self.instances_per_zone = instances
+        self.buckets_per_project = buckets
+        self.violation_rate = violation_rate
+        self.seed = seed
+        self.profile = expectation_profile() if profile is None else profile
+
+        self._instance_rules = [(name, self.profile[f"{name}_assertion"], violate)
+                                for name, (_, violate) in INSTANCE_SETTINGS.items()
+                                if f"{name}_assertion" in self.profile]
+        baseline = instance_resource or instance_template()
+        for name, (conform, _) in INSTANCE_SETTINGS.items():
+            if f"{name}_assertion" in self.profile:
+                baseline = conform(baseline, self.profile[f"{name}_assertion"])
+        self._instance = baseline
+        self._bucket = bucket_resource or bucket_template()
+        self._known_projects = set(self.project_ids)
+
+    def __contains__(self, project_id):
+        return project_id in self._known_projects
+
+    def _violations(self, key, names):
+        rng = random.Random(f"{self.seed}/{key}")
+        return [name for name in names if rng.random() < self.violation_rate]
+
+    def instance_count(self):
+        return len(self.project_ids) * len(self.zones) * self.instances_per_zone
+
+    def bucket_count(self):
+        return len(self.project_ids) * self.buckets_per_project
+
+    def instance_name(self, index):
+        return f"{INSTANCE_PREFIX}-{index:06d}"
+
+    def instance_index(self, name):
+        match = re.fullmatch(rf"{INSTANCE_PREFIX}-(\d+)", name)
+        index = int(match.group(1)) if match else -1
+        return index if 0 <= index < self.instances_per_zone else None
+
+    def instance(self, project_id, zone, index):
+        key = f"{project_id}/{zone}/{index}"
+        violated = self._violations(key, [name for name, _, _ in self._instance_rules])
+        resource = self._instance
+        for name, expected, violate in self._instance_rules:
+            if name in violated:
+                resource = violate(resource, expected)
+
+        resource = dict(resource)
+        name = self.instance_name(index)
+        zone_url = f"{COMPUTE_BASE_URL}/projects/{project_id}/zones/{zone}"
+        resource.update({
+            "id": str(int(hashlib.sha1(key.encode()).hexdigest()[:15], 16)),
+            "name": name,
+            "zone": zone_url,
+            "selfLink": f"{zone_url}/instances/{name}",
+            "fingerprint": _fingerprint(self.seed, key, *violated),
+        })
+        return resource
+
+    def bucket_name(self, project_id, index):
+        return f"{project_id}-{BUCKET_INFIX}-{index:06d}"
+
+    def parse_bucket_name(self, bucket_name):
+        # -> (project_id, index), or None for a bucket outside the fleet
+        project_id, _, index = bucket_name.rpartition(f"-{BUCKET_INFIX}-")
+        if project_id not in self or not index.isdigit() or int(index) >= self.buckets_per_project:
+            return None
+        return project_id, int(index)
+
+    def _bucket_violations(self, project_id, index):
+        return self._violations(f"{project_id}/bucket/{index}", [*BUCKET_VIOLATIONS, PUBLIC_IAM])
+
+    def bucket(self, project_id, index):
+        violated = self._bucket_violations(project_id, index)
+        resource = self._bucket
+        for name in violated:
+            if name in BUCKET_VIOLATIONS:
+                resource = BUCKET_VIOLATIONS[name](resource)
+
+        resource = dict(resource)
+        name = self.bucket_name(project_id, index)
+        resource.update({
+            "id": name,
+            "name": name,
+            "selfLink": f"https://www.googleapis.com/storage/v1/b/{name}",
+            "projectNumber": str(int(hashlib.sha1(project_id.encode()).hexdigest()[:11], 16)),
+            "etag": _fingerprint(self.seed, project_id, index, *violated),
+        })
+        return resource
+
+    def bucket_policy(self, project_id, index):
+        bindings = [
+            {"role": "roles/storage.legacyBucketOwner", "members": [f"projectOwner:{project_id}"]},
+            {"role": "roles/storage.legacyBucketReader", "members": [f"projectViewer:{project_id}"]},
+        ]
+        if PUBLIC_IAM in self._bucket_violations(project_id, index):
+            bindings.append({"role": "roles/storage.objectViewer", "members": ["allUsers"]})
+        return {"kind": "storage#policy", "resourceId": f"projects/_/buckets/{self.bucket_name(project_id, index)}",
+                "version": 1, "etag": "CAE=", "bindings": bindings}
+
+
+'''
+    ============
+    HTTP front end
+    ============
+'''
+_AGGREGATED = re.compile(r"/compute/v1/projects/([^/]+)/aggregated/instances")
+_ZONE_LIST = re.compile(r"/compute/v1/projects/([^/]+)/zones/([^/]+)/instances")
+_INSTANCE = re.compile(r"/compute/v1/projects/([^/]+)/zones/([^/]+)/instances/([^/]+)")
+_BUCKET_LIST = re.compile(r"/storage/v1/b")
+_BUCKET = re.compile(r"/storage/v1/b/([^/]+)")
+_BUCKET_IAM = re.compile(r"/storage/v1/b/([^/]+)/iam")
+
+
+class _NotFound(Exception):
+    pass
+
+
+def _page(resource, total, token, size, terms):
+    # Scans positions from the page token on and returns ([(position, resource)], next page token)
+    position = int(token) if token and token.isdigit() else 0
+    items = []
+    while position < total and len(items) < size:
+        item = resource(position)
+        if terms is None or matches_filter(item, terms):
+            items.append((position, item))
+        position += 1
+    return items, (str(position) if position < total else None)
+
+
+def _known_project(fleet, project_id):
+    if project_id not in fleet:
+        raise _NotFound(f"The resource 'projects/{project_id}' was not found")
+    return project_id
+
+
+def _known_zone(fleet, zone):
+    if zone not in fleet.zones:
+        raise _NotFound(f"The resource 'zones/{zone}' was not found")
+    return zone
+
+
+def _known_bucket(fleet, bucket_name):
+    parsed = fleet.parse_bucket_name(bucket_name)
+    if parsed is None:
+        raise _NotFound(f"The specified bucket does not exist: {bucket_name}")
+    return parsed
+
+
+def _projected(bucket, query):
+    # ACLs are only part of the full projection
+    if query.get("projection") == "full":
+        return bucket
+    return {key: value for key, value in bucket.items() if key not in ("acl", "defaultObjectAcl")}
+
+
+def _listing(kind, items, token):
+    listing = {"kind": kind, "items": items}
+    if token:
+        listing["nextPageToken"] = token
+    return listing
+
+
+def route(fleet, path, query, page_size=DEFAULT_PAGE_SIZE):
+    # -> (endpoint name, response body) for one GET; raises _NotFound
+    size = min(int(query.get("maxResults") or page_size), page_size)
+    terms = parse_filter(query["filter"]) if query.get("filter") else None
+
+    match = _AGGREGATED.fullmatch(path)
+    if match:
+        project_id = _known_project(fleet, match.group(1))
+        per_zone = fleet.instances_per_zone
+        items, token = _page(lambda p: fleet.instance(project_id, fleet.zones[p // per_zone], p % per_zone),
+                             len(fleet.zones) * per_zone, query.get("pageToken"), size, terms)
+        grouped = {}
+        for position, item in items:
+            grouped.setdefault(f"zones/{fleet.zones[position // per_zone]}", {"instances": []})["instances"].append(item)
+        return "instances.aggregatedList", _listing("compute#instanceAggregatedList", grouped, token)
+
+    match = _ZONE_LIST.fullmatch(path)
+    if match:
+        project_id, zone = _known_project(fleet, match.group(1)), _known_zone(fleet, match.group(2))
+        items, token = _page(lambda p: fleet.instance(project_id, zone, p), fleet.instances_per_zone,
+                             query.get("pageToken"), size, terms)
+        return "instances.list", _listing("compute#instanceList", [item for _, item in items], token)
+
+    match = _INSTANCE.fullmatch(path)
+    if match:
+        project_id, zone = _known_project(fleet, match.group(1)), _known_zone(fleet, match.group(2))
+        index = fleet.instance_index(match.group(3))
+        if index is None:
+            raise _NotFound(f"The resource 'projects/{project_id}/zones/{zone}/instances/{match.group(3)}' was not found")
+        return "instances.get", fleet.instance(project_id, zone, index)
+
+    if _BUCKET_LIST.fullmatch(path):
+        project_id = _known_project(fleet, query.get("project"))
+        items, token = _page(lambda p: _projected(fleet.bucket(project_id, p), query),
+                             fleet.buckets_per_project, query.get("pageToken"), size, terms)
+        return "buckets.list", _listing("storage#buckets", [item for _, item in items], token)
+
+    match = _BUCKET_IAM.fullmatch(path)
+    if match:
+        project_id, index = _known_bucket(fleet, match.group(1))
+        return "buckets.getIamPolicy", fleet.bucket_policy(project_id, index)
+
+    match = _BUCKET.fullmatch(path)
+    if match:
+        project_id, index = _known_bucket(fleet, match.group(1))
+        return "buckets.get", _projected(fleet.bucket(project_id, index), query)
+
+    raise _NotFound(f"No emulated endpoint for {path}")
+
+
+class EmulatorHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive, as with the real endpoints
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        status, body = self.server.emulator.respond(self.path, self.headers)
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=UTF-8")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+
+class Emulator:
+
+    def __init__(self, fleet, host="127.0.0.1", port=0, page_size=DEFAULT_PAGE_SIZE, latency=0.0, jitter=0.0,
+                 throttle_rate=0.0):
+        # latency / jitter: seconds added to every request (jitter uniformly drawn on top),
+        # throttle_rate: share of requests answered with a 429
+        self.fleet = fleet
+        self.host = host
+        self.port = port
+        self.page_size = page_size
+        self.latency = latency
+        self.jitter = jitter
+        self.throttle_rate = throttle_rate
+        self.requests = Counter()  # endpoint ("instances.aggregatedList", "buckets.getIamPolicy", ...) -> requests served
+        self._lock = threading.Lock()
+        self._server = None
+        self._thread = None
+
+    @property
+    def endpoint(self):
+        # host:port, as expected by --emulator
+        return f"{self.host}:{self.port}"
+
+    def delay(self):
+        if self.latency or self.jitter:
+            time.sleep(self.latency + random.uniform(0, self.jitter))
+
+    def throttled(self):
+        return self.throttle_rate > 0 and random.random() < self.throttle_rate
+
+    def count(self, name):
+        with self._lock:
+            self.requests[name] += 1
+
+    def respond(self, url, headers=None):
+        # Serves one GET for url (path and query string) -> (HTTP status, JSON body); used by the HTTP front end
+        # and by in-memory transports alike
+        url = urlsplit(url)
+        query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+
+        self.delay()
+        if self.throttled():
+            self.count("throttled")
+            return 429, {"error": {"code": 429, "message": "Quota exceeded (emulated)",
+                                   "errors": [{"reason": "rateLimitExceeded"}]}}
+        try:
+            name, body = route(self.fleet, unquote(url.path), query, self.page_size)
+        except _NotFound as e:
+            self.count("not_found")
+            return 404, {"error": {"code": 404, "message": str(e), "errors": [{"reason": "notFound"}]}}
+
+        self.count(name)
+        headers = {key.lower(): value for key, value in (headers or {}).items()}
+        mask = headers.get("x-goog-fieldmask") or query.get("fields")
+        return 200, apply_field_mask(body, parse_field_mask(mask)) if mask else body
+
+    def start(self):
+        self._server = ThreadingHTTPServer((self.host, self.port), EmulatorHandler)
+        self._server.daemon_threads = True
+        self._server.emulator = self
+        self.port = self._server.server_address[1]
+        self._thread = threading.Thread(target=self._server.serve_forever, name="gcp-emulator", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._thread.join()
+            self._server = self._thread = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+'''
+    ============
+    Configuration for the emulated fleet
+    ============
+'''
+def write_config(fleet, directory, source_dir=None):
+    # Copies the configuration under source_dir (default: the active config root) into directory and
+    # replaces the project lists of config.yaml / gcs_test_config.yaml with the fleet's projects
+    source_dir = source_dir or config_store.root
+    os.makedirs(directory, exist_ok=True)
+    for name in os.listdir(source_dir):
+        if name.endswith((".yaml", ".json")):
+            shutil.copyfile(os.path.join(source_dir, name), os.path.join(directory, name))
+
+    compute_projects = []
+    for project_id in fleet.project_ids:
+        project = {"project_id": project_id, "zone": fleet.zones[0]}
+        if len(fleet.zones) > 1:
+            project["zones"] = list(fleet.zones)
+        project.update(fleet.profile)
+        if len(fleet.zones) > 1:
+            # A single expected zone cannot hold for a fleet spread over several
+            project.pop("zone_assertion", None)
+        else:
+            project["zone_assertion"] = fleet.zones[0]
+        compute_projects.append(project)
+
+    bucket_profile = config_store.load("gcs_test_config.yaml").projects[0]
+    bucket_projects = [dict({key: value for key, value in bucket_profile.items() if key.endswith("_assertion")},
+                            project_id=project_id, zone=fleet.zones[0])
+                       for project_id in fleet.project_ids]
+
+    for name, projects in (("config.yaml", compute_projects), ("gcs_test_config.yaml", bucket_projects)):
+        with open(os.path.join(directory, name), "w") as config_file:
+            yaml.safe_dump({"projects": projects}, config_file, sort_keys=False)
+    return directory
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m api_tests.emulator",
+                                     description="Serve a synthetic Compute Engine / Cloud Storage fleet over HTTP")
+    parser.add_argument("--projects", type=int, default=3)
+    parser.add_argument("--zones", type=int, default=1, help="Zones per project")
+    parser.add_argument("--instances", type=int, default=100, help="Instances per project and zone")
+    parser.add_argument("--buckets", type=int, default=10, help="Buckets per project")
+    parser.add_argument("--violation-rate", type=float, default=0.01, help="Chance that a resource violates any one rule")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--page-size", type=int, default=DEFAULT_PAGE_SIZE, help="Largest page served per listing request")
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds added to every request")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Up to this many seconds more, drawn per request")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="Share of requests answered with a 429")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--config-out", metavar="DIR", help="Write a configuration directory for the fleet (use with --config-dir)")
+    args = parser.parse_args(argv)
+
+    fleet = Fleet(args.projects, args.zones, args.instances, args.buckets, args.violation_rate, args.seed)
+    if args.config_out:
+        write_config(fleet, args.config_out)
+
+    emulator = Emulator(fleet, args.host, args.port, args.page_size, args.latency, args.jitter, args.throttle_rate)
+    emulator.start()
+    print(f"Emulating {fleet.instance_count()} instance(s) and {fleet.bucket_count()} bucket(s) "
+          f"in {len(fleet.project_ids)} project(s) on {emulator.endpoint}")
+    if args.config_out:
+        print(f"pytest api_tests --emulator {emulator.endpoint} --config-dir {args.config_out} --api-rate 0")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        emulator.stop()
+
+
+if __name__ == "__main__":
+    main()
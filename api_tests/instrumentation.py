@@ -0,0 +1,235 @@
+import json
+import os
+import re
+import threading
+import time
+from collections import defaultdict
+from urllib.parse import urlsplit
+
+import pytest
+
+from api_tests.scheduler import _percentile
+
+'''
+    ====================
+    Per-call latency and throughput instrumentation (--metrics-dir)
+
+    Every Compute Engine / Cloud Storage call finished by the scheduler is recorded with its
+    method, operation, project, zone, page, bytes, latency and attempts. Fixture setups and test
+    bodies are timed separately, so a slow run can be pinned on the network (API calls), the
+    fixtures (listing, evaluation) or the assertions. At session end the plugin writes:
+      - metrics_summary.json: per-operation histograms, p50 / p95 / p99, listings with their page
+        counts, the slowest calls, fixture and test timings,
+      - metrics.prom: the same counters and histograms in the Prometheus text format, for the
+        node_exporter textfile collector.
+    Under pytest-xdist every worker records its own calls and writes its own pair of files,
+    metrics_summary.gw0.json and metrics.gw0.prom, whose series carry a worker="gw0" label, so
+    the collector can read all of them side by side.
+    Calls served from cassettes (--replay) bypass the scheduler and are not recorded.
+    ====================
+'''
+
+SUMMARY_FILE = "metrics_summary.json"
+PROMETHEUS_FILE = "metrics.prom"
+LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)  # seconds
+TOP_SLOW_CALLS = 10
+
+_OPERATIONS = (
+    (re.compile(r"/compute/v1/projects/[^/]+/aggregated/instances$"), "instances.aggregatedList"),
+    (re.compile(r"/compute/v1/projects/[^/]+/zones/[^/]+/instances$"), "instances.list"),
+    (re.compile(r"/compute/v1/projects/[^/]+/zones/[^/]+/instances/[^/]+$"), "instances.get"),
+    (re.compile(r"/storage/v1/b$"), "buckets.list"),
+    (re.compile(r"/storage/v1/b/[^/]+/iam$"), "buckets.getIamPolicy"),
+    (re.compile(r"/storage/v1/b/[^/]+$"), "buckets.get"),
+)
+
+
+def operation(method, url):
+    # "instances.aggregatedList", "buckets.getIamPolicy", ...; other calls are named by method and path
+    path = urlsplit(url).path
+    for pattern, name in _OPERATIONS:
+        if pattern.search(path):
+            return name
+    return f"{method} {path}"
+
+
+def _distribution(values):
+    ordered = sorted(values)
+    return {
+        "count": len(ordered),
+        "sum": round(sum(ordered), 6),
+        "p50": round(_percentile(ordered, 0.50), 6),
+        "p95": round(_percentile(ordered, 0.95), 6),
+        "p99": round(_percentile(ordered, 0.99), 6),
+        "max": round(ordered[-1], 6),
+    }
+
+
+def _histogram(values):
+    # Cumulative counts per upper bound, as in a Prometheus histogram
+    return {str(bound): sum(1 for value in values if value <= bound) for bound in LATENCY_BUCKETS}
+
+
+def _label_value(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(**labels):
+    return ",".join(f'{key}="{_label_value(value)}"' for key, value in labels.items() if value is not None)
+
+
+def worker_file(name, worker):
+    # "metrics.prom" -> "metrics.gw0.prom" for an xdist worker
+    if worker is None:
+        return name
+    stem, extension = os.path.splitext(name)
+    return f"{stem}.{worker}{extension}"
+
+
+class Instrumentation:
+
+    def __init__(self, directory, worker=None):
+        # worker: xdist worker id ("gw0"), None in the controller or without xdist
+        self.directory = directory
+        self.worker = worker
+        self.calls = []  # CallRecord
+        self.fixtures = defaultdict(list)  # fixture name -> setup seconds
+        self.tests = {}  # node id -> seconds spent in the test body
+        self._lock = threading.Lock()
+        self._started = time.perf_counter()
+
+    def record(self, call):
+        # Scheduler observer; called from every fetch worker
+        with self._lock:
+            self.calls.append(call)
+
+    '''
+        ============
+        pytest hooks
+        ============
+    '''
+    @pytest.hookimpl(hookwrapper=True)
+    def pytest_fixture_setup(self, fixturedef, request):
+        # Dependencies are set up before this hook runs, so the time is the fixture's own
+        start = time.perf_counter()
+        yield
+        with self._lock:
+            self.fixtures[fixturedef.argname].append(time.perf_counter() - start)
+
+    @pytest.hookimpl(hookwrapper=True)
+    def pytest_runtest_call(self, item):
+        start = time.perf_counter()
+        yield
+        self.tests[item.nodeid] = time.perf_counter() - start
+
+    def pytest_sessionfinish(self, session):
+        self.write()
+
+    '''
+        ============
+        Summary
+        ============
+    '''
+    def summary(self):
+        with self._lock:
+            calls = list(self.calls)
+            fixtures = {name: list(seconds) for name, seconds in self.fixtures.items()}
+            tests = dict(self.tests)
+
+        by_operation = defaultdict(list)
+        listings = defaultdict(lambda: {"pages": 0, "bytes": 0, "seconds": 0.0})
+        for call in calls:
+            name = operation(call.method, call.url)
+            by_operation[(call.service, name)].append(call)
+            if name.endswith("List") or name.endswith(".list"):
+                listing = listings[(call.service, name, call.project_id, call.zone)]
+                listing["pages"] += 1
+                listing["bytes"] += call.bytes
+                listing["seconds"] += call.seconds
+
+        operations = []
+        for (service, name), records in sorted(by_operation.items()):
+            latencies = [r.seconds for r in records]
+            operations.append({
+                "service": service,
+                "operation": name,
+                "calls": len(records),
+                "retries": sum(r.attempts - 1 for r in records),
+                "errors": sum(1 for r in records if r.error or (r.status or 0) >= 400),
+                "bytes": sum(r.bytes for r in records),
+                "latency": _distribution(latencies),
+                "histogram": _histogram(latencies),
+            })
+
+        slowest = sorted(calls, key=lambda r: r.seconds, reverse=True)[:TOP_SLOW_CALLS]
+        api_seconds = [r.seconds for r in calls]
+        return {
+            "wall_seconds": round(time.perf_counter() - self._started, 3),
+            "api": dict(_distribution(api_seconds), histogram=_histogram(api_seconds)) if api_seconds else None,
+            "operations": operations,
+            "listings": [dict(service=service, operation=name, project_id=project_id, zone=zone,
+                              pages=listing["pages"], bytes=listing["bytes"], seconds=round(listing["seconds"], 6))
+                         for (service, name, project_id, zone), listing in sorted(listings.items(), key=str)],
+            "slowest_calls": [{"operation": operation(r.method, r.url), "url": r.url, "project_id": r.project_id,
+                               "zone": r.zone, "status": r.status, "seconds": round(r.seconds, 6),
+                               "attempts": r.attempts, "bytes": r.bytes, "error": r.error} for r in slowest],
+            "fixtures": {name: _distribution(seconds) for name, seconds in sorted(fixtures.items())},
+            "tests": _distribution(list(tests.values())) if tests else None,
+        }
+
+    def prometheus(self, summary):
+        # Every series carries the xdist worker id, if any, so the workers' files never clash
+        worker = f"{{{_labels(worker=self.worker)}}}" if self.worker else ""
+        operations = [(_labels(service=op["service"], operation=op["operation"], worker=self.worker), op)
+                      for op in summary["operations"]]
+        lines = [
+            "# HELP gcp_api_calls_total Google API calls made by the suites, retries not counted separately.",
+            "# TYPE gcp_api_calls_total counter",
+        ]
+        for labels, op in operations:
+            lines.append(f"gcp_api_calls_total{{{labels}}} {op['calls']}")
+        lines += ["# HELP gcp_api_retries_total Retried attempts of Google API calls.",
+                  "# TYPE gcp_api_retries_total counter"]
+        for labels, op in operations:
+            lines.append(f"gcp_api_retries_total{{{labels}}} {op['retries']}")
+        lines += ["# HELP gcp_api_errors_total Google API calls that failed.",
+                  "# TYPE gcp_api_errors_total counter"]
+        for labels, op in operations:
+            lines.append(f"gcp_api_errors_total{{{labels}}} {op['errors']}")
+        lines += ["# HELP gcp_api_response_bytes_total Response body bytes received from Google APIs.",
+                  "# TYPE gcp_api_response_bytes_total counter"]
+        for labels, op in operations:
+            lines.append(f"gcp_api_response_bytes_total{{{labels}}} {op['bytes']}")
+
+        lines += ["# HELP gcp_api_call_duration_seconds Latency of Google API calls, retries included.",
+                  "# TYPE gcp_api_call_duration_seconds histogram"]
+        for labels, op in operations:
+            for bound, count in op["histogram"].items():
+                lines.append(f'gcp_api_call_duration_seconds_bucket{{{labels},le="{bound}"}} {count}')
+            lines.append(f'gcp_api_call_duration_seconds_bucket{{{labels},le="+Inf"}} {op["calls"]}')
+            lines.append(f"gcp_api_call_duration_seconds_sum{{{labels}}} {op['latency']['sum']}")
+            lines.append(f"gcp_api_call_duration_seconds_count{{{labels}}} {op['calls']}")
+
+        lines += ["# HELP pytest_fixture_setup_seconds_total Time spent setting up each fixture.",
+                  "# TYPE pytest_fixture_setup_seconds_total counter"]
+        for name, distribution in summary["fixtures"].items():
+            lines.append(f"pytest_fixture_setup_seconds_total{{{_labels(fixture=name, worker=self.worker)}}} {distribution['sum']}")
+        lines += ["# HELP pytest_test_call_seconds_total Time spent in test bodies (assertions).",
+                  "# TYPE pytest_test_call_seconds_total counter",
+                  f"pytest_test_call_seconds_total{worker} {summary['tests']['sum'] if summary['tests'] else 0}",
+                  "# HELP pytest_session_seconds Wall time of the test session.",
+                  "# TYPE pytest_session_seconds gauge",
+                  f"pytest_session_seconds{worker} {summary['wall_seconds']}"]
+        return "\n".join(lines) + "\n"
+
+    def write(self):
+        summary = self.summary()
+        os.makedirs(self.directory, exist_ok=True)
+        with open(os.path.join(self.directory, worker_file(SUMMARY_FILE, self.worker)), "w") as summary_file:
+            json.dump(summary, summary_file, indent=2)
+        # Written aside and renamed, so the textfile collector never reads a partial file
+        path = os.path.join(self.directory, worker_file(PROMETHEUS_FILE, self.worker))
+        with open(path + ".tmp", "w") as prometheus_file:
+            prometheus_file.write(self.prometheus(summary))
+        os.replace(path + ".tmp", path)
+        return summary
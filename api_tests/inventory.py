@@ -0,0 +1,556 @@
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from google.api_core import gapic_v1
+from google.api_core.exceptions import NotFound
+from google.cloud import compute_v1
+from google.cloud.storage.retry import DEFAULT_RETRY
+
+from api_tests.cassettes import FIELD_MASK_HEADER
+from api_tests.clients import registry
+from api_tests.scheduler import scheduler
+from api_tests.tracing import tracer
+
+'''
+    ====================
+    Session-wide Compute Engine and Cloud Storage inventory
+
+    Every project is listed once and materialized into an immutable snapshot. The checks in
+    test_compute_engine.py, test_gce.py, test_single_instance.py and test_gcs.py all read from
+    the same snapshots instead of re-listing.
+
+    Fetching fans out over project x zone (Compute) and project x bucket (Storage) on a bounded
+    worker pool, so a full inventory costs roughly the slowest shard instead of the sum of all.
+
+    Listings can be narrowed to a field set (partial responses); snapshots are cached per
+    (project, zones, field set) and a full snapshot serves any field set.
+
+    With streaming enabled (--stream) nothing is materialized: stream() hands out one API page at
+    a time, so peak memory is bounded by the page size rather than by the size of the project.
+
+    Under pytest-xdist the workers share their listings through an on-disk InventoryCache
+    (inventory_cache.py), so each shard is fetched once per run rather than once per worker.
+    ====================
+'''
+
+DEFAULT_MAX_WORKERS = 8
+
+# Latency of one fetched shard, e.g. ("compute", "dev000", "europe-west3-a", 0.41, 12, None)
+ShardTiming = namedtuple("ShardTiming", ["service", "project_id", "shard", "seconds", "items", "error"])
+
+
+def zone_name(zone_url):
+    # "https://.../zones/europe-west3-a" and "zones/europe-west3-a" both become "europe-west3-a"
+    return zone_url.rsplit("/", 1)[-1] if zone_url else zone_url
+
+
+'''
+    ============
+    Bounded fan-out
+    ============
+'''
+def fan_out(service, shards, fetch, max_workers=DEFAULT_MAX_WORKERS):
+    # shards: list of (project_id, shard) pairs; fetch(project_id, shard) returns a list of items.
+    # Returns ({(project_id, shard): items}, [ShardTiming, ...]); the first failing shard is re-raised
+    # once every shard has finished so the timings stay complete.
+    # Workers have their own span stacks, so each shard is traced under the span that fanned out
+    parent = tracer.current()
+
+    def timed_fetch(project_id, shard):
+        start = time.perf_counter()
+        try:
+            with tracer.span(f"{project_id}/{shard}", service, parent=parent):
+                items = fetch(project_id, shard)
+        except Exception as e:
+            return None, e, ShardTiming(service, project_id, shard, time.perf_counter() - start, 0, repr(e))
+        return items, None, ShardTiming(service, project_id, shard, time.perf_counter() - start, len(items), None)
+
+    results, timings, errors = {}, [], []
+    if not shards:
+        return results, timings
+
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(shards)))) as pool:
+        futures = [(key, pool.submit(timed_fetch, *key)) for key in shards]
+        for key, future in futures:
+            items, error, timing = future.result()
+            timings.append(timing)
+            if error is not None:
+                errors.append(error)
+            else:
+                results[key] = items
+
+    if errors:
+        raise errors[0]
+    return results, timings
+
+
+class _InFlight:
+    # Snapshots being listed, so that the inventories list outside their lock without two threads listing the
+    # same snapshot. Called under the inventory's lock
+
+    def __init__(self):
+        self._events = {}
+
+    def claim(self, keys):
+        # Returns (keys the caller now lists, events of the keys other threads are already listing)
+        mine, theirs = [], []
+        for key in dict.fromkeys(keys):
+            if key in self._events:
+                theirs.append(self._events[key])
+            else:
+                self._events[key] = threading.Event()
+                mine.append(key)
+        return mine, theirs
+
+    def done(self, keys):
+        for key in keys:
+            self._events.pop(key).set()
+
+
+'''
+    ============
+    Compute Engine
+    ============
+'''
+class InstanceSnapshot:
+
+    def __init__(self, project_id, instances, zones=None):
+        self._project_id = project_id
+        self._instances = tuple(instances)
+        # Zones this snapshot was listed for; None means the whole project (aggregated listing)
+        self._covered_zones = frozenset(zones) if zones is not None else None
+
+        by_zone = {}
+        for instance in self._instances:
+            by_zone.setdefault(zone_name(instance.zone), []).append(instance)
+        self._by_zone = {zone: tuple(zone_instances) for zone, zone_instances in by_zone.items()}
+
+    @property
+    def project_id(self):
+        return self._project_id
+
+    @property
+    def instances(self):
+        return self._instances
+
+    @property
+    def zones(self):
+        return tuple(sorted(self._by_zone))
+
+    def covers(self, zones):
+        return self._covered_zones is None or (zones is not None and set(zones) <= self._covered_zones)
+
+    def in_zone(self, zone):
+        return self._by_zone.get(zone, ())
+
+    def names(self):
+        return list(dict.fromkeys(instance.name for instance in self._instances))
+
+    def find(self, instance_name, zone=None):
+        candidates = self.in_zone(zone) if zone else self._instances
+        return next((instance for instance in candidates if instance.name == instance_name), None)
+
+    def __iter__(self):
+        return iter(self._instances)
+
+    def __len__(self):
+        return len(self._instances)
+
+    def __repr__(self):
+        return f"InstanceSnapshot(project_id={self._project_id!r}, instances={len(self._instances)})"
+
+
+# Shard key used when a project is listed across all zones at once
+ALL_ZONES = "*"
+
+
+# Partial responses are requested through the X-Goog-FieldMask system parameter (FIELD_MASK_HEADER), the
+# header form of ?fields=, because the generated Compute requests have no field for it. fields=None means full
+# resources.
+
+
+def instance_field_mask(fields, zone):
+    # ("name", "zone") -> "items/*/instances(name,zone),nextPageToken" for the aggregated listing
+    selection = ",".join(fields)
+    if zone == ALL_ZONES:
+        return f"items/*/instances({selection}),nextPageToken"
+    return f"items({selection}),nextPageToken"
+
+
+def _field_mask_metadata(fields, zone):
+    return [(FIELD_MASK_HEADER, instance_field_mask(fields, zone))] if fields else ()
+
+
+def _list_request(project_id, zone, filter_):
+    # filter_: Compute API filter expression evaluated server-side, e.g. "(deletionProtection != true)"
+    if zone == ALL_ZONES:
+        return compute_v1.AggregatedListInstancesRequest(project=project_id, filter=filter_)
+    return compute_v1.ListInstancesRequest(project=project_id, zone=zone, filter=filter_)
+
+
+def list_zone_instances(project_id, zone, fields=None, filter_=None):
+    vm_client = registry.compute_instances()
+    metadata = _field_mask_metadata(fields, zone)
+    request = _list_request(project_id, zone, filter_)
+    # The scheduler retries each request itself while it is installed
+    retry = scheduler.library_retry(gapic_v1.method.DEFAULT)
+
+    if zone == ALL_ZONES:
+        # One aggregated listing covers every zone; the pager follows next_page_token for us
+        instances = []
+        for _, zone_instances in vm_client.aggregated_list(request=request, metadata=metadata, retry=retry):
+            instances.extend(zone_instances.instances)
+        return instances
+
+    return list(vm_client.list(request=request, metadata=metadata, retry=retry))
+
+
+def get_instance(project_id, zone, instance_name, fields=None):
+    # One targeted get; None when the instance no longer exists
+    vm_client = registry.compute_instances()
+    metadata = [(FIELD_MASK_HEADER, ",".join(fields))] if fields else ()
+    try:
+        return vm_client.get(project=project_id, zone=zone, instance=instance_name, metadata=metadata,
+                             retry=scheduler.library_retry(gapic_v1.method.DEFAULT))
+    except NotFound:
+        return None
+
+
+def list_instance_pages(project_id, zone, fields=None, filter_=None):
+    # Same listing as list_zone_instances, one list of instances per API page
+    vm_client = registry.compute_instances()
+    metadata = _field_mask_metadata(fields, zone)
+    request = _list_request(project_id, zone, filter_)
+    # The scheduler retries each request itself while it is installed
+    retry = scheduler.library_retry(gapic_v1.method.DEFAULT)
+
+    if zone == ALL_ZONES:
+        for page in vm_client.aggregated_list(request=request, metadata=metadata, retry=retry).pages:
+            yield [instance for _, zone_instances in page.items.items() for instance in zone_instances.instances]
+        return
+
+    for page in vm_client.list(request=request, metadata=metadata, retry=retry).pages:
+        yield list(page.items)
+
+
+def _timed_pages(service, project_id, shard, pages, timings, lock):
+    # Passes pages through, recording the time spent waiting on the API as one ShardTiming
+    pages = iter(pages)
+    seconds, items = 0.0, 0
+    while True:
+        start = time.perf_counter()
+        page = next(pages, None)
+        seconds += time.perf_counter() - start
+        if page is None:
+            break
+        items += len(page)
+        yield page
+
+    with lock:
+        timings.append(ShardTiming(service, project_id, shard, seconds, items, None))
+
+
+class ComputeInventory:
+
+    def __init__(self, list_instances=list_zone_instances, max_workers=DEFAULT_MAX_WORKERS,
+                 list_pages=list_instance_pages, get=get_instance):
+        self._list_instances = list_instances
+        self._list_pages = list_pages
+        self._get = get
+        self.max_workers = max_workers
+        # When set (--stream), suites consume stream() instead of materializing snapshots
+        self.streaming = False
+        # When set (--violators-only), suites list only candidate violators through server-side filters
+        self.pushdown = False
+        # When set (xdist workers), suites prefetch only their own tests' projects
+        self.partitioned = False
+        # InventoryCache shared with other processes (xdist): each shard is listed once across them
+        self.shared = None
+        self._snapshots = {}  # (project_id, fields, filter_) -> {frozenset of zones, None for all: InstanceSnapshot}
+        self._timings = []
+        self._in_flight = _InFlight()
+        self._lock = threading.Lock()
+
+    @property
+    def timings(self):
+        with self._lock:
+            return list(self._timings)
+
+    def _cached(self, project_id, zones, fields, filter_):
+        # A full snapshot serves every field set and an unfiltered one every filter (a filter only narrows what
+        # is fetched, callers still evaluate what they get); otherwise only the exact listing is served. Any
+        # snapshot listed for the requested zones or more serves them
+        for key in ((None, None), (fields, None), (None, filter_), (fields, filter_)):
+            for snapshot in self._snapshots.get((project_id,) + key, {}).values():
+                if snapshot.covers(zones):
+                    return snapshot
+        return None
+
+    def prefetch(self, projects, fields=None, filter_=None):
+        # projects: iterable of (project_id, zones); zones=None lists the whole project in one shard.
+        # fields: API field paths to request (partial response), None for full resources.
+        # filter_: server-side filter expression, None to list every instance
+        # The lock only guards the snapshots: listings run outside it, and a snapshot another thread is already
+        # listing is waited for, then looked up again
+        fields = tuple(fields) if fields else None
+        projects = list(projects)
+        with tracer.span("compute inventory", "compute", fields=fields, filter=filter_):
+            with self._lock:
+                wanted = {(project_id, frozenset(zones) if zones is not None else None): zones
+                          for project_id, zones in projects if self._cached(project_id, zones, fields, filter_) is None}
+                missing, listing = self._in_flight.claim([key + (fields, filter_) for key in wanted])
+
+            try:
+                shards = []
+                for project_id, zone_set, _, _ in missing:
+                    shards.extend((project_id, zone) for zone in (wanted[(project_id, zone_set)] or [ALL_ZONES]))
+                results, timings = fan_out("compute", shards,
+                                           lambda project_id, zone: self._fetch(project_id, zone, fields, filter_),
+                                           self.max_workers)
+
+                # Merge the zone shards back into one snapshot per project
+                snapshots = {}
+                for project_id, zone_set, _, _ in missing:
+                    zones = wanted[(project_id, zone_set)]
+                    instances = [instance for zone in (zones or [ALL_ZONES]) for instance in results[(project_id, zone)]]
+                    snapshots[(project_id, zone_set)] = InstanceSnapshot(project_id, instances, zones)
+                with self._lock:
+                    for (project_id, zone_set), snapshot in snapshots.items():
+                        self._snapshots.setdefault((project_id, fields, filter_), {})[zone_set] = snapshot
+                    self._timings.extend(timings)
+            finally:
+                with self._lock:
+                    self._in_flight.done(missing)
+
+            for event in listing:
+                event.wait()
+        if listing:
+            # Listed here after all if the other thread's listing failed
+            self.prefetch(projects, fields, filter_)
+
+    def _fetch(self, project_id, zone, fields, filter_):
+        if self.shared is None:
+            return self._list_instances(project_id, zone, fields, filter_)
+        return self.shared.fetch(("compute", project_id, zone, fields, filter_),
+                                 lambda: self._list_instances(project_id, zone, fields, filter_))
+
+    def snapshot(self, project_id, zones=None, fields=None, filter_=None):
+        fields = tuple(fields) if fields else None
+        self.prefetch([(project_id, zones)], fields, filter_)
+        with self._lock:
+            return self._cached(project_id, zones, fields, filter_)
+
+    def get_instances(self, project_id, resources, fields=None):
+        # Targeted gets of "zone/name" resources, fanned out like the listings and never cached.
+        # Returns {resource: Instance, or None when it no longer exists}
+        fields = tuple(fields) if fields else None
+        with tracer.span("compute gets", "compute", instances=len(resources)):
+            results, timings = fan_out("compute", [(project_id, resource) for resource in resources],
+                                       lambda project_id, resource: [self._get(project_id, *resource.split("/", 1), fields)],
+                                       self.max_workers)
+        with self._lock:
+            self._timings.extend(timings)
+        return {resource: items[0] for (_, resource), items in results.items()}
+
+    def stream(self, project_id, zones=None, fields=None, filter_=None):
+        # Yields the project's instances page by page without keeping them; a cached snapshot is served as one page
+        fields = tuple(fields) if fields else None
+        with self._lock:
+            snapshot = self._cached(project_id, zones, fields, filter_)
+        if snapshot is not None:
+            yield list(snapshot)
+            return
+
+        for zone in zones or [ALL_ZONES]:
+            yield from _timed_pages("compute", project_id, zone, self._list_pages(project_id, zone, fields, filter_),
+                                    self._timings, self._lock)
+
+    def clear(self):
+        with self._lock:
+            self._snapshots.clear()
+            self._timings.clear()
+
+
+'''
+    ============
+    Cloud Storage
+    ============
+'''
+class BucketSnapshot:
+
+    def __init__(self, project_id, buckets):
+        self._project_id = project_id
+        self._buckets = tuple(buckets)
+
+    @property
+    def project_id(self):
+        return self._project_id
+
+    @property
+    def buckets(self):
+        return self._buckets
+
+    def names(self):
+        return [bucket.name for bucket in self._buckets]
+
+    def find(self, bucket_name):
+        return next((bucket for bucket in self._buckets if bucket.name == bucket_name), None)
+
+    def __iter__(self):
+        return iter(self._buckets)
+
+    def __len__(self):
+        return len(self._buckets)
+
+    def __repr__(self):
+        return f"BucketSnapshot(project_id={self._project_id!r}, buckets={len(self._buckets)})"
+
+
+# Shard key for a project's bucket listing; per-bucket shards use the bucket name
+BUCKET_LIST = "buckets"
+
+
+def bucket_field_mask(fields):
+    # ("name", "labels") -> "items(name,labels),nextPageToken"; None lists full resources
+    return f"items({','.join(fields)}),nextPageToken" if fields else None
+
+
+def list_project_buckets(project_id, shard=BUCKET_LIST, fields=None):
+    client = registry.storage(project_id)
+    # Full projection so every bucket already carries its ACLs and no per-bucket get is needed
+    return list(client.list_buckets(projection="full", fields=bucket_field_mask(fields),
+                                      retry=scheduler.library_retry(DEFAULT_RETRY)))
+
+
+def list_bucket_pages(project_id, fields=None):
+    # Same listing as list_project_buckets, one list of buckets per API page
+    client = registry.storage(project_id)
+    for page in client.list_buckets(projection="full", fields=bucket_field_mask(fields),
+                                    retry=scheduler.library_retry(DEFAULT_RETRY)).pages:
+        yield list(page)
+
+
+class StorageInventory:
+
+    def __init__(self, list_buckets=list_project_buckets, max_workers=DEFAULT_MAX_WORKERS,
+                 list_pages=list_bucket_pages):
+        self._list_buckets = list_buckets
+        self._list_pages = list_pages
+        self.max_workers = max_workers
+        # When set (--stream), suites consume stream() instead of materializing snapshots
+        self.streaming = False
+        # When set (xdist workers), suites prefetch only their own tests' projects
+        self.partitioned = False
+        # InventoryCache shared with other processes (xdist): each listing is fetched once across them
+        self.shared = None
+        self._snapshots = {}
+        self._timings = []
+        self._in_flight = _InFlight()
+        self._lock = threading.Lock()
+
+    @property
+    def timings(self):
+        with self._lock:
+            return list(self._timings)
+
+    def _cached(self, project_id, fields):
+        # A full snapshot serves every field set; a partial one only the field set it was listed with
+        return self._snapshots.get((project_id, None)) or self._snapshots.get((project_id, fields))
+
+    def prefetch(self, project_ids, fields=None):
+        # fields: bucket field paths to request (partial response), None for full resources
+        # Listed outside the lock, like ComputeInventory.prefetch
+        fields = tuple(fields) if fields else None
+        project_ids = list(project_ids)
+        with tracer.span("storage inventory", "storage", fields=fields):
+            with self._lock:
+                missing, listing = self._in_flight.claim(
+                    [(project_id, fields) for project_id in project_ids if self._cached(project_id, fields) is None])
+
+            try:
+                results, timings = fan_out("storage", [(project_id, BUCKET_LIST) for project_id, _ in missing],
+                                           lambda project_id, shard: self._fetch(project_id, shard, fields),
+                                           self.max_workers)
+                snapshots = {(project_id, fields): BucketSnapshot(project_id, buckets)
+                             for (project_id, _), buckets in results.items()}
+                with self._lock:
+                    self._snapshots.update(snapshots)
+                    self._timings.extend(timings)
+            finally:
+                with self._lock:
+                    self._in_flight.done(missing)
+
+            for event in listing:
+                event.wait()
+        if listing:
+            self.prefetch(project_ids, fields)
+
+    def _fetch(self, project_id, shard, fields):
+        if self.shared is None:
+            return self._list_buckets(project_id, shard, fields)
+        return self.shared.fetch(("storage", project_id, shard, fields, None),
+                                 lambda: self._list_buckets(project_id, shard, fields))
+
+    def snapshot(self, project_id, fields=None):
+        fields = tuple(fields) if fields else None
+        self.prefetch([project_id], fields)
+        with self._lock:
+            return self._cached(project_id, fields)
+
+    def bucket_details(self, project_ids, fetch_details):
+        # Fans fetch_details(bucket) out over project x bucket; returns {project_id: {bucket_name: details}}
+        self.prefetch(project_ids)
+        with self._lock:
+            buckets = {(project_id, bucket.name): bucket for project_id in dict.fromkeys(project_ids)
+                       for bucket in self._snapshots[(project_id, None)]}
+
+        with tracer.span("bucket details", "storage"):
+            results, timings = fan_out("storage", list(buckets), lambda *key: [fetch_details(buckets[key])],
+                                       self.max_workers)
+        with self._lock:
+            self._timings.extend(timings)
+
+        details = {project_id: {} for project_id in project_ids}
+        for (project_id, name), (bucket_details,) in results.items():
+            details[project_id][name] = bucket_details
+        return details
+
+    def stream(self, project_id, fields=None):
+        # Yields the project's buckets page by page without keeping them; a cached snapshot is served as one page
+        fields = tuple(fields) if fields else None
+        with self._lock:
+            snapshot = self._cached(project_id, fields)
+        if snapshot is not None:
+            yield list(snapshot)
+            return
+
+        yield from _timed_pages("storage", project_id, BUCKET_LIST, self._list_pages(project_id, fields),
+                                self._timings, self._lock)
+
+    def stream_bucket_details(self, project_id, fetch_details):
+        # Page-by-page bucket_details(): fetch_details(bucket) fans out over one page at a time.
+        # Yields (bucket_name, details); only the current page's buckets are held.
+        for page in self.stream(project_id):
+            buckets = {(project_id, bucket.name): bucket for bucket in page}
+            results, timings = fan_out("storage", list(buckets), lambda *key: [fetch_details(buckets[key])],
+                                       self.max_workers)
+            with self._lock:
+                self._timings.extend(timings)
+            for (_, name) in buckets:
+                yield name, results[(project_id, name)][0]
+
+    def clear(self):
+        with self._lock:
+            self._snapshots.clear()
+            self._timings.clear()
+
+
+# Process-wide inventories shared by every test module
+compute_inventory = ComputeInventory()
+storage_inventory = StorageInventory()
+
+
+def shard_timings():
+    return compute_inventory.timings + storage_inventory.timings
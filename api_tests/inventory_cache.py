@@ -0,0 +1,227 @@
+import hashlib
+import json
+import os
+import struct
+import threading
+import time
+import zlib
+from collections import Counter
+from contextlib import contextmanager
+
+import pytest
+from google.cloud import compute_v1
+from google.cloud.storage import Bucket
+
+from api_tests.clients import registry
+
+try:
+    import fcntl
+except ImportError:  # no advisory locks (Windows): concurrent workers may both fetch a shard, the result is the same
+    fcntl = None
+
+'''
+    ====================
+    Shared on-disk inventory shards
+
+    One listing shard (service, project, zone / bucket listing, field set, filter) is stored per
+    file, zlib-compressed: Compute Engine instances as length-prefixed protobuf records, Cloud
+    Storage buckets as their JSON resources. Every shard has its own lock file, so when several
+    processes (xdist workers) ask for the same shard the first one lists it and the others block
+    on the lock and read its file; different shards are still fetched in parallel.
+
+    Under pytest-xdist the controller creates one cache directory per run and hands it to every
+    worker (SharedInventory below); the directory is removed when the run ends.
+
+    With --inventory-ttl the cache persists across runs (reports/inventory-cache): a shard younger
+    than the TTL is served without a call, an older one is served as well while a background thread
+    re-lists it for the next run (stale-while-revalidate), and --inventory-refresh lists every
+    shard again. Entries are namespaced by API endpoint, so emulated and real fleets never mix.
+    ====================
+'''
+
+_RECORD = struct.Struct(">I")
+
+
+def encode_instances(instances):
+    return b"".join(_RECORD.pack(len(data)) + data
+                    for data in (compute_v1.Instance.serialize(instance) for instance in instances))
+
+
+def decode_instances(project_id, data):
+    instances, offset = [], 0
+    while offset < len(data):
+        (size,) = _RECORD.unpack_from(data, offset)
+        offset += _RECORD.size
+        instances.append(compute_v1.Instance.deserialize(data[offset:offset + size]))
+        offset += size
+    return instances
+
+
+def encode_buckets(buckets):
+    return json.dumps([bucket._properties for bucket in buckets], separators=(",", ":")).encode("utf-8")
+
+
+def decode_buckets(project_id, data):
+    # Rebuilt the way the client builds listed buckets, bound to the project's shared client
+    client = registry.storage(project_id)
+    buckets = []
+    for resource in json.loads(data):
+        bucket = Bucket(client, resource.get("name"))
+        bucket._set_properties(resource)
+        buckets.append(bucket)
+    return buckets
+
+
+CODECS = {
+    "compute": (encode_instances, decode_instances),
+    "storage": (encode_buckets, decode_buckets),
+}
+
+
+@contextmanager
+def _locked(path):
+    with open(path, "a") as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+class InventoryCache:
+
+    def __init__(self, directory, ttl=None, refresh_since=None, namespace=None):
+        # ttl: seconds a shard is served without re-listing it (None: for as long as the cache exists),
+        # refresh_since: shards written before this time are listed again (--inventory-refresh: the start of
+        # the run, so that xdist workers re-list each shard once between them), namespace: e.g. the API endpoint
+        self.directory = directory
+        self.ttl = ttl
+        self.refresh_since = refresh_since
+        self.namespace = namespace
+        self.stats = Counter()  # "fresh" / "stale" / "missed" / "refreshed" / "refresh_failed" -> shards
+        self._revalidating = {}  # key -> background refresh thread
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, key):
+        # key: (service, project_id, shard, fields, filter_)
+        digest = hashlib.sha1(repr((self.namespace,) + tuple(key)).encode("utf-8")).hexdigest()
+        return os.path.join(self.directory, f"{key[0]}-{digest}")
+
+    def age(self, key):
+        # Seconds since the shard was written, None when it is not cached (or written before refresh_since)
+        try:
+            written = os.stat(self.path(key) + ".bin").st_mtime
+        except FileNotFoundError:
+            return None
+        if self.refresh_since is not None and written < self.refresh_since:
+            return None
+        return time.time() - written
+
+    def read(self, key):
+        # Decoded items of the shard, or None when it is not cached
+        try:
+            with open(self.path(key) + ".bin", "rb") as shard_file:
+                data = shard_file.read()
+        except FileNotFoundError:
+            return None
+        return CODECS[key[0]][1](key[1], zlib.decompress(data))
+
+    def write(self, key, items):
+        # Written aside and renamed, so a reader never sees a partial shard
+        path = self.path(key) + ".bin"
+        with open(path + ".tmp", "wb") as shard_file:
+            shard_file.write(zlib.compress(CODECS[key[0]][0](items), 1))
+        os.replace(path + ".tmp", path)
+
+    def _count(self, outcome):
+        with self._lock:
+            self.stats[outcome] += 1
+
+    def fetch(self, key, fetch):
+        # Items of the shard; fetch() lists it when it is missing (or forced), a stale shard is revalidated
+        with _locked(self.path(key) + ".lock"):
+            age = self.age(key)
+            items = self.read(key) if age is not None else None
+            if items is None:
+                items = fetch()
+                self.write(key, items)
+                self._count("missed")
+                return items
+
+        if self.ttl is not None and age > self.ttl:
+            self._count("stale")
+            self._revalidate(key, fetch)
+        else:
+            self._count("fresh")
+        return items
+
+    def _revalidate(self, key, fetch):
+        with self._lock:
+            if key in self._revalidating:
+                return
+            thread = threading.Thread(target=self._refresh, args=(key, fetch), name="inventory-revalidate", daemon=True)
+            self._revalidating[key] = thread
+            # Started under the lock, so wait() never joins a thread that has not started yet
+            thread.start()
+
+    def _refresh(self, key, fetch):
+        try:
+            with _locked(self.path(key) + ".lock"):
+                # Another process may have re-listed the shard in the meantime
+                age = self.age(key)
+                if age is None or age > self.ttl:
+                    self.write(key, fetch())
+                    self._count("refreshed")
+        except Exception:
+            # The stale shard stays; the next read of it tries again
+            self._count("refresh_failed")
+        finally:
+            # Once this refresh is over, the shard is revalidated again when it next goes stale
+            with self._lock:
+                self._revalidating.pop(key, None)
+
+    def wait(self):
+        # Lets background refreshes finish, so that the next run finds them
+        while True:
+            with self._lock:
+                threads = list(self._revalidating.values())
+            if not threads:
+                return
+            for thread in threads:
+                thread.join()
+
+
+'''
+    ============
+    pytest-xdist integration
+    ============
+'''
+# Fixtures whose parameter is (project_id,): their tests are grouped per project
+PROJECT_FIXTURES = ("project_vm_instances", "project_gcs_buckets", "project_buckets_list")
+
+
+class SharedInventory:
+    # Registered on the xdist controller: one cache directory for the run (None when the workers list through
+    # another cache), passed to every worker
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.started = time.time()  # start of the run, for --inventory-refresh
+
+    def pytest_configure_node(self, node):
+        if self.directory:
+            node.workerinput["inventory_cache"] = self.directory
+        node.workerinput["run_started"] = self.started
+
+
+def group_by_project(items):
+    # With --dist loadgroup every project's tests run on one worker, which lists only that project
+    for item in items:
+        params = getattr(getattr(item, "callspec", None), "params", {})
+        for name in PROJECT_FIXTURES:
+            if name in params:
+                item.add_marker(pytest.mark.xdist_group(params[name][0]))
+                break
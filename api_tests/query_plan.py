@@ -0,0 +1,94 @@
+from collections import namedtuple
+
+from google.cloud import compute_v1
+
+from api_tests.rules import COMPUTE_RULES, active_rules, equals, evaluate, required_fields
+
+'''
+    ====================
+    Query planning for --violators-only runs
+
+    Rules that compare one scalar API field for equality with their expectation are pushed down:
+    their negations are OR-ed into a single Compute API filter, so only candidate violators are
+    listed. The candidates are still evaluated client-side, which keeps the verdicts exact even
+    where the server-side filter is looser than the extractor. When any active rule cannot be
+    pushed down, the project is listed once, unfiltered and narrowed to the fields all its rules
+    read, and every rule is evaluated client-side over that listing: a filtered listing on top of
+    it would only repeat calls.
+
+    The API does not document whether "field != value" matches instances where the field is unset,
+    while the extractors read an unset field as its default. Fields the API returns on every
+    instance, false values included (deletionProtection, scheduling.*, shieldedInstanceConfig.*, see
+    config/compute_response.json), are never unset and are always pushed down. Any other field is
+    only pushed down when an instance without it complies with the rule
+    (display_device_assertion: False); otherwise such instances could be filtered out unseen.
+    ====================
+'''
+
+# Rule name -> API field (filter syntax) the rule's extractor compares with the expectation
+PUSHDOWN_FIELDS = {
+    "deletion_protection": "deletionProtection",
+    "display_device": "displayDevice.enableDisplay",
+    "secure_boot": "shieldedInstanceConfig.enableSecureBoot",
+    "vtpm": "shieldedInstanceConfig.enableVtpm",
+    "integrity_monitoring": "shieldedInstanceConfig.enableIntegrityMonitoring",
+    "vm_provisioning_model": "scheduling.provisioningModel",
+    "on_host_maintenance": "scheduling.onHostMaintenance",
+    "automatic_restart": "scheduling.automaticRestart",
+}
+
+# Filter-syntax prefixes of the fields returned on every listed instance, set or not
+ALWAYS_RETURNED = ("deletionProtection", "scheduling.", "shieldedInstanceConfig.")
+
+# filter: Compute API filter expression listing the candidate violators of the pushed rules (None if no rule
+# was pushed); pushed / client_side: active rules the filter covers / that need the whole project listed
+QueryPlan = namedtuple("QueryPlan", ["filter", "pushed", "client_side"])
+
+
+def _literal(value):
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if isinstance(value, int):
+        return str(value)
+    return '"' + value.replace('"', '\\"') + '"'
+
+
+# An instance as listed with none of the pushed fields set
+_UNSET = compute_v1.Instance()
+
+
+def violation_filter(r, expected):
+    # "(displayDevice.enableDisplay != false)" for display_device_assertion: False; None when not pushable
+    field = PUSHDOWN_FIELDS.get(r.name)
+    if field is None or r.compare is not equals or not isinstance(expected, (bool, int, str)):
+        return None
+    if not field.startswith(ALWAYS_RETURNED) and not r.compare(r.extract(_UNSET), expected):
+        # Instances without the field violate the rule, and the filter might not list them
+        return None
+    return f"({field} != {_literal(expected)})"
+
+
+def plan(project, rules=COMPUTE_RULES):
+    pushed, client_side, filters = [], [], []
+    for r in active_rules(project, rules):
+        expression = violation_filter(r, project[r.key])
+        if expression is None:
+            client_side.append(r)
+        else:
+            pushed.append(r)
+            filters.append(expression)
+    return QueryPlan(" OR ".join(filters) or None, pushed, client_side)
+
+
+def evaluate_planned(project, fetch, rules=COMPUTE_RULES):
+    # fetch(fields, filter_) returns the project's instances for one listing; called at most once. Returns
+    # {rule name: RuleResult}; pushed rules report passed=None, passing instances were never listed.
+    query = plan(project, rules)
+    if query.client_side:
+        active = query.pushed + query.client_side
+        return evaluate(fetch(required_fields(active), None), project, active)
+    if not query.pushed:
+        return {}
+    candidates = fetch(required_fields(query.pushed), query.filter)
+    return {name: result._replace(passed=None)
+            for name, result in evaluate(candidates, project, query.pushed).items()}
@@ -0,0 +1,51 @@
+from collections import defaultdict
+
+from api_tests import inventory
+from api_tests.rules import COMPUTE_RULES, RuleResult, active_rules, required_fields
+
+'''
+    ====================
+    Re-verification of the last run's failures (--reverify-failures)
+
+    The failing (instance, rule) pairs recorded in the audit state by the last --incremental run
+    are the only thing checked: each failing instance is fetched with one targeted get (fanned out
+    over the fetch workers, narrowed to the fields of its failing rules) and only its failing rules
+    are checked again, instance by instance. A remediation check over a dozen VMs out of thousands
+    therefore costs a dozen gets instead of full listings.
+
+    Pairs that pass now, and instances that no longer exist, are removed from the recorded
+    failures, so the next re-verification only checks what is still failing.
+    ====================
+'''
+
+
+def reverify_project(project_id, project, store, rules=COMPUTE_RULES):
+    # {rule name: RuleResult} for the rules that had failures; instances that no longer exist are left out
+    active = {r.name: r for r in active_rules(project, rules)}
+    failing = defaultdict(set)  # rule name -> "zone/name" resources
+    for resource, rule_name in store.load("compute", project_id).failures:
+        if rule_name in active:
+            failing[rule_name].add(resource)
+    if not failing:
+        return {}
+
+    resources = sorted(set().union(*failing.values()))
+    instances = inventory.compute_inventory.get_instances(
+        project_id, resources, required_fields([active[name] for name in failing]))
+
+    results, passed = {}, []
+    for rule_name, rule_resources in sorted(failing.items()):
+        r, expected = active[rule_name], project[active[rule_name].key]
+        # One verdict per "zone/name" resource: instance names are only unique within a zone
+        verdicts = {resource: bool(r.compare(r.extract(instances[resource]), expected))
+                    for resource in sorted(rule_resources) if instances[resource] is not None}
+        passed.extend((resource, rule_name) for resource, ok in verdicts.items() if ok)
+        results[rule_name] = RuleResult(r, expected,
+                                        [instances[resource].name for resource, ok in verdicts.items() if ok],
+                                        [instances[resource].name for resource, ok in verdicts.items() if not ok])
+
+    gone = {resource for resource in resources if instances[resource] is None}
+    store.resolve("compute", project_id, passed, gone)
+    store.rechecked += sum(len(rule_resources) for rule_resources in failing.values())
+    store.resolved += len(passed) + sum(len(rule_resources & gone) for rule_resources in failing.values())
+    return results
@@ -0,0 +1,286 @@
+import hashlib
+from collections import namedtuple
+
+from api_tests.audit_state import instance_fingerprint, instance_resource
+from api_tests.tracing import tracer
+
+try:
+    import numpy as np
+except ImportError:  # columnar evaluation is optional; evaluate() falls back to the row loop
+    np = None
+
+'''
+    ====================
+    Declarative Compute Engine rules
+
+    Every "<name>_assertion" key in config/config.yaml maps to one Rule: a field extractor, a
+    comparator against the configured expectation, and the Allure metadata of the check.
+    evaluate() walks each instance once and applies every active rule to it, so adding a rule
+    adds no extra pass over the fleet. With NumPy installed that single pass only flattens the
+    inventory into columns (bool / count / categorical) and the rules run as vectorized masks.
+    ====================
+'''
+
+# severity: pytest marker / "Severity" label, allure_severity: name in allure.severity_level,
+# kind: column type the extracted values are flattened into (BOOL, COUNT or CATEGORY),
+# fields: API field paths the extractor reads, requested as a partial response
+Rule = namedtuple("Rule", ["name", "key", "story", "title", "failure", "severity", "allure_severity",
+                           "kind", "fields", "extract", "compare"])
+
+RuleResult = namedtuple("RuleResult", ["rule", "expected", "passed", "failed"])
+
+
+def equals(actual, expected):
+    return actual == expected
+
+
+def ends_with(actual, expected):
+    return actual is not None and actual.endswith(expected)
+
+
+BOOL, COUNT, CATEGORY = "bool", "count", "category"
+
+
+def rule(name, story, title, failure, severity, allure_severity, kind, fields, extract, compare=equals):
+    return Rule(name, f"{name}_assertion", story, title, failure, severity, allure_severity, kind, fields, extract,
+                compare)
+
+
+# Read for every instance regardless of the active rules: identity, zone grouping and incremental fingerprints
+BASE_FIELDS = ("name", "zone", "fingerprint", "labelFingerprint")
+
+
+'''
+    ============
+    Field extractors
+    ============
+'''
+def _boot_disk_type(instance):
+    return instance.disks[0].type_ if instance.disks and instance.disks[0].type_ else None
+
+
+def _scheduling(field):
+    return lambda instance: getattr(instance.scheduling, field) if instance.scheduling else None
+
+
+def _shielded(field):
+    return lambda instance: bool(instance.shielded_instance_config and getattr(instance.shielded_instance_config, field))
+
+
+COMPUTE_RULES = (
+    rule("tags", "Verify tags are attached to every Compute Engine VM Resource",
+         "Tags Test Case", "Instances missing required tags", "Medium", "NORMAL", BOOL, ("tags",),
+         lambda instance: bool(instance.tags)),
+    rule("labels", "Verify labels are attached to every Compute Engine VM Resource",
+         "Labels Test Case", "Instances missing required labels", "Medium", "NORMAL", BOOL, ("labels",),
+         lambda instance: bool(instance.labels)),
+    rule("zone", "Verify the zone for every Compute Engine VM Resource is europe-west3-x",
+         "Zone Test Case", "Instances in wrong zones", "Critical", "BLOCKER", CATEGORY, ("zone",),
+         lambda instance: instance.zone, ends_with),
+    rule("deletion_protection", "Verify deletion protection is enabled for every Compute Engine VM Resource",
+         "Deletion Protection Test Case", "Instances with unexpected Deletion Protection", "Medium", "NORMAL", BOOL, ("deletionProtection",),
+         lambda instance: instance.deletion_protection),
+    rule("display_device", "Verify Display Device is disabled for every Compute Engine VM Resource",
+         "Display Device Test Case", "Instances with unexpected Display Device", "Low", "NORMAL", BOOL, ("displayDevice/enableDisplay",),
+         lambda instance: bool(instance.display_device and instance.display_device.enable_display)),
+    rule("no_gpu", "Verify no GPU is assigned to any Compute Engine VM Resource",
+         "No GPU Test Case", "Instances with GPU assigned", "Low", "MINOR", COUNT, ("guestAccelerators",),
+         lambda instance: len(instance.guest_accelerators)),
+    rule("persistent_boot_disk", "Verify Persistent Boot Disk for every Compute Engine VM Resource",
+         "Persistent Boot Disk Test Case", "Instances with Non-Persistent Boot Disk", "High", "CRITICAL", CATEGORY, ("disks/type",),
+         _boot_disk_type),
+    rule("secure_boot", "Verify Secure Boot is enabled for every Compute Engine VM Resource",
+         "Secure Boot Test Case", "Instances with Secure Boot disabled", "High", "CRITICAL", BOOL, ("shieldedInstanceConfig/enableSecureBoot",),
+         _shielded("enable_secure_boot")),
+    rule("vtpm", "Verify vTPM is enabled for every Compute Engine VM Resource",
+         "vTPM Test Case", "Instances with vTPM disabled", "High", "CRITICAL", BOOL, ("shieldedInstanceConfig/enableVtpm",),
+         _shielded("enable_vtpm")),
+    rule("integrity_monitoring", "Verify Integrity Monitoring is enabled for every Compute Engine VM Resource",
+         "Integrity Monitoring Test Case", "Instances with Integrity Monitoring disabled", "High", "CRITICAL", BOOL, ("shieldedInstanceConfig/enableIntegrityMonitoring",),
+         _shielded("enable_integrity_monitoring")),
+    rule("vm_provisioning_model", "Verify VM Provisioning Model for every Compute Engine VM Resource",
+         "VM Provisioning Model Test Case", "Instances with wrong VM Provisioning Model", "Medium", "NORMAL", CATEGORY, ("scheduling/provisioningModel",),
+         _scheduling("provisioning_model")),
+    rule("on_host_maintenance", "Verify On-Host Maintenance for every Compute Engine VM Resource",
+         "On-Host Maintenance Test Case", "Instances with incorrect On-Host Maintenance setting", "Medium", "NORMAL", CATEGORY, ("scheduling/onHostMaintenance",),
+         _scheduling("on_host_maintenance")),
+    rule("automatic_restart", "Verify Automatic Restart for every Compute Engine VM Resource",
+         "Automatic Restart Test Case", "Instances with Automatic Restart disabled", "Medium", "NORMAL", CATEGORY, ("scheduling/automaticRestart",),
+         _scheduling("automatic_restart")),
+)
+
+
+def active_rules(project, rules=COMPUTE_RULES):
+    # A rule is active for a project when its *_assertion key is configured for it
+    return [r for r in rules if r.key in project]
+
+
+def required_fields(rules=COMPUTE_RULES):
+    # Minimal, sorted field set the given rules need, e.g. ("deletionProtection", "fingerprint", ..., "zone")
+    return tuple(sorted(set(BASE_FIELDS).union(*(r.fields for r in rules))))
+
+
+'''
+    ============
+    Columnar evaluation
+    ============
+'''
+class InstanceColumns:
+
+    def __init__(self, instances, rules=COMPUTE_RULES):
+        # The only pass over the proto messages: each rule's field is extracted once per instance
+        instances = tuple(instances)
+        raw = {r.name: [] for r in rules}
+        names = []
+        for instance in instances:
+            names.append(instance.name)
+            for r in rules:
+                raw[r.name].append(r.extract(instance))
+
+        self.names = names
+        self.columns = {r.name: _column(r.kind, raw[r.name]) for r in rules}
+
+    def mask(self, r, expected):
+        # Boolean array, True where the instance satisfies the rule
+        column = self.columns[r.name]
+        if isinstance(column, tuple):
+            # Categorical: compare once per distinct value, then broadcast through the codes
+            codes, categories = column
+            matches = np.array([bool(r.compare(category, expected)) for category in categories], dtype=bool)
+            return matches[codes] if len(categories) else np.zeros(len(codes), dtype=bool)
+        if r.compare is equals:
+            return column == expected
+        return np.array([bool(r.compare(value, expected)) for value in column.tolist()], dtype=bool)
+
+    def __len__(self):
+        return len(self.names)
+
+
+def _column(kind, values):
+    if kind == BOOL:
+        return np.array(values, dtype=bool)
+    if kind == COUNT:
+        return np.array(values, dtype=np.int64)
+    # CATEGORY: (codes, categories); keeps the original values (including None) as categories
+    index = {}
+    codes = np.fromiter((index.setdefault(value, len(index)) for value in values), dtype=np.int32, count=len(values))
+    return codes, list(index)
+
+
+def _masks(instances, checks):
+    # {rule name: per-instance verdicts}, aligned with instances
+    if np is None:
+        # Single pass without NumPy: every instance is visited once and checked against all active rules
+        masks = {r.name: [] for r, _ in checks}
+        for instance in instances:
+            for r, expected in checks:
+                masks[r.name].append(bool(r.compare(r.extract(instance), expected)))
+        return masks
+
+    with tracer.span("extract columns", "rules", instances=len(instances)):
+        columns = InstanceColumns(instances, [r for r, _ in checks])
+    masks = {}
+    for r, expected in checks:
+        # Rules are vectorized over all instances, so the rule is the finest span
+        with tracer.span(r.name, "rules", instances=len(instances)):
+            masks[r.name] = columns.mask(r, expected)
+    return masks
+
+
+def _results(checks, names, masks):
+    if np is None:
+        return {r.name: RuleResult(r, expected,
+                                   [name for name, ok in zip(names, masks[r.name]) if ok],
+                                   [name for name, ok in zip(names, masks[r.name]) if not ok])
+                for r, expected in checks}
+
+    names = np.array(names, dtype=object)
+    results = {}
+    for r, expected in checks:
+        mask = np.asarray(masks[r.name], dtype=bool)
+        results[r.name] = RuleResult(r, expected, names[mask].tolist(), names[~mask].tolist())
+    return results
+
+
+def evaluate(instances, project, rules=COMPUTE_RULES):
+    # Returns {rule name: RuleResult}
+    instances = tuple(instances)
+    checks = [(r, project[r.key]) for r in active_rules(project, rules)]
+    with tracer.span("evaluate", "rules", project_id=project.get("project_id"), rules=len(checks)):
+        return _results(checks, [instance.name for instance in instances], _masks(instances, checks))
+
+
+def evaluate_pages(pages, project, rules=COMPUTE_RULES):
+    # Streaming evaluate(): every page is flattened, evaluated and dropped right away, so only instance
+    # names and per-rule verdicts outlive it
+    checks = [(r, project[r.key]) for r in active_rules(project, rules)]
+    names, parts = [], {r.name: [] for r, _ in checks}
+    for page in pages:
+        page = tuple(page)
+        names.extend(instance.name for instance in page)
+        for name, mask in _masks(page, checks).items():
+            parts[name].append(mask)
+
+    if np is None:
+        masks = {name: [passed for mask in masks for passed in mask] for name, masks in parts.items()}
+    else:
+        masks = {name: np.concatenate(masks) if masks else np.zeros(0, dtype=bool) for name, masks in parts.items()}
+    return _results(checks, names, masks)
+
+
+'''
+    ============
+    Incremental evaluation
+    ============
+'''
+def _code_identity(function):
+    # Bytecode, referenced names, literal constants and closure values: stable across runs,
+    # and different for e.g. _shielded("enable_vtpm") and _shielded("enable_secure_boot")
+    code = function.__code__
+    constants = [c for c in code.co_consts if isinstance(c, (str, int, float, bool, type(None)))]
+    closure = [cell.cell_contents for cell in function.__closure__ or ()]
+    return repr((code.co_code, code.co_names, constants, closure)).encode("utf-8")
+
+
+def signature(r, expected):
+    # Changes whenever the rule's field, comparator, column kind or configured expectation changes
+    digest = hashlib.sha1(repr((r.name, r.kind, expected)).encode("utf-8"))
+    digest.update(_code_identity(r.extract))
+    digest.update(_code_identity(r.compare))
+    return digest.hexdigest()
+
+
+def evaluate_incremental(project_id, instances, project, store, rules=COMPUTE_RULES):
+    # Same result as evaluate(), but the verdicts store recorded for unchanged instances and unchanged
+    # rules are reused: only changed instances (against every rule) and changed rules (against every
+    # instance) are evaluated
+    instances = tuple(instances)
+    checks = [(r, project[r.key]) for r in active_rules(project, rules)]
+    previous = store.load("compute", project_id)
+
+    resources = [instance_resource(instance) for instance in instances]
+    fingerprints = dict(zip(resources, (instance_fingerprint(instance) for instance in instances)))
+    signatures = {r.name: signature(r, expected) for r, expected in checks}
+
+    changed = [i for i, resource in enumerate(resources)
+               if not fingerprints[resource] or previous.fingerprints.get(resource) != fingerprints[resource]]
+    changed_rules = [(r, expected) for r, expected in checks if previous.signatures.get(r.name) != signatures[r.name]]
+    changed_set = set(changed)
+    unchanged = [i for i in range(len(instances)) if i not in changed_set]
+
+    # Previous verdicts for everything else: a recorded pair passed unless it is listed as a failure
+    masks = {r.name: [(resource, r.name) not in previous.failures for resource in resources] for r, _ in checks}
+    failures = set()
+    for subset, subset_checks in ((changed, checks), (unchanged, changed_rules)):
+        if not subset or not subset_checks:
+            continue
+        fresh = _masks([instances[i] for i in subset], subset_checks)
+        for r, _ in subset_checks:
+            for i, passed in zip(subset, fresh[r.name]):
+                masks[r.name][i] = bool(passed)
+                if not passed:
+                    failures.add((resources[i], r.name))
+
+    store.record("compute", project_id, fingerprints, signatures, [resources[i] for i in changed],
+                 [r.name for r, _ in changed_rules], failures)
+    return _results(checks, [instance.name for instance in instances], masks)
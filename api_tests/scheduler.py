@@ -0,0 +1,429 @@
+import random
+import re
+import threading
+import time
+from collections import Counter, defaultdict, deque, namedtuple
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, as_completed, wait
+from urllib.parse import parse_qs, urlsplit
+
+import requests
+from google.auth.transport.requests import AuthorizedSession
+
+from api_tests.cassettes import _service_name
+
+'''
+    ====================
+    Quota-aware scheduling of every Compute Engine / Cloud Storage call
+
+    Every request made through google.auth's AuthorizedSession (the transport of both
+    compute_v1 and storage.Client) passes through one Scheduler:
+      - a token bucket per (API, project) keeps the request rate under the per-project read quota,
+      - an AIMD controller per API grows the number of in-flight requests while responses are fast
+        and healthy and halves it on 429 / 503,
+      - idempotent calls that are throttled, fail with a 5xx or lose their connection are retried
+        with jittered exponential backoff (honouring Retry-After),
+      - every call has a deadline (all attempts included) and every call is cut off once the run
+        budget is spent,
+      - with hedging enabled, an idempotent read still outstanding after the API's observed p95
+        latency gets a duplicate request, and whichever response arrives first is used. The
+        duplicate needs a free concurrency slot and a token, and none is sent while the API is
+        being backed off.
+    ====================
+'''
+
+DEFAULT_RATE = 20.0  # requests per second per (API, project); Compute's default read quota is 1,500 per minute
+DEFAULT_MAX_CONCURRENCY = 8
+DEFAULT_MAX_RETRIES = 5
+LATENCY_TARGET = 2.0  # seconds; slower responses stop the controller from raising concurrency
+BACKOFF_BASE = 0.5
+BACKOFF_CAP = 30.0
+DEFAULT_CALL_TIMEOUT = 60.0  # seconds per call, retries included
+LATENCY_WINDOW = 200  # recent latencies per API the hedging threshold (p95) is computed from
+HEDGE_MIN_SAMPLES = 20
+
+THROTTLE_STATUSES = {429, 503}
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+IDEMPOTENT_METHODS = {"GET", "HEAD", "OPTIONS"}
+
+# Storage bucket / IAM calls carry no project; they share one bucket per API
+NO_PROJECT = "-"
+_PROJECT_PATH = re.compile(r"/projects/([^/]+)")
+_ZONE_PATH = re.compile(r"/zones/([^/]+)")
+
+# One finished call as seen by the observers: attempts includes retries, seconds spans all of them,
+# page_token is set for every page of a listing after the first, bytes is the final response's body size
+CallRecord = namedtuple("CallRecord", ["service", "method", "url", "project_id", "zone", "page_token", "status",
+                                       "seconds", "attempts", "bytes", "error"])
+
+
+class RunBudgetExceeded(RuntimeError):
+    pass
+
+
+def _min_timeout(current, limit):
+    # requests accepts a number or a (connect, read) tuple; a tuple is capped element-wise
+    if isinstance(current, tuple):
+        return tuple(limit if t is None else min(t, limit) for t in current)
+    return limit if current is None else min(current, limit)
+
+
+def _percentile(values, q):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def _project(url, params=None):
+    # /compute/v1/projects/<project>/... or ?project=<project> (bucket listing)
+    match = _PROJECT_PATH.search(urlsplit(url).path)
+    if match:
+        return match.group(1)
+    query = parse_qs(urlsplit(url).query)
+    # params is a dict or, from the Compute REST transport, a list of (name, value) pairs
+    project = dict(params or {}).get("project") or (query.get("project") or [None])[0]
+    return project or NO_PROJECT
+
+
+def _zone(url):
+    match = _ZONE_PATH.search(urlsplit(url).path)
+    return match.group(1) if match else None
+
+
+def _page_token(url, params=None):
+    query = parse_qs(urlsplit(url).query)
+    # params is a dict or, from the Compute REST transport, a list of (name, value) pairs
+    return dict(params or {}).get("pageToken") or (query.get("pageToken") or [None])[0]
+
+
+class TokenBucket:
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.capacity = burst or max(1.0, rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self, deadline=None):
+        # Blocks until a token is available; returns the seconds spent waiting, or None without taking a token
+        # when none is available before deadline (a time.monotonic() value)
+        waited = 0.0
+        while True:
+            with self._lock:
+                self._refill()
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return waited
+                delay = (1 - self._tokens) / self.rate
+                if deadline is not None and self._updated + delay > deadline:
+                    return None
+            time.sleep(delay)
+            waited += delay
+
+    def try_acquire(self):
+        # Takes a token only if one is available right away
+        with self._lock:
+            self._refill()
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return True
+            return False
+
+
+class AIMDLimiter:
+
+    def __init__(self, limit, minimum=1, increase=1.0, decrease=0.5):
+        self.maximum = limit
+        self.minimum = minimum
+        self._limit = float(limit)
+        self._increase = increase
+        self._decrease = decrease
+        self._in_flight = 0
+        self._condition = threading.Condition()
+
+    @property
+    def limit(self):
+        return max(self.minimum, int(self._limit))
+
+    @property
+    def backing_off(self):
+        # Below its maximum: the API pushed back and the limit has not recovered yet
+        return self._limit < self.maximum
+
+    def acquire(self):
+        with self._condition:
+            while self._in_flight >= self.limit:
+                self._condition.wait()
+            self._in_flight += 1
+
+    def try_acquire(self):
+        # Takes a slot only if one is free right away
+        with self._condition:
+            if self._in_flight >= self.limit:
+                return False
+            self._in_flight += 1
+            return True
+
+    def release(self, healthy, throttled):
+        with self._condition:
+            self._in_flight -= 1
+            if throttled:
+                # Multiplicative decrease on quota pushback
+                self._limit = max(self.minimum, self._limit * self._decrease)
+            elif healthy:
+                # Additive increase: roughly +1 per window of successful calls
+                self._limit = min(self.maximum, self._limit + self._increase / max(1.0, self._limit))
+            self._condition.notify_all()
+
+
+class Scheduler:
+
+    def __init__(self, rate=DEFAULT_RATE, max_concurrency=DEFAULT_MAX_CONCURRENCY, max_retries=DEFAULT_MAX_RETRIES,
+                 latency_target=LATENCY_TARGET, call_timeout=DEFAULT_CALL_TIMEOUT, hedge=False):
+        self.rate = rate  # None or 0 disables rate limiting
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.latency_target = latency_target
+        self.call_timeout = call_timeout  # None disables per-call deadlines
+        self.hedge = hedge
+        self._budget_deadline = None
+        self._buckets = {}
+        self._limiters = {}
+        self._latencies = defaultdict(lambda: deque(maxlen=LATENCY_WINDOW))  # API -> recent latencies
+        self._counters = defaultdict(Counter)  # API -> calls / throttled / retried / failed / timed_out / hedged / hedge_won
+        self._hedge_pool = None
+        self._lock = threading.Lock()
+        self._original_request = None
+        self.observers = []  # callables receiving a CallRecord for every finished call
+
+    def start_budget(self, seconds):
+        # Overall run budget; calls made after it is spent raise RunBudgetExceeded. None removes the budget
+        self._budget_deadline = time.monotonic() + seconds if seconds else None
+
+    def _bucket(self, service, project_id):
+        with self._lock:
+            if (service, project_id) not in self._buckets:
+                self._buckets[(service, project_id)] = TokenBucket(self.rate)
+            return self._buckets[(service, project_id)]
+
+    def _limiter(self, service):
+        with self._lock:
+            if service not in self._limiters:
+                self._limiters[service] = AIMDLimiter(self.max_concurrency)
+            return self._limiters[service]
+
+    def _count(self, service, counter):
+        with self._lock:
+            self._counters[service][counter] += 1
+
+    def stats(self):
+        # {API: {"calls": n, "throttled": n, "retried": n, "failed": n, "timed_out": n, "hedged": n, "hedge_won": n,
+        #        "concurrency": current limit, "p95": seconds or None}}
+        with self._lock:
+            return {service: dict(counters,
+                                  concurrency=self._limiters[service].limit if service in self._limiters else None,
+                                  p95=_percentile(self._latencies[service], 0.95) if self._latencies[service] else None)
+                    for service, counters in self._counters.items()}
+
+    def _deadline(self):
+        deadlines = [d for d in (time.monotonic() + self.call_timeout if self.call_timeout else None,
+                                 self._budget_deadline) if d is not None]
+        return min(deadlines) if deadlines else None
+
+    def _remaining(self, deadline):
+        if self._budget_deadline is not None and time.monotonic() >= self._budget_deadline:
+            raise RunBudgetExceeded("The run budget is spent; no further API calls are made")
+        return None if deadline is None else deadline - time.monotonic()
+
+    '''
+        ============
+        Hedged requests
+        ============
+    '''
+    def _hedge_threshold(self, service):
+        with self._lock:
+            latencies = self._latencies[service]
+            return _percentile(latencies, 0.95) if len(latencies) >= HEDGE_MIN_SAMPLES else None
+
+    def _send(self, send, timeout, service, method, bucket, limiter):
+        # The caller holds one limiter slot and one token for the primary request and releases the slot
+        # when this returns; a duplicate takes a slot and a token of its own, and whichever request loses
+        # gives its slot back only once it has actually finished
+        threshold = self._hedge_threshold(service) if self.hedge and method.upper() in IDEMPOTENT_METHODS else None
+        if threshold is None or limiter.backing_off:
+            # No duplicates while the API is pushing back
+            return send(timeout)
+
+        with self._lock:
+            if self._hedge_pool is None:
+                self._hedge_pool = ThreadPoolExecutor(max_workers=4 * self.max_concurrency)
+            pool = self._hedge_pool
+
+        primary = pool.submit(send, timeout)
+        if wait([primary], timeout=threshold, return_when=FIRST_COMPLETED).done:
+            return primary.result()
+
+        # Still outstanding after the observed p95: race a duplicate, but only with capacity to spare
+        if limiter.backing_off or not limiter.try_acquire():
+            return primary.result()
+        if bucket and not bucket.try_acquire():
+            limiter.release(healthy=False, throttled=False)
+            return primary.result()
+        self._count(service, "hedged")
+        backup = pool.submit(send, timeout)
+
+        winner = primary
+        for future in as_completed([primary, backup]):
+            if future.exception() is None:
+                winner = future
+                break
+        loser = backup if winner is primary else primary
+        loser.add_done_callback(lambda future: self._release_loser(future, limiter))
+        if winner is backup:
+            self._count(service, "hedge_won")
+        return winner.result()
+
+    @staticmethod
+    def _release_loser(future, limiter):
+        # The request nobody waits for any more: its slot is freed and its connection returned to the pool
+        response = future.result() if future.exception() is None else None
+        limiter.release(healthy=False, throttled=response is not None and response.status_code in THROTTLE_STATUSES)
+        if response is not None:
+            response.close()
+
+    def _backoff(self, attempt, response):
+        retry_after = response.headers.get("Retry-After") if response is not None else None
+        if retry_after and retry_after.isdigit():
+            return min(BACKOFF_CAP, float(retry_after))
+        # Full jitter keeps retrying workers from synchronizing
+        return random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2 ** attempt))
+
+    '''
+        ============
+        Serving a request
+        ============
+    '''
+    def call(self, send, method, url, params=None):
+        # send(timeout) performs one attempt, bounded by timeout seconds (None: unbounded), and returns a
+        # requests.Response
+        service = _service_name(url)
+        bucket = self._bucket(service, _project(url, params)) if self.rate else None
+        limiter = self._limiter(service)
+        deadline = self._deadline()
+        started = time.perf_counter()
+
+        attempt = 0
+        while True:
+            # Neither a spent run budget nor a deadline that passes before the next rate-limit token waits for one
+            self._remaining(deadline)
+            if bucket and bucket.acquire(deadline) is None:
+                if deadline == self._budget_deadline:
+                    raise RunBudgetExceeded("The run budget is spent before the next rate-limit token; no further API calls are made")
+                error = requests.Timeout(f"Deadline of {self.call_timeout}s exceeded waiting to send {method} {url}")
+                self._count(service, "timed_out")
+                self._observe(service, method, url, params, None, error, started, attempt)
+                raise error
+            limiter.acquire()
+            start = time.perf_counter()
+            response, error = None, None
+            try:
+                timeout = self._remaining(deadline)
+                if timeout is not None and timeout <= 0:
+                    raise requests.Timeout(f"Deadline of {self.call_timeout}s exceeded for {method} {url}")
+                response = self._send(send, timeout, service, method, bucket, limiter)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                error = e
+            finally:
+                latency = time.perf_counter() - start
+                throttled = response is not None and response.status_code in THROTTLE_STATUSES
+                healthy = response is not None and response.status_code < 500 and latency <= self.latency_target
+                limiter.release(healthy and not throttled, throttled)
+
+            self._count(service, "calls")
+            if response is not None:
+                with self._lock:
+                    self._latencies[service].append(latency)
+            if throttled:
+                self._count(service, "throttled")
+            if isinstance(error, requests.Timeout):
+                self._count(service, "timed_out")
+
+            retryable = error is not None or response.status_code in RETRY_STATUSES
+            backoff = self._backoff(attempt + 1, response)
+            # No retry that could not even start before the deadline
+            out_of_time = deadline is not None and time.monotonic() + backoff >= deadline
+            if not retryable or method.upper() not in IDEMPOTENT_METHODS or attempt >= self.max_retries or out_of_time:
+                if error is not None or response.status_code >= 500:
+                    self._count(service, "failed")
+                self._observe(service, method, url, params, response, error, started, attempt + 1)
+                if error is not None:
+                    raise error
+                return response
+
+            attempt += 1
+            self._count(service, "retried")
+            time.sleep(backoff)
+
+    def _observe(self, service, method, url, params, response, error, started, attempts):
+        if not self.observers:
+            return
+        record = CallRecord(service, method.upper(), url, _project(url, params), _zone(url), _page_token(url, params),
+                            response.status_code if response is not None else None, time.perf_counter() - started,
+                            attempts, len(response.content or b"") if response is not None else 0,
+                            repr(error) if error is not None else None)
+        for observer in self.observers:
+            observer(record)
+
+    def _wrap(self, original_request):
+        scheduler = self
+
+        def request(session, method, url, data=None, headers=None, **kwargs):
+            def send(timeout):
+                call_kwargs = kwargs if timeout is None else dict(kwargs, timeout=_min_timeout(kwargs.get("timeout"), timeout))
+                return original_request(session, method, url, data=data, headers=headers, **call_kwargs)
+
+            return scheduler.call(send, method, url, kwargs.get("params"))
+
+        return request
+
+    '''
+        ============
+        Installing / removing the hook
+        ============
+    '''
+    def install(self):
+        if self._original_request is not None:
+            return
+        self._original_request = AuthorizedSession.request
+        AuthorizedSession.request = self._wrap(self._original_request)
+
+    def uninstall(self):
+        if self._original_request is None:
+            return
+        AuthorizedSession.request = self._original_request
+        self._original_request = None
+
+    @property
+    def installed(self):
+        return self._original_request is not None
+
+    def library_retry(self, default):
+        # Retry policy to pass to a client library call: its own default, or none while the scheduler is installed
+        # and retries every attempt itself, so the library's retries never multiply the scheduler's
+        return None if self.installed else default
+
+    def clear(self):
+        with self._lock:
+            self._buckets.clear()
+            self._limiters.clear()
+            self._latencies.clear()
+            self._counters.clear()
+            self._budget_deadline = None
+
+
+# Process-wide scheduler in front of every API call; installed by conftest.py
+scheduler = Scheduler()
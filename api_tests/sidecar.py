@@ -0,0 +1,262 @@
+import argparse
+import json
+import os
+import socket
+import socketserver
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+from api_tests import inventory
+from api_tests.clients import registry
+from api_tests.inventory_cache import CODECS
+from api_tests.scheduler import DEFAULT_RATE, scheduler
+
+'''
+    ====================
+    Local inventory sidecar (--inventory-sidecar)
+
+    A long-lived process that keeps Compute Engine / Cloud Storage listing shards warm and serves
+    them over a Unix socket to every pytest process on the machine:
+
+        python -m api_tests.sidecar --socket reports/inventory.sock
+        pytest api_tests --inventory-sidecar reports/inventory.sock
+
+    The first request for a shard (service, project, zone / bucket listing, field set, filter)
+    lists it upstream; concurrent requests for the same shard wait for that one listing. Known
+    shards are re-listed in the background every --refresh seconds and dropped once nobody asked
+    for them for --idle-expiry seconds, so the upstream calls depend on the refresh interval and
+    not on how many runs read the shards. Shards are kept and sent in the compact form of
+    inventory_cache.py.
+
+    The sidecar lists with its own credentials; the socket is created readable by its owner only.
+    A pytest process that cannot reach the sidecar lists the shard itself.
+
+    Protocol: one JSON line {"key": [endpoint, service, project_id, shard, fields, filter]} per
+    connection, answered by one JSON line {"ok": true, "size": n, "fetched_at": t} followed by n
+    payload bytes, or {"ok": false, "error": "..."}. The endpoint is the API host the shard is
+    listed from ("googleapis" or the emulator's HOST:PORT); a sidecar rejects keys for any endpoint
+    but its own, so a run against an emulator is never served the real fleet, or the other way round.
+    ====================
+'''
+
+DEFAULT_SOCKET = os.path.join("reports", "inventory.sock")
+DEFAULT_REFRESH = 300.0  # seconds between background re-listings of every known shard
+DEFAULT_IDLE_EXPIRY = 3600.0  # seconds a shard is kept warm after it was last requested
+DEFAULT_CLIENT_TIMEOUT = 600.0  # a cold shard of a large project can take minutes to list
+GOOGLE_APIS = "googleapis"  # endpoint of the real APIs in shard keys
+
+
+def _list_shard(key):
+    service, project_id, shard, fields, filter_ = key
+    if service == "compute":
+        return inventory.list_zone_instances(project_id, shard, fields, filter_)
+    return inventory.list_project_buckets(project_id, shard, fields)
+
+
+def _key(raw, endpoint):
+    # JSON has no tuples: the field set comes back as a list. The endpoint is checked, not kept: a sidecar lists
+    # from one endpoint only
+    requested, service, project_id, shard, fields, filter_ = raw
+    if requested != endpoint:
+        raise ValueError(f"This sidecar lists from {endpoint}, not {requested}")
+    if service not in CODECS:
+        raise ValueError(f"Unknown service {service!r}")
+    return service, project_id, shard, tuple(fields) if fields else None, filter_
+
+
+class _Shard:
+    __slots__ = ("payload", "fetched_at", "requested_at", "lock")
+
+    def __init__(self):
+        self.payload = None
+        self.fetched_at = None
+        self.requested_at = time.time()
+        self.lock = threading.Lock()
+
+
+class SidecarHandler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        sidecar = self.server.sidecar
+        try:
+            key = _key(json.loads(self.rfile.readline())["key"], sidecar.endpoint)
+            payload, fetched_at = sidecar.payload(key)
+        except Exception as e:
+            self.wfile.write(json.dumps({"ok": False, "error": repr(e)}).encode("utf-8") + b"\n")
+            return
+        self.wfile.write(json.dumps({"ok": True, "size": len(payload), "fetched_at": fetched_at}).encode("utf-8") + b"\n")
+        self.wfile.write(payload)
+
+
+class Sidecar:
+
+    def __init__(self, path=DEFAULT_SOCKET, refresh=DEFAULT_REFRESH, idle_expiry=DEFAULT_IDLE_EXPIRY,
+                 max_workers=inventory.DEFAULT_MAX_WORKERS, list_shard=_list_shard, endpoint=None):
+        # endpoint: the emulator's HOST:PORT the shards are listed from, None for Google
+        self.path = path
+        self.endpoint = endpoint or GOOGLE_APIS
+        self.refresh = refresh
+        self.idle_expiry = idle_expiry
+        self.max_workers = max_workers
+        self._list_shard = list_shard
+        self._shards = {}  # key -> _Shard
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._server = None
+        self._threads = []
+
+    def _fetch(self, key, shard):
+        items = self._list_shard(key)
+        shard.payload = zlib.compress(CODECS[key[0]][0](items), 1)
+        shard.fetched_at = time.time()
+
+    def payload(self, key):
+        # (compressed shard, time it was listed); lists the shard on first use
+        with self._lock:
+            shard = self._shards.setdefault(key, _Shard())
+            shard.requested_at = time.time()
+        with shard.lock:
+            if shard.payload is None:
+                self._fetch(key, shard)
+            return shard.payload, shard.fetched_at
+
+    def keys(self):
+        with self._lock:
+            return list(self._shards)
+
+    '''
+        ============
+        Background refresh
+        ============
+    '''
+    def _refresh_one(self, key):
+        with self._lock:
+            shard = self._shards.get(key)
+        if shard is None:
+            return
+        try:
+            items = self._list_shard(key)
+        except Exception as e:
+            # The previous listing keeps being served until a refresh succeeds
+            print(f"Refreshing {key} failed: {e!r}")
+            return
+        payload = zlib.compress(CODECS[key[0]][0](items), 1)
+        with shard.lock:
+            shard.payload, shard.fetched_at = payload, time.time()
+
+    def refresh_all(self):
+        now = time.time()
+        with self._lock:
+            for key in [key for key, shard in self._shards.items() if now - shard.requested_at > self.idle_expiry]:
+                del self._shards[key]
+            keys = [key for key, shard in self._shards.items() if shard.payload is not None]
+        with ThreadPoolExecutor(max_workers=max(1, min(self.max_workers, len(keys) or 1))) as pool:
+            list(pool.map(self._refresh_one, keys))
+
+    def _refresh_loop(self):
+        while not self._stopped.wait(self.refresh):
+            self.refresh_all()
+
+    def start(self):
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        # The socket is bound under a restrictive umask, so it is never connectable by other users, not even
+        # before the chmod
+        umask = os.umask(0o177)
+        try:
+            self._server = socketserver.ThreadingUnixStreamServer(self.path, SidecarHandler)
+        finally:
+            os.umask(umask)
+        os.chmod(self.path, 0o600)
+        self._server.daemon_threads = True
+        self._server.sidecar = self
+        self._stopped.clear()
+        self._threads = [threading.Thread(target=self._server.serve_forever, name="inventory-sidecar", daemon=True),
+                         threading.Thread(target=self._refresh_loop, name="inventory-refresh", daemon=True)]
+        for thread in self._threads:
+            thread.start()
+        return self
+
+    def stop(self):
+        if self._server is not None:
+            self._stopped.set()
+            self._server.shutdown()
+            self._server.server_close()
+            for thread in self._threads:
+                thread.join()
+            self._server, self._threads = None, []
+            if os.path.exists(self.path):
+                os.unlink(self.path)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+class SidecarClient:
+    # Same interface as InventoryCache, so ComputeInventory / StorageInventory use it as their shared cache
+
+    def __init__(self, path, endpoint=None, timeout=DEFAULT_CLIENT_TIMEOUT):
+        self.path = path
+        self.endpoint = endpoint or GOOGLE_APIS
+        self.timeout = timeout
+
+    def _request(self, key):
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+            connection.settimeout(self.timeout)
+            connection.connect(self.path)
+            connection.sendall(json.dumps({"key": [self.endpoint] + list(key)}).encode("utf-8") + b"\n")
+            with connection.makefile("rb") as response:
+                header = json.loads(response.readline())
+                if not header["ok"]:
+                    raise RuntimeError(f"Inventory sidecar failed to list {key}: {header['error']}")
+                payload = response.read(header["size"])
+        if len(payload) != header["size"]:
+            raise ConnectionError(f"Inventory sidecar closed the connection while sending {key}")
+        return payload
+
+    def fetch(self, key, fetch):
+        try:
+            payload = self._request(key)
+        except (OSError, ValueError, RuntimeError):
+            # No sidecar running, one for another endpoint, or it could not list the shard: list it here (and
+            # surface any error here)
+            return fetch()
+        return CODECS[key[0]][1](key[1], zlib.decompress(payload))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m api_tests.sidecar",
+                                     description="Serve warm Compute Engine / Cloud Storage inventories over a Unix socket")
+    parser.add_argument("--socket", default=DEFAULT_SOCKET, help="Path of the Unix socket to listen on")
+    parser.add_argument("--refresh", type=float, default=DEFAULT_REFRESH, help="Seconds between background re-listings of every known shard")
+    parser.add_argument("--idle-expiry", type=float, default=DEFAULT_IDLE_EXPIRY, help="Seconds a shard is kept warm after it was last requested")
+    parser.add_argument("--fetch-workers", type=int, default=inventory.DEFAULT_MAX_WORKERS, help="Shards re-listed concurrently")
+    parser.add_argument("--api-rate", type=float, default=DEFAULT_RATE, help="Requests per second allowed per API and project (0 disables rate limiting)")
+    parser.add_argument("--emulator", metavar="HOST:PORT", help="List from a local emulator (python -m api_tests.emulator) instead of Google")
+    args = parser.parse_args(argv)
+
+    registry.endpoint = args.emulator
+    registry.pool_size = args.fetch_workers
+    scheduler.rate = args.api_rate
+    scheduler.max_concurrency = args.fetch_workers
+    scheduler.install()
+
+    sidecar = Sidecar(args.socket, args.refresh, args.idle_expiry, args.fetch_workers, endpoint=args.emulator)
+    sidecar.start()
+    print(f"Serving inventories on {sidecar.path}, refreshed every {sidecar.refresh:g}s")
+    print(f"pytest api_tests --inventory-sidecar {sidecar.path}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        sidecar.stop()
+
+
+if __name__ == "__main__":
+    main()
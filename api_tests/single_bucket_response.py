@@ -1,5 +1,8 @@
 import json
-from google.cloud import storage
+from google.cloud.storage.retry import DEFAULT_RETRY
+from api_tests import inventory
+from api_tests.clients import registry
+from api_tests.scheduler import scheduler
 from datetime import datetime
 import pdb
 
@@ -11,147 +14,177 @@ class DateTimeEncoder(json.JSONEncoder):
         return super(DateTimeEncoder, self).default(obj)
 
 
+def bucket_configuration(bucket, policy):
+    # Builds the configuration dictionary from a bucket resource fetched with projection="full"
+    # (so the legacy ACL is part of the resource) and the bucket's IAM policy
+    bucket_name = bucket.name
+
+    # Create a dictionary to store all configurations
+    bucket_config = {
+        "Requester Pays": bucket.requester_pays,
+        # "Tags": bucket.labels,
+        "Labels": None,
+        "Cloud Console URL": f"https://console.cloud.google.com/storage/browser/{bucket_name}",
+        "gsutil URI": f"gs://{bucket_name}",
+        "Access Control": None,
+        "Object Versioning": bucket.versioning_enabled,
+        "Bucket Meta Generation": bucket.metageneration,
+        "Bucket Data Locations": bucket.data_locations,
+        "Encryption Type": None,
+        "Properties": bucket._properties,
+        "Lifecycle Rules": None,
+        "Policy Roles": None,
+        "Policy Bindings": None,
+        "Authenticated Users": None,
+        "Bucket Retention Policy": bool
+    }
+    '''
+        ============
+        Get Labels
+        ============
+    '''
+    labels = bucket.labels
+    if labels:
+        for k, v in labels.items():
+            bucket_config["Labels"] = []
+            bucket_config["Labels"].append({k: v})
+    else:
+        bucket_config["Labels"] = "No Label Found"
+
+    '''
+        ============
+        Get Access Control Details
+        The full projection already carries the legacy ACL; UBLA-enabled buckets have none
+        ============
+    '''
+    acl_entries = bucket._properties.get("acl")
+    if acl_entries:
+        for acl in acl_entries:
+            bucket_config["Access Control"] = []
+            bucket_config["Access Control"].append({
+                "Entity": acl.get("entity"),
+                "Role": acl.get("role"),
+            })
+    elif not bucket.iam_configuration.uniform_bucket_level_access_enabled:
+        bucket_config["Access Control"] = "ACL Info Not Found"
+
+    '''
+        ============
+        Get Retention Policy
+        ============
+    '''
+    if bucket._properties.get("retentionPolicy"):
+        bucket_config["Bucket Retention Policy"] = True
+    else:
+        bucket_config["Bucket Retention Policy"] = False
+
+    '''
+        ============
+        Get IAM Policy Details
+        ============
+    '''
+    if policy:
+        for p in list(policy):
+            bucket_config["Policy Roles"] = []
+            bucket_config["Policy Roles"].append(p)
+    else:
+        bucket_config["Policy Roles"] = "No Associated Policy Found"
+
+    '''
+        Fetch Authenticated Users of the Bucket
+    '''
+    if policy.authenticated_users():
+        bucket_config["Authenticated Users"] = []
+        for user in policy.authenticated_users():
+            bucket_config["Authenticated Users"].append(user)
+    else:
+        bucket_config["Authenticated Users"] = "No Authenticated Users Found"
+
+    '''
+        Fetch Policy Bindings of the Bucket
+    '''
+    if policy.bindings:
+        for binding in policy.bindings:
+            bucket_config["Policy Bindings"] = []
+            bucket_config["Policy Bindings"].append(binding)
+    else:
+        bucket_config["Policy Bindings"] = "No associated Policy Binding Found"
+
+    '''
+        ============
+        Fetch Encryption Type if it's set
+        ============
+    '''
+    default_kms_key_name = bucket.default_kms_key_name
+
+    bucket_config[
+        "Encryption Type"] = "Google Managed" if default_kms_key_name is None else "Customer Managed" if default_kms_key_name.startswith(
+        "projects/") else f"Not Provided, the value returned is {default_kms_key_name}"
+
+    '''
+        ============
+        Fetch Lifecycle Rules if they are set
+        ============
+    '''
+    lifecycle_rules = bucket.lifecycle_rules
+    if lifecycle_rules:
+        for rule in list(bucket.lifecycle_rules):
+            bucket_config["Lifecycle Rules"] = []
+            bucket_config["Lifecycle Rules"].append({
+                "Action": rule['action'],
+                "Condition": rule['condition'],
+            })
+    else:
+        bucket_config["Lifecycle Rules"] = "Bucket Lifecycle Rules are Missing"
+
+    return bucket_config
+
+
+def _safe_bucket_configuration(bucket):
+    try:
+        # The IAM policy is the only part that genuinely needs a per-bucket request
+        policy = bucket.get_iam_policy(requested_policy_version=3, retry=scheduler.library_retry(DEFAULT_RETRY))
+        return bucket_configuration(bucket, policy)
+
+    except Exception as e:
+        return str(f"Exception in Bucket Config: {e} | at line no. {e.__traceback__.tb_lineno}")
+
+
 def get_bucket_configuration(bucket_name):
     try:
-        # Initialize a client
-        storage_client = storage.Client()
+        # Shared, pooled client from the registry
+        storage_client = registry.storage()
 
-        # Get a reference to the bucket
-        bucket = storage_client.get_bucket(bucket_name)
+        # One request for the bucket including its ACL (full projection), one for its IAM policy
+        bucket = storage_client.bucket(bucket_name)
+        bucket.reload(projection="full", retry=scheduler.library_retry(DEFAULT_RETRY))
         print("====================")
 
-        # Create a dictionary to store all configurations
-        bucket_config = {
-            "Requester Pays": bucket.requester_pays,
-            # "Tags": bucket.labels,
-            "Labels": None,
-            "Cloud Console URL": f"https://console.cloud.google.com/storage/browser/{bucket_name}",
-            "gsutil URI": f"gs://{bucket_name}",
-            "Access Control": None,
-            "Object Versioning": bucket.versioning_enabled,
-            "Bucket Meta Generation": bucket.metageneration,
-            "Bucket Data Locations": bucket.data_locations,
-            "Encryption Type": None,
-            "Properties": bucket._properties,
-            "Lifecycle Rules": None,
-            "Policy Roles": None,
-            "Policy Bindings": None,
-            "Authenticated Users": None,
-            "Bucket Retention Policy": bool
-        }
-        '''
-            ============
-            Get Labels
-            ============
-        '''
-        labels = bucket.labels
-        if labels:
-            for k, v in labels.items():
-                bucket_config["Labels"] = []
-                bucket_config["Labels"].append({k: v})
-        else:
-            bucket_config["Labels"] = "No Label Found"
-
-        '''
-            ============
-            Get Access Control Details
-            Fetch and add Access Control information (if not UBLA-enabled)
-            ============
-        '''
-        try:
-            if bucket.acl:
-                for acl in bucket.acl:
-                    bucket_config["Access Control"] = []
-                    bucket_config["Access Control"].append({
-                        "Entity": acl.entity,
-                        "Role": acl.role,
-                    })
-            else:
-                bucket_config["Access Control"] = "ACL Info Not Found"
-        except Exception as acl_error:
-            if "Cannot get legacy ACL" not in str(acl_error):
-                raise acl_error
-
-        '''
-            ============
-            Get Retention Policy
-            ============
-        '''
-        if bucket._properties.get("retentionPolicy"):
-            bucket_config["Bucket Retention Policy"] = True
-        else:
-            bucket_config["Bucket Retention Policy"] = False
-
-        '''
-            ============
-            Get IAM Policy Details
-            ============
-        '''
-
-        policy = bucket.get_iam_policy(requested_policy_version=3)
-        if policy:
-            for p in list(policy):
-                bucket_config["Policy Roles"] = []
-                bucket_config["Policy Roles"].append(p)
-        else:
-            bucket_config["Policy Roles"] = "No Associated Policy Found"
-
-        '''
-            Fetch Authenticated Users of the Bucket
-        '''
-        if policy.authenticated_users():
-            bucket_config["Authenticated Users"] = []
-            for user in policy.authenticated_users():
-                bucket_config["Authenticated Users"].append(user)
-        else:
-            bucket_config["Authenticated Users"] = "No Authenticated Users Found"
-
-        '''
-            Fetch Policy Bindings of the Bucket
-        '''
-        if policy.bindings:
-            for binding in policy.bindings:
-                bucket_config["Policy Bindings"] = []
-                bucket_config["Policy Bindings"].append(binding)
-        else:
-            bucket_config["Policy Bindings"] = "No associated Policy Binding Found"
-
-        '''
-            ============
-            Fetch Encryption Type if it's set
-            ============
-        '''
-        default_kms_key_name = bucket.default_kms_key_name
-
-        bucket_config[
-            "Encryption Type"] = "Google Managed" if default_kms_key_name is None else "Customer Managed" if default_kms_key_name.startswith(
-            "projects/") else f"Not Provided, the value returned is {default_kms_key_name}"
-
-        '''
-            ============
-            Fetch Lifecycle Rules if they are set
-            ============
-        '''
-        lifecycle_rules = bucket.lifecycle_rules
-        if lifecycle_rules:
-            for rule in list(bucket.lifecycle_rules):
-                bucket_config["Lifecycle Rules"] = []
-                bucket_config["Lifecycle Rules"].append({
-                    "Action": rule['action'],
-                    "Condition": rule['condition'],
-                })
-        else:
-            bucket_config["Lifecycle Rules"] = "Bucket Lifecycle Rules are Missing"
-
-        return bucket_config
-
     except Exception as e:
         return str(f"Exception in Bucket Config: {e} | at line no. {e.__traceback__.tb_lineno}")
 
+    return _safe_bucket_configuration(bucket)
 
-# Sample usage:
-bkt = 'map-qa-testing'
-try:
-    print(get_bucket_configuration(bkt))
-except json.JSONDecodeError as exp:
-    print(str(f"Exception: {exp} | at line no. {exp.__traceback__.tb_lineno} | Exception Message: {exp.msg}"))
+
+def collect_bucket_configurations(project_id):
+    # Bulk variant for a whole project: bucket metadata comes from the (full projection) bucket listing,
+    # so the only per-bucket requests left are the IAM policies, fetched concurrently.
+    # Returns {bucket_name: bucket_config}
+    if inventory.storage_inventory.streaming:
+        return dict(stream_bucket_configurations(project_id))
+    return inventory.storage_inventory.bucket_details([project_id], _safe_bucket_configuration)[project_id]
+
+
+def stream_bucket_configurations(project_id):
+    # --stream variant: yields (bucket_name, bucket_config) one listing page at a time, so only the
+    # current page's Bucket resources are held while their IAM policies are fetched
+    return inventory.storage_inventory.stream_bucket_details(project_id, _safe_bucket_configuration)
+
+
+# Sample usage (python -m api_tests.single_bucket_response); never runs on import, so collecting test_gcs.py makes no API call
+if __name__ == "__main__":
+    bkt = 'map-qa-testing'
+    try:
+        print(get_bucket_configuration(bkt))
+    except json.JSONDecodeError as exp:
+        print(str(f"Exception: {exp} | at line no. {exp.__traceback__.tb_lineno} | Exception Message: {exp.msg}"))
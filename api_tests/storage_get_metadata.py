@@ -17,7 +17,7 @@
 import sys
 
 # [START storage_get_metadata]
-from google.cloud import storage
+from api_tests.clients import registry
 
 
 def blob_metadata(bucket_name, blob_name):
@@ -25,7 +25,7 @@ def blob_metadata(bucket_name, blob_name):
     # bucket_name = 'your-bucket-name'
     # blob_name = 'your-object-name'
 
-    storage_client = storage.Client()
+    storage_client = registry.storage()
     bucket = storage_client.bucket(bucket_name)
 
     # Retrieve a blob, and its metadata, from Google Cloud Storage.
@@ -0,0 +1,113 @@
+import allure
+import pytest
+from api_tests import inventory, rules
+from config.loader import lazy_config
+
+# Configuration from the YAML file, read on first use (validated once and cached by config.loader)
+config = lazy_config("config.yaml")
+
+'''
+    ====================
+    One test case per (rule, VM instance) (--per-resource)
+
+    Test items are generated at collection time from the session-wide inventory snapshot, one per
+    configured rule and listed instance, with stable IDs such as
+        test_secure_boot[dev000/europe-west3-a/cdp-rubix-dev-m]
+    so a single non-compliant VM fails only its own item, --lf reruns only the failing VMs and
+    xdist can spread the checks. The snapshot listed for collection is the one the checks read,
+    so the project is still listed once; verdicts are evaluated once per project and zone.
+    ====================
+'''
+
+
+def rule_fields():
+    # Same field set as test_compute_engine.py, so both suites share one snapshot per project
+    return rules.required_fields([r for r in rules.COMPUTE_RULES if any(r.key in p for p in config["projects"])])
+
+
+def project_alias(project_id, project_ids):
+    # "de0360-pkce-rubix-cl-dev000" -> "dev000", unless another configured project ends the same way
+    alias = project_id.rsplit("-", 1)[-1]
+    return alias if sum(1 for other in project_ids if other.rsplit("-", 1)[-1] == alias) == 1 else project_id
+
+
+def configured_instances(project):
+    # Instances of the project's configured zone(s), in listing order
+    zones = project.get("zones")
+    snapshot = inventory.compute_inventory.snapshot(project["project_id"], zones, rule_fields())
+    return [(zone, snapshot.in_zone(zone)) for zone in zones or [project["zone"]]]
+
+
+'''
+    ============
+    Collection
+    ============
+'''
+def pytest_generate_tests(metafunc):
+    r = getattr(metafunc.function, "rule", None)
+    if r is None:
+        return
+
+    projects = config["projects"]
+    project_ids = [p["project_id"] for p in projects]
+    # Every project is listed concurrently once; the snapshots serve every rule's parametrization
+    inventory.compute_inventory.prefetch([(p["project_id"], p.get("zones")) for p in projects], rule_fields())
+
+    resources, ids = [], []
+    for project in projects:
+        if r.key not in project:
+            continue
+        alias = project_alias(project["project_id"], project_ids)
+        for zone, instances in configured_instances(project):
+            for instance in instances:
+                resources.append((project["project_id"], zone, instance.name))
+                ids.append(f"{alias}/{zone}/{instance.name}")
+    metafunc.parametrize("resource", resources, ids=ids)
+
+
+@pytest.fixture(scope="session")
+def instance_failures():
+    # (project_id, zone) -> {rule name: {failed instance name: actual value}}, evaluated on first use
+    evaluated = {}
+
+    def failures(project_id, zone):
+        if (project_id, zone) not in evaluated:
+            project = config.project(project_id)
+            instances = dict(configured_instances(project))[zone]
+            by_name = {instance.name: instance for instance in instances}
+            evaluated[(project_id, zone)] = {
+                name: {instance_name: result.rule.extract(by_name[instance_name]) for instance_name in result.failed}
+                for name, result in rules.evaluate(instances, project).items()}
+        return evaluated[(project_id, zone)]
+
+    return failures
+
+
+'''
+    ============
+    One test function per rule in rules.COMPUTE_RULES
+    ============
+'''
+def _rule_test(r):
+    @allure.feature("Compute Engine")
+    @allure.story(r.story)
+    @pytest.mark.severity(r.severity)
+    def test(resource, instance_failures):
+        project_id, zone, instance_name = resource
+        allure.dynamic.title(f"{r.title} - {instance_name}")
+        allure.dynamic.severity(getattr(allure.severity_level, r.allure_severity))
+        allure.dynamic.label("Severity", r.severity)
+
+        failed = instance_failures(project_id, zone).get(r.name, {})
+        assert instance_name not in failed, \
+            f"{r.failure}: {instance_name} in {project_id}/{zone} has {failed.get(instance_name)!r}, " \
+            f"expected {config.expectation(project_id, r.key)!r}"
+
+    test.rule = r
+    test.__name__ = test.__qualname__ = f"test_{r.name}"
+    return test
+
+
+for _r in rules.COMPUTE_RULES:
+    globals()[f"test_{_r.name}"] = _rule_test(_r)
+del _r
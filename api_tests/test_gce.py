@@ -1,47 +1,35 @@
 import pytest
-import yaml
-from google.cloud import compute_v1
+from api_tests import inventory
+from api_tests.clients import registry
+from config.loader import load_config
 
 # @pytest.fixture
 def config_file():
-    # Read the configuration from the YAML file
-    with open("/Users/dpkprmr/PycharmProjects/Learning/GCP_Infratests/config/configuration.yaml") as config_file:
-        config = yaml.safe_load(config_file)
-        project_id = config['gce_project_id']
-        zone = config['zone']
-        vm_details = config['vm_details']
+    # Read the configuration from the YAML file (loaded and validated once, then served from cache)
+    config = load_config("configuration.yaml")
+    project_id = config['gce_project_id']
+    zone = config['zone']
+    vm_details = config['vm_details']
     return config, project_id, zone, vm_details
 
 @pytest.fixture
 def gce_client():
-    return compute_v1.InstancesClient()
+    return registry.compute_instances()
 
 
 # Get the Instances List
 def get_gce_vm_details(gce_client):
-    # Test logic to retrieve and compare VM details using the GCE API
-    # Use gce_client.get() or other methods to retrieve VM details
-    client = compute_v1.InstancesClient()
-
-    # Fetch the list of instances
-    instances = client.aggregated_list(project=config_file()[1]).items #config_file()[1] = project_id
-    instance_names = []
-
-    # Process and Get the instance names in a list
-    for zone, zone_instances in instances.items():
-        for instance in zone_instances.instances or []:
-            if instance.name not in instance_names:instance_names.append(instance.name)
-    return instance_names
+    # Instance names come from the session-wide inventory snapshot (one aggregated listing per project)
+    snapshot = inventory.compute_inventory.snapshot(config_file()[1]) #config_file()[1] = project_id
+    return snapshot.names()
 
 # Get VM Details
 def get_vm_details(project_id, zone, instance_name):
-    client = compute_v1.InstancesClient()
-
-    # Construct the instance URL manually
-    instance_url = f'projects/{project_id}/zones/{zone}/instances/{instance_name}'
-
+    # The listing already carries the full instance resource, so no per-instance get() is needed
     try:
-        instance = client.get(project=project_id, zone=zone, instance=instance_name)
+        instance = inventory.compute_inventory.snapshot(project_id).find(instance_name, zone)
+        if instance is None:
+            raise ValueError(f"Instance '{instance_name}' not found in zone '{zone}' of project '{project_id}'")
         return {
             "Instance Zone": instance.zone,
             "Instance Name": instance.name,
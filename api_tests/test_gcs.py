@@ -1,13 +1,12 @@
 import json
 import allure
 import pytest
-import yaml
-from google.cloud import storage
-from api_tests.single_bucket_response import get_bucket_configuration, DateTimeEncoder
+from api_tests import inventory
+from api_tests.single_bucket_response import get_bucket_configuration, collect_bucket_configurations, DateTimeEncoder
+from config.loader import ProjectParams, lazy_config
 
-# Read configuration from the YAML file
-with open("/Users/dpkprmr/PycharmProjects/Learning/GCP_Infratests/config/gcs_test_config.yaml", "r") as config_file:
-    config = yaml.safe_load(config_file)
+# Configuration from the YAML file, read on first use (validated once and cached by config.loader)
+config = lazy_config("gcs_test_config.yaml")
 
 '''
     ====================
@@ -17,19 +16,15 @@ with open("/Users/dpkprmr/PycharmProjects/Learning/GCP_Infratests/config/gcs_tes
 
 
 def fetch_project_gcs_buckets(project_id, zone):
-    # Get the zone for the specific project from the configuration
-    project = next((p for p in config["projects"] if p["project_id"] == project_id), None)
-    if not project:
-        raise ValueError(f"Project with project_id '{project_id}' not found.")
+    # O(1) lookup; raises ValueError for a project that is not configured
+    config.project(project_id)
 
-    zone = project.get("zone", None)
-    if not zone:
-        raise ValueError(f"Zone not specified for project with project_id '{project_id}' in the configuration YAML.")
-    # Initialize the Google Cloud Storage client
-    client = storage.Client(project=project_id)
-
-    # List all GCS buckets in the project
-    buckets = list(client.list_buckets())
+    if inventory.storage_inventory.streaming:
+        # Lazily consumed page by page; nothing but the current page is held
+        buckets = (bucket for page in inventory.storage_inventory.stream(project_id) for bucket in page)
+    else:
+        # List all GCS buckets in the project (served from the session-wide snapshot)
+        buckets = list(inventory.storage_inventory.snapshot(project_id))
 
     return project_id, buckets
 
@@ -40,13 +35,30 @@ def get_bucket_details(bucket_name):
     return bucket_detail
 
 
+def fetch_project_bucket_details(project_id):
+    # Bucket details for every bucket of the project: metadata from the listing, IAM policies fetched concurrently
+    return collect_bucket_configurations(project_id)
+
+
 @allure.feature("Google Cloud Storage")
 class TestGCS:
     @pytest.fixture(scope="class")
     def project_gcs_buckets(self, request):
+        # Only the parametrized project is served; without a parameter every configured project is
+        requested = {request.param[0]} if hasattr(request, "param") else None
+
+        if not inventory.storage_inventory.streaming:
+            # List every configured project concurrently up front; later parametrizations hit the cache.
+            # An xdist worker lists only its own projects, the other workers list theirs.
+            partitioned = inventory.storage_inventory.partitioned and requested is not None
+            inventory.storage_inventory.prefetch([p["project_id"] for p in config["projects"]
+                                                  if not partitioned or p["project_id"] in requested])
+
         buckets_list = []
         for project in config["projects"]:
             project_id = project["project_id"]
+            if requested is not None and project_id not in requested:
+                continue
             zone = project.get("zone", None)
             if not zone:
                 raise ValueError(
@@ -57,7 +69,7 @@ class TestGCS:
         return buckets_list
 
     @allure.story("Verify labels are attached to every GCS Bucket Resource")
-    @pytest.mark.parametrize("project_gcs_buckets", [(p["project_id"],) for p in config["projects"]], indirect=True)
+    @pytest.mark.parametrize("project_gcs_buckets", ProjectParams(config), indirect=True)
     @pytest.mark.severity("Medium")
     @allure.severity(allure.severity_level.NORMAL)
     @pytest.mark.smoke("Smoke")
@@ -70,13 +82,14 @@ class TestGCS:
         #         continue
         #
         #     missing_labels_buckets = []  # Buckets missing required labels
+        #     bucket_details = fetch_project_bucket_details(project_id)
         #
         #     for bucket in buckets:
         #         test_case_name = f"Labels Test Case - {project_id}"
         #         allure.dynamic.title(test_case_name)
         #
         #         assert_value = next(p["labels_assertion"] for p in config["projects"] if p["project_id"] == project_id)
-        #         labels = get_bucket_details(bucket)['Labels']
+        #         labels = bucket_details[bucket.name]['Labels']
         #         label_value = labels != "No Label Found"
         #         assert_result = label_value == assert_value
         #
@@ -97,4 +110,4 @@ class TestGCS:
         #
         #     # Raise an assertion error if any bucket failed the assertion
         #     assert all([(labels != "No Label Found") == assert_value for labels in
-        #                 [get_bucket_details(bucket)['Labels'] for bucket in buckets]]), title
+        #                 [bucket_details[bucket.name]['Labels'] for bucket in buckets]]), title
@@ -1,27 +1,24 @@
 import allure
 import pytest
-import yaml
-from google.cloud import compute_v1
+from api_tests import inventory
 import pdb
+from config.loader import ProjectParams, lazy_config
 
-# Read configuration from the YAML file
-with open("/Users/dpkprmr/PycharmProjects/Learning/GCP_Infratests/config/config.yaml", "r") as config_file:
-    config = yaml.safe_load(config_file)
+# Configuration from the YAML file, read on first use (validated once and cached by config.loader)
+config = lazy_config("config.yaml")
 
 
 # Fixture to fetch VM instances for each project and store them as class attributes
 def fetch_project_vm_instances(project_id, zone):
-    # Get the zone for the specific project from the configuration
-    project = next((p for p in config["projects"] if p["project_id"] == project_id), None)
-    if not project:
-        raise ValueError(f"Project with project_id '{project_id}' not found in the configuration YAML.")
+    # O(1) lookup; project_id and zone are validated when the file is loaded
+    project = config.project(project_id)
+    zone = project["zone"]
 
-    zone = project.get("zone", None)
-    if not zone:
-        raise ValueError(f"Zone not specified for project with project_id '{project_id}' in the configuration YAML.")
-
-    vm_client = compute_v1.InstancesClient()
-    instances = vm_client.list(project=project_id, zone=zone)
+    # Served from the session-wide snapshot; the project is listed at most once per run.
+    # An optional "zones" list shards the listing per zone instead of one aggregated call.
+    zones = project.get("zones")
+    snapshot = inventory.compute_inventory.snapshot(project_id, zones)
+    instances = tuple(instance for listed_zone in (zones or [zone]) for instance in snapshot.in_zone(listed_zone))
 
     return project_id, instances
 
@@ -31,9 +28,19 @@ class TestComputeEngine:
 
     @pytest.fixture(scope="class")
     def project_vm_instances(self, request):
+        # Only the parametrized project is served; without a parameter every configured project is
+        requested = {request.param[0]} if hasattr(request, "param") else None
+
+        # List every configured project concurrently up front; later parametrizations hit the cache
+        partitioned = inventory.compute_inventory.partitioned and requested is not None
+        inventory.compute_inventory.prefetch([(p["project_id"], p.get("zones")) for p in config["projects"]
+                                              if not partitioned or p["project_id"] in requested])
+
         instances_list = []
         for project in config["projects"]:
             project_id = project["project_id"]
+            if requested is not None and project_id not in requested:
+                continue
             zone = project.get("zone", None)
             if not zone:
                 raise ValueError(
@@ -46,7 +53,7 @@ class TestComputeEngine:
 
     # Not getting response
     # @allure.story("Verify Confidential VM Service is disabled for every Compute Engine VM Resource")
-    # @pytest.mark.parametrize("project_vm_instances", [(p["project_id"],) for p in config["projects"]], indirect=True)
+    # @pytest.mark.parametrize("project_vm_instances", ProjectParams(config), indirect=True)
     # def test_confidential_vm_service_disabled(self, project_vm_instances):
     #     for project_id, instances in project_vm_instances:
     #         if not instances:
@@ -77,7 +84,7 @@ class TestComputeEngine:
 
 #     ===============
     @allure.story("Verify tags are attached to every Compute Engine VM Resource")
-    @pytest.mark.parametrize("project_vm_instances", [(p["project_id"],) for p in config["projects"]], indirect=True)
+    @pytest.mark.parametrize("project_vm_instances", ProjectParams(config), indirect=True)
     def test_tags_attached(self, project_vm_instances):
         for project_id, instances in project_vm_instances:
             if not instances:
@@ -89,7 +96,7 @@ class TestComputeEngine:
                 test_case_name = f"{project_id} - Tags Test Case"
                 allure.dynamic.title(test_case_name)
 
-                assert_value = next(p["tags_assertion"] for p in config["projects"] if p["project_id"] == project_id)
+                assert_value = config.expectation(project_id, "tags_assertion")
                 tags = instance.tags.items if instance.tags else None
                 assert_result = (tags is not None) == assert_value
 
@@ -113,7 +120,7 @@ class TestComputeEngine:
                         [instance.tags.items if instance.tags else None for instance in instances]]), title
 
     @allure.story("Verify labels are attached to every Compute Engine VM Resource")
-    @pytest.mark.parametrize("project_vm_instances", [(p["project_id"],) for p in config["projects"]], indirect=True)
+    @pytest.mark.parametrize("project_vm_instances", ProjectParams(config), indirect=True)
     def test_labels_attached(self, project_vm_instances):
         for project_id, instances in project_vm_instances:
             if not instances:
@@ -125,7 +132,7 @@ class TestComputeEngine:
                 test_case_name = f"{project_id} - Labels Test Case"
                 allure.dynamic.title(test_case_name)
 
-                assert_value = next(p["labels_assertion"] for p in config["projects"] if p["project_id"] == project_id)
+                assert_value = config.expectation(project_id, "labels_assertion")
                 labels = instance.labels.items if instance.labels else None
                 assert_result = (labels is not None) == assert_value
 
@@ -149,7 +156,7 @@ class TestComputeEngine:
                         [instance.labels.items if instance.labels else None for instance in instances]]), title
 
     @allure.story("Verify the zone for every Compute Engine VM Resource is europe-west3-x")
-    @pytest.mark.parametrize("project_vm_instances", [(p["project_id"],) for p in config["projects"]], indirect=True)
+    @pytest.mark.parametrize("project_vm_instances", ProjectParams(config), indirect=True)
     def test_zone_europe_west3_x(self, project_vm_instances):
         for project_id, instances in project_vm_instances:
             if not instances:
@@ -161,12 +168,7 @@ class TestComputeEngine:
                 test_case_name = f"{project_id} - Zone Test Case"
                 allure.dynamic.title(test_case_name)
 
-                zone_assertion = next(
-                    (p["zone_assertion"] for p in config["projects"] if p["project_id"] == project_id), None)
-
-                if zone_assertion is None:
-                    raise ValueError(
-                        f"Zone assertion not found for project_id '{project_id}' in the configuration YAML.")
+                zone_assertion = config.expectation(project_id, "zone_assertion")
 
                 assert_result = instance.zone.endswith(zone_assertion)
 
@@ -190,7 +192,7 @@ class TestComputeEngine:
 
 
     @allure.story("Verify deletion protection is enabled for every Compute Engine VM Resource")
-    @pytest.mark.parametrize("project_vm_instances", [(p["project_id"],) for p in config["projects"]], indirect=True)
+    @pytest.mark.parametrize("project_vm_instances", ProjectParams(config), indirect=True)
     def test_deletion_protection_enabled(self, project_vm_instances):
         for project_id, instances in project_vm_instances:
             if not instances:
@@ -203,8 +205,7 @@ class TestComputeEngine:
                 test_case_name = f"{project_id} - Deletion Protection Test Case"
                 allure.dynamic.title(test_case_name)
 
-                assert_value = next(
-                    p["deletion_protection_assertion"] for p in config["projects"] if p["project_id"] == project_id)
+                assert_value = config.expectation(project_id, "deletion_protection_assertion")
                 deletion_protection = instance.deletion_protection
                 assert_result = deletion_protection == assert_value
 
@@ -230,7 +231,7 @@ class TestComputeEngine:
                     f"All instances have Deletion Protection enabled: Instance(s) Names: {passed_instances}")
 
     @allure.story("Verify Display Device is disabled for every Compute Engine VM Resource")
-    @pytest.mark.parametrize("project_vm_instances", [(p["project_id"],) for p in config["projects"]], indirect=True)
+    @pytest.mark.parametrize("project_vm_instances", ProjectParams(config), indirect=True)
     def test_display_device_disabled(self, project_vm_instances):
         for project_id, instances in project_vm_instances:
             if not instances:
@@ -243,8 +244,7 @@ class TestComputeEngine:
                 test_case_name = f"{project_id} - Display Device Test Case"
                 allure.dynamic.title(test_case_name)
 
-                assert_value = next(
-                    p["display_device_assertion"] for p in config["projects"] if p["project_id"] == project_id)
+                assert_value = config.expectation(project_id, "display_device_assertion")
                 display_device = instance.display_device
                 assert_result = not display_device == assert_value
 
@@ -270,7 +270,7 @@ class TestComputeEngine:
             assert all([not instance.display_device for instance in instances]), title
 
     @allure.story("Verify no GPU is assigned to any Compute Engine VM Resource")
-    @pytest.mark.parametrize("project_vm_instances", [(p["project_id"],) for p in config["projects"]], indirect=True)
+    @pytest.mark.parametrize("project_vm_instances", ProjectParams(config), indirect=True)
     def test_no_gpu_assigned(self, project_vm_instances):
         for project_id, instances in project_vm_instances:
             if not instances:
@@ -283,7 +283,7 @@ class TestComputeEngine:
                 test_case_name = f"{project_id} - No GPU Test Case"
                 allure.dynamic.title(test_case_name)
 
-                assert_value = next(p["no_gpu_assertion"] for p in config["projects"] if p["project_id"] == project_id)
+                assert_value = config.expectation(project_id, "no_gpu_assertion")
                 gpu_count = len(instance.guest_accelerators)
                 assert_result = gpu_count == assert_value
 
@@ -310,7 +310,7 @@ class TestComputeEngine:
                 [gpu_count == 0 for gpu_count in [len(instance.guest_accelerators) for instance in instances]]), title
 
     @allure.story("Verify Persistent Boot Disk for every Compute Engine VM Resource")
-    @pytest.mark.parametrize("project_vm_instances", [(p["project_id"],) for p in config["projects"]], indirect=True)
+    @pytest.mark.parametrize("project_vm_instances", ProjectParams(config), indirect=True)
     def test_persistent_boot_disk(self, project_vm_instances):
         for project_id, instances in project_vm_instances:
             if not instances:
@@ -322,8 +322,7 @@ class TestComputeEngine:
                 test_case_name = f"{project_id} - Persistent Boot Disk Test Case"
                 allure.dynamic.title(test_case_name)
 
-                assert_value = next(
-                    p["persistent_boot_disk_assertion"] for p in config["projects"] if p["project_id"] == project_id)
+                assert_value = config.expectation(project_id, "persistent_boot_disk_assertion")
                 boot_disk_type = instance.disks[0].type_ if instance.disks and instance.disks[0].type_ else None
 
                 assert_result = boot_disk_type == assert_value
@@ -348,7 +347,7 @@ class TestComputeEngine:
                 instance.disks[0].type_ if instance.disks and instance.disks[0].type_ else None for instance in instances]]), title
 
     @allure.story("Verify Secure Boot is enabled for every Compute Engine VM Resource")
-    @pytest.mark.parametrize("project_vm_instances", [(p["project_id"],) for p in config["projects"]], indirect=True)
+    @pytest.mark.parametrize("project_vm_instances", ProjectParams(config), indirect=True)
     def test_secure_boot(self, project_vm_instances):
         for project_id, instances in project_vm_instances:
             if not instances:
@@ -360,8 +359,7 @@ class TestComputeEngine:
                 test_case_name = f"{project_id} - Secure Boot Test Case"
                 allure.dynamic.title(test_case_name)
 
-                assert_value = next(
-                    p["secure_boot_assertion"] for p in config["projects"] if p["project_id"] == project_id)
+                assert_value = config.expectation(project_id, "secure_boot_assertion")
                 secure_boot = instance.shielded_instance_config.enable_secure_boot
 
                 assert_result = secure_boot == assert_value
@@ -385,7 +383,7 @@ class TestComputeEngine:
             assert all([secure_boot for secure_boot in [instance.shielded_instance_config.enable_secure_boot for instance in instances]]), title
 
     @allure.story("Verify vTPM is enabled for every Compute Engine VM Resource")
-    @pytest.mark.parametrize("project_vm_instances", [(p["project_id"],) for p in config["projects"]], indirect=True)
+    @pytest.mark.parametrize("project_vm_instances", ProjectParams(config), indirect=True)
     def test_vtpm(self, project_vm_instances):
         for project_id, instances in project_vm_instances:
             if not instances:
@@ -397,7 +395,7 @@ class TestComputeEngine:
                 test_case_name = f"{project_id} - vTPM Test Case"
                 allure.dynamic.title(test_case_name)
 
-                assert_value = next(p["vtpm_assertion"] for p in config["projects"] if p["project_id"] == project_id)
+                assert_value = config.expectation(project_id, "vtpm_assertion")
                 vtpm_enabled = instance.shielded_instance_config.enable_vtpm if instance.shielded_instance_config and instance.shielded_instance_config.enable_vtpm else None
 
                 assert_result = vtpm_enabled == assert_value
@@ -423,7 +421,7 @@ class TestComputeEngine:
                 for instance in instances]]), title
 
     @allure.story("Verify Integrity Monitoring is enabled for every Compute Engine VM Resource")
-    @pytest.mark.parametrize("project_vm_instances", [(p["project_id"],) for p in config["projects"]], indirect=True)
+    @pytest.mark.parametrize("project_vm_instances", ProjectParams(config), indirect=True)
     def test_integrity_monitoring(self, project_vm_instances):
         for project_id, instances in project_vm_instances:
             if not instances:
@@ -435,8 +433,7 @@ class TestComputeEngine:
                 test_case_name = f"{project_id} - Integrity Monitoring Test Case"
                 allure.dynamic.title(test_case_name)
 
-                assert_value = next(
-                    p["integrity_monitoring_assertion"] for p in config["projects"] if p["project_id"] == project_id)
+                assert_value = config.expectation(project_id, "integrity_monitoring_assertion")
                 integrity_monitoring_enabled = instance.shielded_instance_config.enable_integrity_monitoring #if instance.virtual_machine and instance.shielded_instance_config.enable_integrity_monitoring else None
 
                 assert_result = integrity_monitoring_enabled == assert_value
@@ -464,7 +461,7 @@ class TestComputeEngine:
                 for instance in instances]]), title
 
     @allure.story("Verify VM Provisioning Model for every Compute Engine VM Resource")
-    @pytest.mark.parametrize("project_vm_instances", [(p["project_id"],) for p in config["projects"]], indirect=True)
+    @pytest.mark.parametrize("project_vm_instances", ProjectParams(config), indirect=True)
     def test_vm_provisioning_model(self, project_vm_instances):
         for project_id, instances in project_vm_instances:
             if not instances:
@@ -476,8 +473,7 @@ class TestComputeEngine:
                 test_case_name = f"{project_id} - VM Provisioning Model Test Case"
                 allure.dynamic.title(test_case_name)
 
-                assert_value = next(
-                    p["vm_provisioning_model_assertion"] for p in config["projects"] if p["project_id"] == project_id)
+                assert_value = config.expectation(project_id, "vm_provisioning_model_assertion")
                 provisioning_model = instance.scheduling.provisioning_model if instance.scheduling else None
 
                 assert_result = provisioning_model == assert_value
@@ -504,7 +500,7 @@ class TestComputeEngine:
                          instance in instances]]), title
 
     @allure.story("Verify On-Host Maintenance for every Compute Engine VM Resource")
-    @pytest.mark.parametrize("project_vm_instances", [(p["project_id"],) for p in config["projects"]], indirect=True)
+    @pytest.mark.parametrize("project_vm_instances", ProjectParams(config), indirect=True)
     def test_on_host_maintenance(self, project_vm_instances):
         for project_id, instances in project_vm_instances:
             if not instances:
@@ -516,8 +512,7 @@ class TestComputeEngine:
                 test_case_name = f"{project_id} - On-Host Maintenance Test Case"
                 allure.dynamic.title(test_case_name)
 
-                assert_value = next(
-                    p["on_host_maintenance_assertion"] for p in config["projects"] if p["project_id"] == project_id)
+                assert_value = config.expectation(project_id, "on_host_maintenance_assertion")
                 on_host_maintenance = instance.scheduling.on_host_maintenance if instance.scheduling else None
                 assert_result = on_host_maintenance == assert_value
 
@@ -544,7 +539,7 @@ class TestComputeEngine:
                          instances]]), title
 
     @allure.story("Verify Automatic Restart for every Compute Engine VM Resource")
-    @pytest.mark.parametrize("project_vm_instances", [(p["project_id"],) for p in config["projects"]], indirect=True)
+    @pytest.mark.parametrize("project_vm_instances", ProjectParams(config), indirect=True)
     def test_automatic_restart(self, project_vm_instances):
         for project_id, instances in project_vm_instances:
             if not instances:
@@ -556,8 +551,7 @@ class TestComputeEngine:
                 test_case_name = f"{project_id} - {instance.name} - Automatic Restart Test Case"
                 allure.dynamic.title(test_case_name)
 
-                assert_value = next(
-                    p["automatic_restart_assertion"] for p in config["projects"] if p["project_id"] == project_id)
+                assert_value = config.expectation(project_id, "automatic_restart_assertion")
                 automatic_restart = instance.scheduling.automatic_restart if instance.scheduling else None
                 assert_result = automatic_restart == assert_value
 
@@ -582,7 +576,7 @@ class TestComputeEngine:
                          instances]]), title
 
     @allure.story("Verify CPU Overcommit for every Compute Engine VM Resource")
-    @pytest.mark.parametrize("project_vm_instances", [(p["project_id"],) for p in config["projects"]], indirect=True)
+    @pytest.mark.parametrize("project_vm_instances", ProjectParams(config), indirect=True)
     def test_cpu_overcommit(self, project_vm_instances):
         for project_id, instances in project_vm_instances:
             if not instances:
@@ -596,8 +590,7 @@ class TestComputeEngine:
                 test_case_name = f"{project_id} - {instance.name} - CPU Overcommit Test Case"
                 allure.dynamic.title(test_case_name)
 
-                assert_value = next(
-                    p["cpu_overcommit_assertion"] for p in config["projects"] if p["project_id"] == project_id)
+                assert_value = config.expectation(project_id, "cpu_overcommit_assertion")
                 cpu_overcommit = instance.scheduling.min_cpu_platform if instance.scheduling else None
                 assert_result = (cpu_overcommit == "Intel Skylake") == assert_value
 
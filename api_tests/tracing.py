@@ -0,0 +1,217 @@
+import itertools
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+from contextlib import nullcontext
+
+import allure
+import pytest
+
+from api_tests.instrumentation import operation
+
+'''
+    ====================
+    In-process trace spans (--trace-dir)
+
+    Spans nest session -> test -> fixture -> service inventory -> project shard -> API page, and
+    rule evaluation -> rule, with a span per resource wherever work is done per resource (bucket
+    IAM / configuration fetches). Compute rules run as vectorized masks over the whole inventory,
+    so for them the rule span is the leaf.
+
+    Each thread keeps its own span stack; work handed to a fetch worker names its parent span
+    explicitly, so shards stay under the inventory span that started them. A disabled tracer
+    hands out one shared no-op context, so the instrumented code paths cost next to nothing
+    without --trace-dir.
+
+    At session end the spans are written as a Chrome trace (trace.json, for chrome://tracing or
+    Perfetto) and as folded stacks (trace.folded, for flamegraph.pl / speedscope), and both are
+    attached to the Allure report.
+    ====================
+'''
+
+TRACE_FILE = "trace.json"
+FOLDED_FILE = "trace.folded"
+
+_NO_SPAN = nullcontext()
+
+
+class Span:
+    __slots__ = ("id", "parent", "name", "category", "start", "end", "thread", "args")
+
+    def __init__(self, span_id, parent, name, category, start, thread, args):
+        self.id = span_id
+        self.parent = parent
+        self.name = name
+        self.category = category
+        self.start = start
+        self.end = None
+        self.thread = thread
+        self.args = args
+
+
+class _SpanContext:
+    __slots__ = ("tracer", "span")
+
+    def __init__(self, tracer, span):
+        self.tracer = tracer
+        self.span = span
+
+    def __enter__(self):
+        self.tracer._stack().append(self.span)
+        return self.span
+
+    def __exit__(self, *exc_info):
+        self.span.end = time.perf_counter()
+        self.tracer._stack().pop()
+        self.tracer.spans.append(self.span)
+
+
+class Tracer:
+
+    def __init__(self):
+        self.enabled = False
+        self.spans = []  # finished spans; list.append is atomic, so workers append without a lock
+        self._ids = itertools.count(1)
+        self._local = threading.local()
+
+    def _stack(self):
+        stack = getattr(self._local, "stack", None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    def current(self):
+        # Innermost open span of the calling thread; hand it to workers as their parent
+        if not self.enabled:
+            return None
+        stack = self._stack()
+        return stack[-1] if stack else None
+
+    def span(self, name, category="", parent=None, **args):
+        if not self.enabled:
+            return _NO_SPAN
+        parent = parent or self.current()
+        return _SpanContext(self, Span(next(self._ids), parent.id if parent else None, name, category,
+                                       time.perf_counter(), threading.get_ident(), args))
+
+    def record(self, name, category, start, end, **args):
+        # A span that already finished (e.g. an API call reported after the fact), under the current span
+        if not self.enabled:
+            return
+        parent = self.current()
+        span = Span(next(self._ids), parent.id if parent else None, name, category, start,
+                    threading.get_ident(), args)
+        span.end = end
+        self.spans.append(span)
+
+    def clear(self):
+        self.spans = []
+
+    def snapshot(self):
+        # Finished spans plus the calling thread's open spans, ended now: the trace as it would look if
+        # the session finished at this point
+        now = time.perf_counter()
+        open_spans = []
+        for span in self._stack():
+            ended = Span(span.id, span.parent, span.name, span.category, span.start, span.thread, span.args)
+            ended.end = now
+            open_spans.append(ended)
+        return list(self.spans) + open_spans
+
+    '''
+        ============
+        Export
+        ============
+    '''
+    def chrome_trace(self, spans=None):
+        spans = sorted(self.spans if spans is None else spans, key=lambda s: s.start)
+        origin = spans[0].start if spans else 0.0
+        threads = {}
+        events = []
+        for span in spans:
+            tid = threads.setdefault(span.thread, len(threads) + 1)
+            events.append({"name": span.name, "cat": span.category, "ph": "X", "pid": 1, "tid": tid,
+                           "ts": round((span.start - origin) * 1e6, 1), "dur": round((span.end - span.start) * 1e6, 1),
+                           "args": {key: str(value) for key, value in span.args.items()}})
+        for thread, tid in threads.items():
+            events.append({"name": "thread_name", "ph": "M", "pid": 1, "tid": tid,
+                           "args": {"name": "main" if tid == 1 else f"worker {tid - 1}"}})
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def folded_stacks(self, spans=None):
+        # "session;test ...;project_vm_instances;compute inventory;... <self time in microseconds>" per stack
+        spans = {span.id: span for span in (self.spans if spans is None else spans)}
+        children = defaultdict(float)
+        for span in spans.values():
+            if span.parent in spans:
+                children[span.parent] += span.end - span.start
+
+        stacks = defaultdict(int)
+        for span in spans.values():
+            names, node = [], span
+            while node is not None:
+                names.append(node.name.replace(";", ","))
+                node = spans.get(node.parent)
+            # Workers overlap their parent, so a parent's self time is clamped at zero
+            self_time = max(0.0, (span.end - span.start) - children[span.id])
+            stacks[";".join(reversed(names))] += int(self_time * 1e6)
+        return "".join(f"{stack} {micros}\n" for stack, micros in sorted(stacks.items()) if micros)
+
+    def export(self, directory, spans=None):
+        # Writes the finished spans (or the given ones) as trace.json and trace.folded
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, TRACE_FILE), "w") as trace_file:
+            json.dump(self.chrome_trace(spans), trace_file)
+        with open(os.path.join(directory, FOLDED_FILE), "w") as folded_file:
+            folded_file.write(self.folded_stacks(spans))
+        return os.path.join(directory, TRACE_FILE), os.path.join(directory, FOLDED_FILE)
+
+
+# Process-wide tracer; disabled until conftest.py enables it (--trace-dir)
+tracer = Tracer()
+
+
+class TracePlugin:
+    # Session, test and fixture spans, plus API calls reported by the scheduler
+
+    def __init__(self, tracer, directory):
+        self.tracer = tracer
+        self.directory = directory
+        self._session = None
+
+    def record_call(self, call):
+        # Scheduler observer: one span per API call (each page of a listing), under the span that made it
+        end = time.perf_counter()
+        self.tracer.record(operation(call.method, call.url), call.service, end - call.seconds, end,
+                           url=call.url, project_id=call.project_id, zone=call.zone,
+                           page_token=call.page_token, status=call.status, attempts=call.attempts, bytes=call.bytes)
+
+    def pytest_sessionstart(self, session):
+        self._session = self.tracer.span("session", "session")
+        self._session.__enter__()
+
+    @pytest.hookimpl(hookwrapper=True)
+    def pytest_runtest_protocol(self, item):
+        with self.tracer.span(item.nodeid, "test"):
+            yield
+
+    @pytest.hookimpl(hookwrapper=True)
+    def pytest_fixture_setup(self, fixturedef, request):
+        with self.tracer.span(fixturedef.argname, "fixture"):
+            yield
+
+    def pytest_sessionfinish(self, session):
+        if self._session is not None:
+            self._session.__exit__(None, None, None)
+            self._session = None
+        self.tracer.export(self.directory)
+
+    def attach(self):
+        # Called while the session is still running (session fixture teardown), so Allure has a place to attach
+        # to. The session span and the last test's span are still open then: they are ended as of now in the
+        # attached trace, and pytest_sessionfinish rewrites the files once they are closed for real.
+        trace_path, folded_path = self.tracer.export(self.directory, self.tracer.snapshot())
+        allure.attach.file(trace_path, name="Chrome trace", attachment_type=allure.attachment_type.JSON)
+        allure.attach.file(folded_path, name="Folded stacks", attachment_type=allure.attachment_type.TEXT)
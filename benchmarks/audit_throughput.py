@@ -0,0 +1,205 @@
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+from api_tests.emulator import Emulator, Fleet, write_config
+
+'''
+    ====================
+    Audit throughput benchmark
+
+    Runs the Compute Engine and Cloud Storage audits against emulated fleets of increasing size
+    (api_tests/emulator.py) and records, per service and fleet size:
+      - wall time, split into listing / evaluation stages,
+      - API calls served, per endpoint,
+      - peak RSS of the auditing process,
+      - evaluation time of every Compute Engine rule some project checks, on its own, measured after
+        the audit and outside its wall time.
+
+    Every (service, size) runs in a fresh interpreter so that peak RSS is its own; the emulator runs
+    in this process. Results are written to benchmarks/baselines/audit_throughput.json, so a change
+    in how the audits scale shows up as a diff of that file.
+
+        python -m benchmarks.audit_throughput --sizes 100,1000,10000,100000
+    ====================
+'''
+
+DEFAULT_SIZES = (100, 1000, 10000, 100000)
+SERVICES = ("compute", "storage")
+PROJECTS = 2
+ZONES = 2
+VIOLATION_RATE = 0.01
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines", "audit_throughput.json")
+
+# Emulator routes counted as the API calls of each service
+SERVICE_ROUTES = {"compute": "instances.", "storage": "buckets."}
+
+
+def fleet_for(size, seed=0):
+    # size resources per service: PROJECTS x ZONES x instances, PROJECTS x buckets
+    return Fleet(projects=PROJECTS, zones_per_project=ZONES, instances=max(1, size // (PROJECTS * ZONES)),
+                 buckets=max(1, size // PROJECTS), violation_rate=VIOLATION_RATE, seed=seed)
+
+
+'''
+    ============
+    Audits (run in the child interpreter)
+    ============
+'''
+def _peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def audit_compute(project_ids):
+    # Mirrors TestComputeEngine: one concurrent listing of every project, then one evaluation per project
+    from api_tests import inventory, rules
+    from config.loader import load_config
+
+    config = load_config("config.yaml")
+    projects = [config.project(project_id) for project_id in project_ids]
+    fields = rules.required_fields([r for r in rules.COMPUTE_RULES if any(r.key in p for p in projects)])
+
+    stages = {}
+    start = time.perf_counter()
+    inventory.compute_inventory.prefetch([(p["project_id"], p.get("zones")) for p in projects], fields)
+    snapshots = [inventory.compute_inventory.snapshot(p["project_id"], p.get("zones"), fields) for p in projects]
+    stages["list"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for project, snapshot in zip(projects, snapshots):
+        rules.evaluate(snapshot, project)
+    stages["evaluate"] = time.perf_counter() - start
+    return sum(len(s) for s in snapshots), stages, lambda: _rule_breakdown(projects, snapshots)
+
+
+def _rule_breakdown(projects, snapshots):
+    # Evaluation time of every rule on its own; a rule that no project checks is not evaluated and not reported
+    from api_tests import rules
+
+    per_rule = {}
+    for r in rules.COMPUTE_RULES:
+        checked = [(project, snapshot) for project, snapshot in zip(projects, snapshots) if rules.active_rules(project, [r])]
+        if not checked:
+            continue
+        start = time.perf_counter()
+        for project, snapshot in checked:
+            rules.evaluate(snapshot, project, [r])
+        per_rule[r.name] = time.perf_counter() - start
+    return per_rule
+
+
+def audit_storage(project_ids):
+    # Mirrors the bucket configuration collection: one listing per project, one IAM policy per bucket
+    from api_tests.single_bucket_response import collect_bucket_configurations
+
+    start = time.perf_counter()
+    resources = sum(len(collect_bucket_configurations(project_id)) for project_id in project_ids)
+    return resources, {"list_and_iam": time.perf_counter() - start}, None
+
+
+def run_child(service, endpoint, config_dir, project_ids):
+    from api_tests.clients import registry
+    from config.loader import config_store
+
+    registry.endpoint = endpoint
+    config_store.root = config_dir
+
+    start = time.perf_counter()
+    resources, stages, rule_breakdown = (audit_compute if service == "compute" else audit_storage)(project_ids)
+    wall = time.perf_counter() - start
+    # Timed once the audit is over, so evaluating every rule again on its own does not count toward its wall time
+    per_rule = rule_breakdown() if rule_breakdown else {}
+    return {
+        "resources": resources,
+        "wall_seconds": round(wall, 3),
+        "stages": {name: round(seconds, 3) for name, seconds in stages.items()},
+        "rules": {name: round(seconds, 4) for name, seconds in per_rule.items()},
+        "peak_rss_mb": _peak_rss_mb(),
+    }
+
+
+'''
+    ============
+    Driver
+    ============
+'''
+def measure(service, size, workdir):
+    fleet = fleet_for(size)
+    config_dir = write_config(fleet, os.path.join(workdir, f"config-{size}"))
+    with Emulator(fleet) as emulator:
+        command = [sys.executable, "-m", "benchmarks.audit_throughput", "--child", service,
+                   "--endpoint", emulator.endpoint, "--config-dir", config_dir, *fleet.project_ids]
+        child = subprocess.run(command, capture_output=True, text=True,
+                               cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        if child.returncode:
+            raise RuntimeError(f"The {service} audit over {size} resource(s) failed:\n{child.stderr}")
+        calls = {route: count for route, count in sorted(emulator.requests.items())
+                 if route.startswith(SERVICE_ROUTES[service])}
+
+    result = json.loads(child.stdout.strip().splitlines()[-1])
+    return dict({"service": service, "size": size, "api_calls": calls}, **result)
+
+
+def machine():
+    return {"python": platform.python_version(), "platform": platform.platform(terse=True),
+            "cpus": os.cpu_count()}
+
+
+def _load_baseline(path):
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r") as baseline_file:
+        return {(r["service"], r["size"]): r for r in json.load(baseline_file)["results"]}
+
+
+def _report(result, previous):
+    calls = sum(result["api_calls"].values())
+    line = (f"{result['service']:<8} {result['size']:>7} resource(s)  {result['wall_seconds']:8.3f}s  "
+            f"{calls:>7} call(s)  {result['peak_rss_mb']:8.1f} MB")
+    if previous:
+        change = (result["wall_seconds"] - previous["wall_seconds"]) / max(previous["wall_seconds"], 1e-3)
+        line += f"  ({change:+.0%} wall, {calls - sum(previous['api_calls'].values()):+d} calls vs baseline)"
+    print(line, flush=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.audit_throughput",
+                                     description="Measure how the audits scale with the size of the fleet")
+    parser.add_argument("--sizes", default=",".join(map(str, DEFAULT_SIZES)), help="Comma-separated resources per service")
+    parser.add_argument("--services", default=",".join(SERVICES))
+    parser.add_argument("--output", default=BASELINE_FILE, help="Where the results are written (default: the committed baseline)")
+    parser.add_argument("--child", choices=SERVICES, help=argparse.SUPPRESS)
+    parser.add_argument("--endpoint", help=argparse.SUPPRESS)
+    parser.add_argument("--config-dir", help=argparse.SUPPRESS)
+    parser.add_argument("project_ids", nargs="*", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.child:
+        print(json.dumps(run_child(args.child, args.endpoint, args.config_dir, args.project_ids)))
+        return
+
+    baseline = _load_baseline(BASELINE_FILE)
+    results = []
+    with tempfile.TemporaryDirectory() as workdir:
+        for service in args.services.split(","):
+            for size in map(int, args.sizes.split(",")):
+                result = measure(service, size, workdir)
+                _report(result, baseline.get((service, size)))
+                results.append(result)
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    with open(args.output, "w") as output_file:
+        json.dump({"machine": machine(), "results": results}, output_file, indent=2)
+        output_file.write("\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,178 @@
+import os
+import threading
+from collections import Counter
+from collections.abc import Sequence
+
+import yaml
+
+'''
+    ====================
+    Configuration loading
+
+    Every YAML file under the config root is read and validated once, cached by mtime, and indexed
+    by project_id so that per-instance checks look expectations up in O(1).
+    The root defaults to this package's directory and can be overridden with the
+    GCP_INFRATESTS_CONFIG_DIR environment variable or the --config-dir pytest option.
+
+    Test modules bind lazy_config() handles at import time; nothing is read until a fixture or the
+    parametrization of a test asks for it, so importing (and collecting) the suites does no I/O
+    and always sees the root chosen by --config-dir.
+    ====================
+'''
+
+CONFIG_DIR_ENV = "GCP_INFRATESTS_CONFIG_DIR"
+DEFAULT_CONFIG_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Top-level keys that must be present in files without a "projects" list
+REQUIRED_KEYS = {
+    "configuration.yaml": ("gce_project_id", "zone", "vm_details"),
+}
+
+
+class ConfigFile:
+
+    def __init__(self, path, data):
+        self.path = path
+        self.data = data
+        self._projects = {project["project_id"]: project for project in data.get("projects") or []}
+
+    def __getitem__(self, key):
+        return self.data[key]
+
+    def __contains__(self, key):
+        return key in self.data
+
+    def get(self, key, default=None):
+        return self.data.get(key, default)
+
+    @property
+    def projects(self):
+        return list(self._projects.values())
+
+    def project_ids(self):
+        return list(self._projects)
+
+    def project(self, project_id):
+        project = self._projects.get(project_id)
+        if project is None:
+            raise ValueError(f"Project with project_id '{project_id}' not found in {os.path.basename(self.path)}.")
+        return project
+
+    def expectation(self, project_id, key):
+        project = self.project(project_id)
+        if key not in project:
+            raise ValueError(f"'{key}' not found for project_id '{project_id}' in {os.path.basename(self.path)}.")
+        return project[key]
+
+
+def validate(name, data):
+    if not isinstance(data, dict):
+        raise ValueError(f"{name} must contain a YAML mapping at the top level.")
+
+    for key in REQUIRED_KEYS.get(name, ()):
+        if key not in data:
+            raise ValueError(f"'{key}' not specified in {name}.")
+
+    if "projects" in data:
+        seen = set()
+        for project in data["projects"] or []:
+            project_id = project.get("project_id") if isinstance(project, dict) else None
+            if not project_id:
+                raise ValueError(f"Every project in {name} needs a project_id.")
+            if project_id in seen:
+                raise ValueError(f"Project with project_id '{project_id}' is listed twice in {name}.")
+            if not project.get("zone"):
+                raise ValueError(f"Zone not specified for project with project_id '{project_id}' in {name}.")
+            seen.add(project_id)
+
+
+class ConfigStore:
+
+    def __init__(self, root=None):
+        self._root = root
+        self._files = {}  # path -> (mtime, ConfigFile)
+        self._lock = threading.Lock()
+        self.parses = Counter()  # file name -> times it was read and parsed (cache misses)
+
+    @property
+    def root(self):
+        return self._root or os.environ.get(CONFIG_DIR_ENV) or DEFAULT_CONFIG_DIR
+
+    @root.setter
+    def root(self, value):
+        with self._lock:
+            self._root = value
+            self._files.clear()
+
+    def path(self, name):
+        return os.path.join(self.root, name)
+
+    def load(self, name):
+        path = self.path(name)
+        mtime = os.stat(path).st_mtime_ns
+
+        with self._lock:
+            cached = self._files.get(path)
+            if cached and cached[0] == mtime:
+                return cached[1]
+
+            with open(path, "r") as config_file:
+                data = yaml.safe_load(config_file)
+            validate(name, data)
+            self.parses[name] += 1
+
+            config_file = ConfigFile(path, data)
+            self._files[path] = (mtime, config_file)
+            return config_file
+
+
+# Process-wide store; --config-dir in conftest.py re-roots it for the session
+config_store = ConfigStore()
+
+
+def load_config(name):
+    return config_store.load(name)
+
+
+class LazyConfig:
+    # Stand-in for a ConfigFile that loads it on first use; every access goes through the store's cache
+
+    def __init__(self, name, store=None):
+        self._name = name
+        self._store = store
+
+    def load(self):
+        return (self._store or config_store).load(self._name)
+
+    def __getitem__(self, key):
+        return self.load()[key]
+
+    def __contains__(self, key):
+        return key in self.load()
+
+    def __getattr__(self, attribute):
+        # get, projects, project_ids, project, expectation, path, data
+        return getattr(self.load(), attribute)
+
+    def __repr__(self):
+        return f"LazyConfig({self._name!r})"
+
+
+class ProjectParams(Sequence):
+    # parametrize() values [(project_id,), ...] of a lazily loaded file, read when pytest collects the test
+
+    def __init__(self, config):
+        self._config = config
+
+    def __iter__(self):
+        return iter([(project_id,) for project_id in self._config.project_ids()])
+
+    def __getitem__(self, index):
+        return list(self)[index]
+
+    def __len__(self):
+        return len(self._config.project_ids())
+
+
+def lazy_config(name):
+    return LazyConfig(name)
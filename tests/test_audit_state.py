@@ -0,0 +1,173 @@
+from collections import Counter
+
+import allure
+import pytest
+from google.cloud import compute_v1
+
+from api_tests.audit_state import AuditStore
+from api_tests.rules import BOOL, evaluate, evaluate_incremental, rule
+
+'''
+    ====================
+    Incremental audits (api_tests/rules.py evaluate_incremental, api_tests/audit_state.py)
+
+    The rules under test count every extraction, so each test sees exactly which instances were
+    evaluated and which verdicts were reused from the state file.
+    ====================
+'''
+
+PROJECT_ID = "dev000"
+ZONE = "https://www.googleapis.com/compute/v1/projects/dev000/zones/europe-west3-a"
+PROJECT = {"project_id": PROJECT_ID, "secure_boot_assertion": True, "vtpm_assertion": True}
+
+# Rule name -> extractions since the test started
+EXTRACTED = Counter()
+
+
+def secure_boot(instance):
+    EXTRACTED["secure_boot"] += 1
+    return bool(instance.shielded_instance_config and instance.shielded_instance_config.enable_secure_boot)
+
+
+def secure_boot_or_vtpm(instance):
+    # A changed extractor under the same rule name
+    EXTRACTED["secure_boot"] += 1
+    config = instance.shielded_instance_config
+    return bool(config and (config.enable_secure_boot or config.enable_vtpm))
+
+
+def vtpm(instance):
+    EXTRACTED["vtpm"] += 1
+    return bool(instance.shielded_instance_config and instance.shielded_instance_config.enable_vtpm)
+
+
+def shielded_rule(name, extract):
+    return rule(name, f"{name} story", f"{name} title", f"{name} failure", "High", "CRITICAL", BOOL,
+                (f"shieldedInstanceConfig/{name}",), extract)
+
+
+RULES = (shielded_rule("secure_boot", secure_boot), shielded_rule("vtpm", vtpm))
+
+
+def instance(index, secure_boot=True, vtpm=True, fingerprint="f0"):
+    return compute_v1.Instance(
+        name=f"vm-{index:02d}", zone=ZONE, fingerprint=fingerprint, label_fingerprint="l0",
+        shielded_instance_config=compute_v1.ShieldedInstanceConfig(enable_secure_boot=secure_boot, enable_vtpm=vtpm))
+
+
+def fleet():
+    # Four instances, vm-01 without Secure Boot
+    return [instance(i, secure_boot=i != 1) for i in range(4)]
+
+
+def verdicts(results):
+    return {name: (sorted(result.passed), sorted(result.failed)) for name, result in results.items()}
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = AuditStore(str(tmp_path / "audit_state.sqlite"))
+    yield store
+    store.close()
+
+
+@pytest.fixture(autouse=True)
+def extracted():
+    EXTRACTED.clear()
+    return EXTRACTED
+
+
+@allure.feature("Incremental audits")
+class TestIncremental:
+
+    @allure.story("An unchanged run reuses every verdict")
+    def test_unchanged_run(self, store, extracted):
+        first = evaluate_incremental(PROJECT_ID, fleet(), PROJECT, store, RULES)
+        assert extracted == {"secure_boot": 4, "vtpm": 4}
+        assert verdicts(first) == verdicts(evaluate(fleet(), PROJECT, RULES))
+
+        extracted.clear()
+        second = evaluate_incremental(PROJECT_ID, fleet(), PROJECT, store, RULES)
+        assert not extracted
+        assert verdicts(second) == verdicts(first)
+        assert (store.evaluated, store.reused) == (4, 4)
+
+    @allure.story("A changed fingerprint re-evaluates only that instance")
+    def test_fingerprint_change(self, store, extracted):
+        evaluate_incremental(PROJECT_ID, fleet(), PROJECT, store, RULES)
+
+        extracted.clear()
+        instances = fleet()
+        # vm-01 gets Secure Boot, and with it a new fingerprint
+        instances[1] = instance(1, fingerprint="f1")
+        results = evaluate_incremental(PROJECT_ID, instances, PROJECT, store, RULES)
+        assert extracted == {"secure_boot": 1, "vtpm": 1}
+        assert results["secure_boot"].failed == []
+        assert verdicts(results) == verdicts(evaluate(instances, PROJECT, RULES))
+
+    @allure.story("Verdicts are keyed on the fingerprint: a change it does not reflect is not re-evaluated")
+    def test_same_fingerprint(self, store):
+        evaluate_incremental(PROJECT_ID, fleet(), PROJECT, store, RULES)
+        instances = fleet()
+        instances[1] = instance(1)
+        results = evaluate_incremental(PROJECT_ID, instances, PROJECT, store, RULES)
+        assert results["secure_boot"].failed == ["vm-01"]
+
+    @allure.story("A changed expectation invalidates the rule's verdicts, and only that rule's")
+    def test_expectation_change(self, store, extracted):
+        evaluate_incremental(PROJECT_ID, fleet(), PROJECT, store, RULES)
+
+        extracted.clear()
+        project = dict(PROJECT, secure_boot_assertion=False)
+        results = evaluate_incremental(PROJECT_ID, fleet(), project, store, RULES)
+        assert extracted == {"secure_boot": 4}
+        assert results["secure_boot"].failed == ["vm-00", "vm-02", "vm-03"]
+
+    @allure.story("A changed extractor invalidates the rule's verdicts")
+    def test_rule_code_change(self, store, extracted):
+        evaluate_incremental(PROJECT_ID, fleet(), PROJECT, store, RULES)
+
+        extracted.clear()
+        rules = (shielded_rule("secure_boot", secure_boot_or_vtpm), RULES[1])
+        results = evaluate_incremental(PROJECT_ID, fleet(), PROJECT, store, rules)
+        assert extracted == {"secure_boot": 4}
+        # vm-01 has vTPM, which the new extractor accepts
+        assert results["secure_boot"].failed == []
+
+    @allure.story("A deleted instance is forgotten")
+    def test_deleted_instance(self, store):
+        evaluate_incremental(PROJECT_ID, fleet(), PROJECT, store, RULES)
+        evaluate_incremental(PROJECT_ID, [i for i in fleet() if i.name != "vm-01"], PROJECT, store, RULES)
+        state = store.load("compute", PROJECT_ID)
+        assert "europe-west3-a/vm-01" not in state.fingerprints
+        assert not state.failures
+
+
+@allure.feature("Incremental audits")
+class TestStateFile:
+
+    @allure.story("A missing state file means a full evaluation")
+    def test_missing(self, tmp_path, extracted):
+        store = AuditStore(str(tmp_path / "reports" / "audit_state.sqlite"))
+        results = evaluate_incremental(PROJECT_ID, fleet(), PROJECT, store, RULES)
+        store.close()
+        assert extracted == {"secure_boot": 4, "vtpm": 4}
+        assert verdicts(results) == verdicts(evaluate(fleet(), PROJECT, RULES))
+
+    @allure.story("A corrupt state file is set aside and means a full evaluation")
+    def test_corrupt(self, tmp_path, extracted):
+        path = tmp_path / "audit_state.sqlite"
+        path.write_bytes(b"not a database" * 100)
+        store = AuditStore(str(path))
+        results = evaluate_incremental(PROJECT_ID, fleet(), PROJECT, store, RULES)
+        store.close()
+        assert extracted == {"secure_boot": 4, "vtpm": 4}
+        assert verdicts(results) == verdicts(evaluate(fleet(), PROJECT, RULES))
+        assert (tmp_path / "audit_state.sqlite.corrupt").read_bytes() == b"not a database" * 100
+
+        # The fresh file serves the next run
+        extracted.clear()
+        store = AuditStore(str(path))
+        evaluate_incremental(PROJECT_ID, fleet(), PROJECT, store, RULES)
+        store.close()
+        assert not extracted
@@ -0,0 +1,193 @@
+import json
+import math
+import os
+import socket
+import subprocess
+import sys
+
+import allure
+import pytest
+
+from api_tests import inventory
+from api_tests.audit_state import AuditStore
+from api_tests.call_budget import fake_fleet
+from api_tests.clients import ClientRegistry
+from api_tests.emulator import Emulator, Fleet, write_config
+from api_tests.sidecar import Sidecar
+from api_tests.single_bucket_response import collect_bucket_configurations
+
+'''
+    ====================
+    API-call budgets of the suites
+
+    Every suite runs in its own interpreter against an in-memory fleet (api_tests/call_budget.py)
+    and must stay within an upper bound of API calls, configuration parses and client
+    constructions, so per-test re-listing or per-call client construction fails here first.
+
+    These are tests of the audit suites themselves and are kept out of api_tests/, so the
+    compliance run (pytest api_tests) and its Allure report never include them:
+
+        pytest tests
+    ====================
+'''
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PROJECTS = 3
+INSTANCES = 120
+BUCKETS = 120
+PAGE_SIZE = 50
+FLEET = f"{PROJECTS},1,{INSTANCES},{BUCKETS}"
+
+
+def run_suite(tmp_path, target, *options):
+    # Runs target against the in-memory fleet; returns {"api_calls": ..., "config_parses": ..., "clients_built": ...}
+    fleet = fake_fleet(FLEET).emulator.fleet
+    config_dir = write_config(fleet, str(tmp_path / "config"))
+    counts = tmp_path / "calls.json"
+    result = subprocess.run(
+        [sys.executable, "-m", "pytest", "-q", "-p", "api_tests.call_budget", "-p", "no:cacheprovider", target,
+         "--fake-fleet", FLEET, "--fake-page-size", str(PAGE_SIZE), "--call-counts", str(counts),
+         "--config-dir", config_dir, "--api-rate", "0", *options],
+        cwd=ROOT, capture_output=True, text=True)
+    assert counts.exists(), f"{target} did not run:\n{result.stdout}\n{result.stderr}"
+    with open(counts, "r") as counts_file:
+        return json.load(counts_file)
+
+
+def calls(api_calls, prefix):
+    return sum(n for endpoint, n in api_calls.items() if endpoint.startswith(prefix))
+
+
+@allure.feature("API call budgets")
+class TestCallBudget:
+
+    @allure.story("The full TestComputeEngine class lists every project once")
+    @pytest.mark.parametrize("options", [(), ("--stream",)], ids=["snapshot", "stream"])
+    def test_compute_engine(self, tmp_path, options):
+        counts = run_suite(tmp_path, "api_tests/test_compute_engine.py::TestComputeEngine", *options)
+        budget = PROJECTS * math.ceil(INSTANCES / PAGE_SIZE)
+        assert calls(counts["api_calls"], "instances.") <= budget, f"{counts['api_calls']} exceeds {budget} list call(s)"
+        assert counts["config_parses"].get("config.yaml", 0) <= 1, counts["config_parses"]
+        assert counts["clients_built"].get("compute", 0) <= 1, counts["clients_built"]
+
+    @allure.story("--violators-only lists every project at most once")
+    def test_compute_engine_violators_only(self, tmp_path):
+        counts = run_suite(tmp_path, "api_tests/test_compute_engine.py::TestComputeEngine", "--violators-only")
+        # The client-side rules need the full listing, which then serves the pushable rules too
+        budget = PROJECTS * math.ceil(INSTANCES / PAGE_SIZE)
+        assert calls(counts["api_calls"], "instances.") <= budget, f"{counts['api_calls']} exceeds {budget} list call(s)"
+
+    @allure.story("Per-resource collection and checks list every project once")
+    def test_compute_resources(self, tmp_path):
+        counts = run_suite(tmp_path, "api_tests/test_compute_resources.py", "--per-resource")
+        budget = PROJECTS * math.ceil(INSTANCES / PAGE_SIZE)
+        assert calls(counts["api_calls"], "instances.") <= budget, f"{counts['api_calls']} exceeds {budget} list call(s)"
+        assert counts["config_parses"].get("config.yaml", 0) <= 1, counts["config_parses"]
+
+    @allure.story("A run within --inventory-ttl of the last one makes no listing call")
+    def test_inventory_cache(self, tmp_path):
+        cache_dir = str(tmp_path / "inventory-cache")
+        target = "api_tests/test_compute_engine.py::TestComputeEngine"
+        first = run_suite(tmp_path, target, "--inventory-ttl", "3600", "--inventory-cache-dir", cache_dir)
+        second = run_suite(tmp_path, target, "--inventory-ttl", "3600", "--inventory-cache-dir", cache_dir)
+        assert calls(first["api_calls"], "instances.") > 0, first["api_calls"]
+        assert not second["api_calls"], second["api_calls"]
+
+    @allure.story("The sidecar cannot be combined with the on-disk inventory cache")
+    def test_sidecar_with_inventory_ttl(self, tmp_path):
+        result = subprocess.run(
+            [sys.executable, "-m", "pytest", "-q", "-p", "no:cacheprovider", "api_tests/test_compute_engine.py",
+             "--inventory-sidecar", str(tmp_path / "inventory.sock"), "--inventory-ttl", "3600"],
+            cwd=ROOT, capture_output=True, text=True)
+        assert result.returncode == pytest.ExitCode.USAGE_ERROR, result.stdout + result.stderr
+        assert "--inventory-sidecar cannot be combined with --inventory-ttl" in result.stderr
+
+    @allure.story("--reverify-failures gets only the last run's failing instances")
+    def test_reverify_failures(self, tmp_path):
+        fleet = fake_fleet(FLEET).emulator.fleet
+        project_id, zone = fleet.project_ids[0], fleet.zones[0]
+        fixed = [f"{zone}/{fleet.instance_name(i)}" for i in (3, 7)]
+        deleted = f"{zone}/{fleet.instance_name(INSTANCES + 1)}"
+        failures = [(fixed[0], "secure_boot"), (fixed[0], "vtpm"), (fixed[1], "secure_boot"), (deleted, "tags")]
+        state = str(tmp_path / "audit_state.sqlite")
+        store = AuditStore(state)
+        store.record("compute", project_id, dict.fromkeys(fixed + [deleted], "fingerprint"),
+                     {"secure_boot": "", "vtpm": "", "tags": ""}, fixed + [deleted], [], failures)
+
+        counts = run_suite(tmp_path, "api_tests/test_compute_engine.py::TestComputeEngine",
+                           "--reverify-failures", "--audit-state", state)
+        # One get per failing instance (the deleted one answers 404), no listing at all
+        assert counts["api_calls"] == {"instances.get": len(fixed), "not_found": 1}, counts["api_calls"]
+        # The fleet is compliant: every failure is resolved, the deleted instance is forgotten
+        assert not AuditStore(state).load("compute", project_id).failures
+
+    @allure.story("xdist workers share one listing per project")
+    def test_compute_engine_xdist(self, tmp_path):
+        pytest.importorskip("xdist")
+        # Workers are separate processes, so they are counted by an emulator they all talk to over HTTP
+        fleet = Fleet(PROJECTS, 1, INSTANCES, BUCKETS, violation_rate=0.0)
+        config_dir = write_config(fleet, str(tmp_path / "config"))
+        with Emulator(fleet, page_size=PAGE_SIZE) as emulator:
+            result = subprocess.run(
+                [sys.executable, "-m", "pytest", "-q", "-p", "no:cacheprovider", "api_tests/test_compute_engine.py",
+                 "-n", "2", "--dist", "loadgroup", "--emulator", emulator.endpoint, "--config-dir", config_dir,
+                 "--api-rate", "0"],
+                cwd=ROOT, capture_output=True, text=True)
+        assert result.returncode == 0, f"{result.stdout}\n{result.stderr}"
+        budget = PROJECTS * math.ceil(INSTANCES / PAGE_SIZE)
+        assert calls(emulator.requests, "instances.") <= budget, f"{dict(emulator.requests)} exceeds {budget} list call(s)"
+
+    @allure.story("Runs served by the inventory sidecar share one listing per project")
+    def test_sidecar(self, tmp_path, monkeypatch):
+        if not hasattr(socket, "AF_UNIX"):
+            pytest.skip("The inventory sidecar needs Unix sockets")
+        fleet = Fleet(PROJECTS, 1, INSTANCES, BUCKETS, violation_rate=0.0)
+        config_dir = write_config(fleet, str(tmp_path / "config"))
+        with Emulator(fleet, page_size=PAGE_SIZE) as emulator:
+            # The sidecar lists in this process, through a registry of its own pointed at the emulator
+            sidecar_registry = ClientRegistry()
+            sidecar_registry.endpoint = emulator.endpoint
+            monkeypatch.setattr(inventory, "registry", sidecar_registry)
+            with Sidecar(str(tmp_path / "inventory.sock"), endpoint=emulator.endpoint) as sidecar:
+                for _ in range(2):
+                    result = subprocess.run(
+                        [sys.executable, "-m", "pytest", "-q", "-p", "no:cacheprovider", "api_tests/test_compute_engine.py",
+                         "api_tests/test_gcs.py", "--inventory-sidecar", sidecar.path, "--emulator", emulator.endpoint,
+                         "--config-dir", config_dir, "--api-rate", "0"],
+                        cwd=ROOT, capture_output=True, text=True)
+                    assert result.returncode == 0, f"{result.stdout}\n{result.stderr}"
+        budget = PROJECTS * math.ceil(INSTANCES / PAGE_SIZE)
+        assert calls(emulator.requests, "instances.") <= budget, f"{dict(emulator.requests)} exceeds {budget} list call(s)"
+        assert calls(emulator.requests, "buckets.") <= PROJECTS * math.ceil(BUCKETS / PAGE_SIZE), dict(emulator.requests)
+
+    @allure.story("TestGCS lists every project's buckets once")
+    def test_gcs(self, tmp_path):
+        counts = run_suite(tmp_path, "api_tests/test_gcs.py::TestGCS")
+        budget = PROJECTS * math.ceil(BUCKETS / PAGE_SIZE)
+        assert calls(counts["api_calls"], "buckets.") + counts["api_calls"].get("not_found", 0) <= budget, counts["api_calls"]
+        assert counts["config_parses"].get("gcs_test_config.yaml", 0) <= 1, counts["config_parses"]
+        assert counts["clients_built"].get("storage", 0) <= PROJECTS, counts["clients_built"]
+
+    @allure.story("Collecting every suite makes no API call and parses each configuration file once")
+    def test_collection(self, tmp_path):
+        counts = run_suite(tmp_path, "api_tests", "--collect-only")
+        assert not counts["api_calls"], counts["api_calls"]
+        assert not counts["clients_built"], counts["clients_built"]
+        # Parametrization needs the configured projects; each file is parsed once and served from the cache after
+        assert all(n <= 1 for n in counts["config_parses"].values()), counts["config_parses"]
+
+    @allure.story("Bucket configuration for N buckets costs ceil(N / page) listings and N IAM calls")
+    def test_bucket_configuration(self, monkeypatch):
+        # In-process: fresh clients and inventory, so the session's own caches are left alone
+        transport = fake_fleet(FLEET, PAGE_SIZE)
+        monkeypatch.setattr(inventory, "registry", ClientRegistry())
+        monkeypatch.setattr(inventory, "storage_inventory", inventory.StorageInventory())
+        project_id = transport.emulator.fleet.project_ids[0]
+
+        with transport:
+            details = collect_bucket_configurations(project_id)
+
+        assert len(details) == BUCKETS
+        assert calls(transport.calls, "buckets.list") <= math.ceil(BUCKETS / PAGE_SIZE), transport.calls
+        assert calls(transport.calls, "buckets.getIamPolicy") <= BUCKETS, transport.calls
+        assert sum(transport.calls.values()) <= math.ceil(BUCKETS / PAGE_SIZE) + BUCKETS, transport.calls
@@ -0,0 +1,65 @@
+import allure
+import pytest
+
+from api_tests import inventory
+from api_tests.cassettes import Cassette, CassetteMissError, request_key
+from api_tests.clients import ClientRegistry
+from api_tests.emulator import Emulator, Fleet
+
+'''
+    ====================
+    Record / replay cassettes (api_tests/cassettes.py)
+    ====================
+'''
+
+URL = "https://compute.googleapis.com/compute/v1/projects/dev000/zones/europe-west3-a/instances"
+
+
+def emulated_registry(monkeypatch, endpoint):
+    registry = ClientRegistry()
+    registry.endpoint = endpoint
+    monkeypatch.setattr(inventory, "registry", registry)
+
+
+def listing(fleet, fields):
+    return [type(instance).to_dict(instance) for instance in
+            inventory.list_zone_instances(fleet.project_ids[0], fleet.zones[0], fields)]
+
+
+@allure.feature("Cassettes")
+class TestCassettes:
+
+    @allure.story("Requests that differ only in their field mask have different keys")
+    def test_field_mask_key(self):
+        full = request_key("GET", URL)
+        names = request_key("GET", URL, headers={"X-Goog-FieldMask": "items(name),nextPageToken"})
+        labels = request_key("GET", URL, headers={"x-goog-fieldmask": "items(labels),nextPageToken"})
+        assert len({full, names, labels}) == 3
+        assert request_key("GET", URL, headers={"Authorization": "Bearer token"}) == full
+
+    @allure.story("Listings of the same URL with different field masks replay their own responses")
+    def test_record_then_replay(self, tmp_path, monkeypatch):
+        fleet = Fleet(1, 1, 5, 0, violation_rate=0.0)
+        directory = str(tmp_path / "cassettes")
+        field_sets = (None, ("name",), ("name", "labels"))
+
+        with Emulator(fleet) as emulator:
+            emulated_registry(monkeypatch, emulator.endpoint)
+            cassette = Cassette(directory, "record")
+            cassette.activate()
+            try:
+                recorded = [listing(fleet, fields) for fields in field_sets]
+            finally:
+                cassette.deactivate()
+        assert recorded[1] != recorded[2]
+
+        # The emulator is gone: every response comes from the cassette
+        emulated_registry(monkeypatch, emulator.endpoint)
+        cassette = Cassette(directory, "replay")
+        cassette.activate()
+        try:
+            assert [listing(fleet, fields) for fields in field_sets] == recorded
+            with pytest.raises(CassetteMissError):
+                listing(fleet, ("status",))
+        finally:
+            cassette.deactivate()
@@ -0,0 +1,111 @@
+import json
+import os
+import re
+
+import allure
+
+from api_tests.instrumentation import Instrumentation
+from api_tests.scheduler import CallRecord
+
+'''
+    ====================
+    Call metrics (api_tests/instrumentation.py)
+    ====================
+'''
+
+COMPUTE_URL = "https://compute.googleapis.com/compute/v1/projects/dev000/zones/europe-west3-a/instances"
+IAM_URL = "https://storage.googleapis.com/storage/v1/b/dev000-logs/iam"
+
+# name{labels} value, or name value
+SAMPLE = re.compile(r'([a-z_]+)(?:\{((?:[a-z_]+="(?:[^"\\]|\\.)*",?)+)\})? (\S+)')
+
+
+def call(url, seconds, service="compute", page_token=None, status=200, attempts=1, bytes_=1000, error=None):
+    zone = "europe-west3-a" if service == "compute" else None
+    return CallRecord(service, "GET", url, "dev000", zone, page_token, status, seconds, attempts, bytes_, error)
+
+
+def instrumented(directory, worker=None):
+    instrumentation = Instrumentation(str(directory), worker)
+    # Two pages of one zone listing, the first retried once, and a bucket whose IAM policy is forbidden
+    instrumentation.record(call(COMPUTE_URL, 0.2, attempts=2))
+    instrumentation.record(call(COMPUTE_URL, 0.04, page_token="page-2", bytes_=500))
+    instrumentation.record(call(IAM_URL, 1.5, service="storage", status=403, bytes_=100))
+    instrumentation.fixtures["project_vm_instances"] += [0.3, 0.1]
+    instrumentation.tests["test_a"] = 0.01
+    return instrumentation
+
+
+def samples(text):
+    # [(name, {label: value}, value)] of a Prometheus text file; fails on a line that is neither a sample nor
+    # a comment, and on a sample of a family without its HELP and TYPE
+    parsed, described = [], set()
+    for line in text.splitlines():
+        if line.startswith("# "):
+            described.add((line.split()[1], line.split()[2]))
+            continue
+        match = SAMPLE.fullmatch(line)
+        assert match, line
+        name, labels, value = match.groups()
+        family = re.sub(r"_(bucket|sum|count)$", "", name) if name.startswith("gcp_api_call_duration") else name
+        assert ("HELP", family) in described and ("TYPE", family) in described, line
+        parsed.append((name, dict(re.findall(r'([a-z_]+)="((?:[^"\\]|\\.)*)"', labels or "")), float(value)))
+    return parsed
+
+
+@allure.feature("Call metrics")
+class TestInstrumentation:
+
+    @allure.story("The summary aggregates calls per operation and listings per shard")
+    def test_summary(self, tmp_path):
+        summary = instrumented(tmp_path).summary()
+        operations = {op["operation"]: op for op in summary["operations"]}
+        assert sorted(operations) == ["buckets.getIamPolicy", "instances.list"]
+
+        listing = operations["instances.list"]
+        assert (listing["calls"], listing["retries"], listing["errors"], listing["bytes"]) == (2, 1, 0, 1500)
+        assert listing["latency"]["max"] == 0.2
+        assert listing["histogram"]["0.025"] == 0
+        assert listing["histogram"]["0.05"] == 1
+        assert listing["histogram"]["30.0"] == 2
+        assert operations["buckets.getIamPolicy"]["errors"] == 1
+
+        assert summary["listings"] == [{"service": "compute", "operation": "instances.list", "project_id": "dev000",
+                                        "zone": "europe-west3-a", "pages": 2, "bytes": 1500, "seconds": 0.24}]
+        assert [c["seconds"] for c in summary["slowest_calls"]] == [1.5, 0.2, 0.04]
+        assert summary["api"]["count"] == 3
+        assert summary["fixtures"]["project_vm_instances"]["count"] == 2
+        assert summary["tests"]["sum"] == 0.01
+
+    @allure.story("The textfile is valid Prometheus exposition format with cumulative histograms")
+    def test_prometheus(self, tmp_path):
+        instrumentation = instrumented(tmp_path)
+        parsed = samples(instrumentation.prometheus(instrumentation.summary()))
+        values = {(name, tuple(sorted(labels.items()))): value for name, labels, value in parsed}
+        compute = (("operation", "instances.list"), ("service", "compute"))
+        assert values[("gcp_api_calls_total", compute)] == 2
+        assert values[("gcp_api_retries_total", compute)] == 1
+        assert values[("gcp_api_call_duration_seconds_count", compute)] == 2
+
+        buckets = [(labels["le"], value) for name, labels, value in parsed
+                   if name == "gcp_api_call_duration_seconds_bucket" and labels["operation"] == "instances.list"]
+        assert buckets[-1] == ("+Inf", 2)
+        counts = [value for _, value in buckets]
+        assert counts == sorted(counts)
+        assert values[("pytest_fixture_setup_seconds_total", (("fixture", "project_vm_instances"),))] == 0.4
+
+    @allure.story("Every xdist worker writes files of its own, with its id on every series")
+    def test_worker_files(self, tmp_path):
+        instrumented(tmp_path).write()
+        for worker in ("gw0", "gw1"):
+            instrumented(tmp_path, worker).write()
+        assert sorted(os.listdir(tmp_path)) == ["metrics.gw0.prom", "metrics.gw1.prom", "metrics.prom",
+                                                "metrics_summary.gw0.json", "metrics_summary.gw1.json",
+                                                "metrics_summary.json"]
+
+        with open(tmp_path / "metrics_summary.gw1.json", "r") as summary_file:
+            assert json.load(summary_file)["api"]["count"] == 3
+        with open(tmp_path / "metrics.gw1.prom", "r") as prometheus_file:
+            assert all(labels.get("worker") == "gw1" for _, labels, _ in samples(prometheus_file.read()))
+        with open(tmp_path / "metrics.prom", "r") as prometheus_file:
+            assert all("worker" not in labels for _, labels, _ in samples(prometheus_file.read()))
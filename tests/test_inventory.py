@@ -0,0 +1,75 @@
+import threading
+
+import allure
+from google.cloud import compute_v1
+
+from api_tests.inventory import ComputeInventory
+
+'''
+    ====================
+    Compute Engine inventory snapshots (api_tests/inventory.py)
+    ====================
+'''
+
+PROJECT_ID = "dev000"
+ZONES = ("europe-west3-a", "europe-west3-b")
+
+
+class FakeListing:
+    # list_instances(project_id, zone, fields, filter_) returning one instance per zone; a zone in blocked waits
+    # until release() before it answers
+
+    def __init__(self, *blocked):
+        self.calls = []
+        self.blocked = set(blocked)
+        self.started = threading.Event()
+        self._released = threading.Event()
+        self._lock = threading.Lock()
+
+    def release(self):
+        self._released.set()
+
+    def __call__(self, project_id, zone, fields=None, filter_=None):
+        with self._lock:
+            self.calls.append((project_id, zone))
+        if zone in self.blocked:
+            self.started.set()
+            assert self._released.wait(10)
+        return [compute_v1.Instance(name=f"vm-{zone}", zone=f"zones/{zone}")]
+
+
+@allure.feature("Inventory")
+class TestComputeInventory:
+
+    @allure.story("Snapshots of different zones of one project are cached side by side")
+    def test_zones_in_snapshot_key(self):
+        listing = FakeListing()
+        inventory = ComputeInventory(list_instances=listing)
+        assert inventory.snapshot(PROJECT_ID, [ZONES[0]]).names() == [f"vm-{ZONES[0]}"]
+        assert inventory.snapshot(PROJECT_ID, [ZONES[1]]).names() == [f"vm-{ZONES[1]}"]
+        # Both served from the cache: the second listing did not replace the first
+        inventory.snapshot(PROJECT_ID, [ZONES[0]])
+        inventory.snapshot(PROJECT_ID, [ZONES[1]])
+        assert listing.calls == [(PROJECT_ID, ZONES[0]), (PROJECT_ID, ZONES[1])]
+
+    @allure.story("A slow listing holds no lock: cached snapshots are served meanwhile, and it is listed once")
+    def test_listing_outside_the_lock(self):
+        listing = FakeListing(ZONES[1])
+        inventory = ComputeInventory(list_instances=listing)
+        inventory.snapshot(PROJECT_ID, [ZONES[0]])
+
+        snapshots = []
+        threads = [threading.Thread(target=lambda: snapshots.append(inventory.snapshot(PROJECT_ID, [ZONES[1]])))
+                   for _ in range(2)]
+        for thread in threads:
+            thread.start()
+        assert listing.started.wait(10)
+        # While zone b is being listed, zone a's snapshot and the timings are still served
+        assert inventory.snapshot(PROJECT_ID, [ZONES[0]]).names() == [f"vm-{ZONES[0]}"]
+        assert len(inventory.timings) == 1
+
+        listing.release()
+        for thread in threads:
+            thread.join(10)
+        assert [snapshot.names() for snapshot in snapshots] == [[f"vm-{ZONES[1]}"]] * 2
+        assert listing.calls.count((PROJECT_ID, ZONES[1])) == 1
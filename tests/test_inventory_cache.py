@@ -0,0 +1,75 @@
+import os
+import time
+
+import allure
+from google.cloud import compute_v1
+
+from api_tests.inventory_cache import InventoryCache
+
+'''
+    ====================
+    On-disk inventory shards (api_tests/inventory_cache.py)
+    ====================
+'''
+
+KEY = ("compute", "dev000", "europe-west3-a", ("name",), None)
+
+
+class CountingFetch:
+
+    def __init__(self):
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        return [compute_v1.Instance(name=f"vm-{self.calls:02d}")]
+
+
+def expire(cache, key):
+    # Backdates the shard past the cache's TTL
+    written = time.time() - 2 * cache.ttl
+    os.utime(cache.path(key) + ".bin", (written, written))
+
+
+@allure.feature("Inventory cache")
+class TestInventoryCache:
+
+    @allure.story("A fresh shard is served without listing it again")
+    def test_fresh(self, tmp_path):
+        cache, fetch = InventoryCache(str(tmp_path), ttl=60), CountingFetch()
+        assert [i.name for i in cache.fetch(KEY, fetch)] == ["vm-01"]
+        assert [i.name for i in cache.fetch(KEY, fetch)] == ["vm-01"]
+        assert fetch.calls == 1
+        assert (cache.stats["missed"], cache.stats["fresh"]) == (1, 1)
+
+    @allure.story("Every expiry of a shard triggers its own background refresh")
+    def test_revalidated_on_every_expiry(self, tmp_path):
+        cache, fetch = InventoryCache(str(tmp_path), ttl=60), CountingFetch()
+        cache.fetch(KEY, fetch)
+
+        for refreshes in (1, 2):
+            expire(cache, KEY)
+            # The stale shard is served at once, the refresh lands for the next read
+            stale = cache.fetch(KEY, fetch)
+            cache.wait()
+            assert fetch.calls == refreshes + 1
+            assert [i.name for i in stale] == [f"vm-{refreshes:02d}"]
+            assert [i.name for i in cache.read(KEY)] == [f"vm-{refreshes + 1:02d}"]
+        assert (cache.stats["stale"], cache.stats["refreshed"]) == (2, 2)
+
+    @allure.story("A failed refresh keeps the stale shard and is retried on the next read")
+    def test_refresh_failure(self, tmp_path):
+        cache, fetch = InventoryCache(str(tmp_path), ttl=60), CountingFetch()
+        cache.fetch(KEY, fetch)
+        expire(cache, KEY)
+
+        def failing():
+            raise ConnectionError("listing failed")
+
+        assert [i.name for i in cache.fetch(KEY, failing)] == ["vm-01"]
+        cache.wait()
+        assert cache.stats["refresh_failed"] == 1
+        cache.fetch(KEY, fetch)
+        cache.wait()
+        assert cache.stats["refreshed"] == 1
+        assert [i.name for i in cache.read(KEY)] == ["vm-02"]
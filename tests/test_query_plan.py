@@ -0,0 +1,85 @@
+import json
+
+import allure
+from google.cloud import compute_v1
+
+from api_tests.emulator import matches_filter, parse_filter
+from api_tests.query_plan import evaluate_planned, plan
+from api_tests.rules import COMPUTE_RULES
+
+'''
+    ====================
+    Query planning for --violators-only (api_tests/query_plan.py)
+
+    Listings are served from a handful of instance resources through the emulator's filter
+    matching, which takes the strict reading of the API: an unset field matches no term.
+    ====================
+'''
+
+ZONE = "https://www.googleapis.com/compute/v1/projects/dev000/zones/europe-west3-a"
+PROJECT = {"project_id": "dev000", "zone": "europe-west3-a", "secure_boot_assertion": True,
+           "display_device_assertion": False}
+# An instance without a display device violates display_device_assertion: True
+CLIENT_SIDE_PROJECT = dict(PROJECT, display_device_assertion=True)
+
+# shieldedInstanceConfig is returned on every instance, false included; displayDevice only when set
+RESOURCES = [
+    {"name": "vm-compliant", "zone": ZONE, "shieldedInstanceConfig": {"enableSecureBoot": True},
+     "displayDevice": {"enableDisplay": False}},
+    {"name": "vm-no-secure-boot", "zone": ZONE, "shieldedInstanceConfig": {"enableSecureBoot": False}},
+    {"name": "vm-display", "zone": ZONE, "shieldedInstanceConfig": {"enableSecureBoot": True},
+     "displayDevice": {"enableDisplay": True}},
+]
+
+
+class Listings:
+    # fetch(fields, filter_) over RESOURCES, recording every listing's filter
+
+    def __init__(self):
+        self.filters = []
+
+    def __call__(self, fields, filter_):
+        self.filters.append(filter_)
+        terms = parse_filter(filter_) if filter_ else None
+        return [compute_v1.Instance.from_json(json.dumps(resource)) for resource in RESOURCES
+                if terms is None or matches_filter(resource, terms)]
+
+
+def rule_names(rules):
+    return [r.name for r in rules]
+
+
+@allure.feature("Query planning")
+class TestQueryPlan:
+
+    @allure.story("Fields returned on every instance are pushed down whatever the expectation")
+    def test_plan(self):
+        query = plan(PROJECT, COMPUTE_RULES)
+        assert rule_names(query.pushed) == ["display_device", "secure_boot"]
+        assert not query.client_side
+        assert query.filter == "(displayDevice.enableDisplay != false) OR (shieldedInstanceConfig.enableSecureBoot != true)"
+
+    @allure.story("A field that may be unset is only pushed down when an unset field complies")
+    def test_plan_unset_field(self):
+        query = plan(CLIENT_SIDE_PROJECT, COMPUTE_RULES)
+        assert rule_names(query.pushed) == ["secure_boot"]
+        assert rule_names(query.client_side) == ["display_device"]
+
+    @allure.story("With every rule pushed down, one filtered listing returns the violators only")
+    def test_pushed_only(self):
+        fetch = Listings()
+        results = evaluate_planned(PROJECT, fetch)
+        assert fetch.filters == [plan(PROJECT, COMPUTE_RULES).filter]
+        assert results["secure_boot"].failed == ["vm-no-secure-boot"]
+        assert results["display_device"].failed == ["vm-display"]
+        assert results["display_device"].passed is None
+
+    @allure.story("A client-side rule means one unfiltered listing that serves every rule")
+    def test_client_side(self):
+        fetch = Listings()
+        results = evaluate_planned(CLIENT_SIDE_PROJECT, fetch)
+        assert fetch.filters == [None]
+        # vm-no-secure-boot has no display device at all and is still reported
+        assert results["display_device"].failed == ["vm-compliant", "vm-no-secure-boot"]
+        assert results["secure_boot"].failed == ["vm-no-secure-boot"]
+        assert results["secure_boot"].passed == ["vm-compliant", "vm-display"]
@@ -0,0 +1,67 @@
+import allure
+from google.cloud import compute_v1
+
+from api_tests import inventory
+from api_tests.audit_state import AuditStore
+from api_tests.reverify import reverify_project
+
+'''
+    ====================
+    Re-verification of recorded failures (api_tests/reverify.py)
+    ====================
+'''
+
+PROJECT_ID = "dev000"
+PROJECT = {"project_id": PROJECT_ID, "zone": "europe-west3-a", "secure_boot_assertion": True}
+
+
+def instance(zone, name, secure_boot):
+    return compute_v1.Instance(
+        name=name, zone=f"https://www.googleapis.com/compute/v1/projects/{PROJECT_ID}/zones/{zone}",
+        shielded_instance_config=compute_v1.ShieldedInstanceConfig(enable_secure_boot=secure_boot))
+
+
+class FakeInventory:
+    # get_instances() served from {"zone/name": instance}; missing resources no longer exist
+
+    def __init__(self, instances):
+        self.instances = instances
+
+    def get_instances(self, project_id, resources, fields=None):
+        return {resource: self.instances.get(resource) for resource in resources}
+
+
+@allure.feature("Re-verification")
+class TestReverify:
+
+    @allure.story("Instances with the same name in two zones keep separate verdicts")
+    def test_same_name_in_two_zones(self, tmp_path, monkeypatch):
+        fixed, failing = "europe-west3-a/vm-01", "europe-west3-b/vm-01"
+        monkeypatch.setattr(inventory, "compute_inventory", FakeInventory({
+            fixed: instance("europe-west3-a", "vm-01", True),
+            failing: instance("europe-west3-b", "vm-01", False),
+        }))
+        store = AuditStore(str(tmp_path / "audit_state.sqlite"))
+        pairs = [(fixed, "secure_boot"), (failing, "secure_boot")]
+        store.record("compute", PROJECT_ID, dict.fromkeys([fixed, failing], "f"), {"secure_boot": ""},
+                     [fixed, failing], [], pairs)
+
+        result = reverify_project(PROJECT_ID, PROJECT, store)["secure_boot"]
+        assert (result.passed, result.failed) == (["vm-01"], ["vm-01"])
+        assert store.load("compute", PROJECT_ID).failures == {(failing, "secure_boot")}
+        assert (store.rechecked, store.resolved) == (2, 1)
+        store.close()
+
+    @allure.story("A failing instance that no longer exists is forgotten")
+    def test_deleted_instance(self, tmp_path, monkeypatch):
+        deleted = "europe-west3-a/vm-02"
+        monkeypatch.setattr(inventory, "compute_inventory", FakeInventory({}))
+        store = AuditStore(str(tmp_path / "audit_state.sqlite"))
+        store.record("compute", PROJECT_ID, {deleted: "f"}, {"secure_boot": ""}, [deleted], [],
+                     [(deleted, "secure_boot")])
+
+        result = reverify_project(PROJECT_ID, PROJECT, store)["secure_boot"]
+        assert (result.passed, result.failed) == ([], [])
+        state = store.load("compute", PROJECT_ID)
+        assert not state.failures and deleted not in state.fingerprints
+        store.close()
@@ -0,0 +1,401 @@
+import random
+import threading
+import time
+
+import allure
+import pytest
+import requests
+from google.api_core.exceptions import TooManyRequests
+
+from api_tests import inventory, scheduler as scheduler_module
+from api_tests.clients import ClientRegistry
+from api_tests.emulator import Emulator, Fleet
+from api_tests.scheduler import AIMDLimiter, RunBudgetExceeded, Scheduler, TokenBucket, _project
+
+'''
+    ====================
+    Quota-aware scheduling (api_tests/scheduler.py)
+
+    Every test drives a Scheduler of its own through fake sends, so no request leaves the process.
+    Rate limiting, backoff and deadlines run on a fake clock: sleeping advances it at once.
+    Hedged requests race on real threads, each answering when the test lets it.
+    ====================
+'''
+
+BUCKETS_URL = "https://storage.googleapis.com/storage/v1/b"
+
+
+def response(status=200, headers=None):
+    result = requests.Response()
+    result.status_code = status
+    result.headers.update(headers or {})
+    result._content = b"{}"
+    return result
+
+
+class FakeClock:
+    # Stands in for the time module inside api_tests.scheduler
+
+    def __init__(self):
+        self.now = 1000.0
+        self.slept = []
+
+    def monotonic(self):
+        return self.now
+
+    perf_counter = monotonic
+
+    def sleep(self, seconds):
+        self.slept.append(seconds)
+        self.now += seconds
+
+
+class FakeSend:
+    # send(timeout) answering the given statuses (or raising the given exceptions) in turn; the last one repeats
+
+    def __init__(self, clock, *outcomes, latency=0.1):
+        self.clock = clock
+        self.outcomes = list(outcomes)
+        self.latency = latency
+        self.timeouts = []
+
+    def __call__(self, timeout):
+        self.timeouts.append(timeout)
+        self.clock.now += self.latency
+        outcome = self.outcomes.pop(0) if len(self.outcomes) > 1 else self.outcomes[0]
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome if isinstance(outcome, requests.Response) else response(outcome)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(scheduler_module, "time", clock)
+    # Backoff without jitter: always the upper bound
+    monkeypatch.setattr(random, "uniform", lambda low, high: high)
+    return clock
+
+
+@allure.feature("API scheduler")
+class TestProject:
+
+    @allure.story("The project of a bucket listing is read from params passed as (name, value) pairs")
+    def test_params_as_pairs(self):
+        # The Compute REST transport passes query params as a list of pairs, not a dict
+        assert _project(BUCKETS_URL, [("project", "dev000"), ("maxResults", 500)]) == "dev000"
+        assert _project(BUCKETS_URL, {"project": "dev000"}) == "dev000"
+        assert _project(f"{BUCKETS_URL}?project=dev000") == "dev000"
+
+    @allure.story("Every project gets its own token bucket")
+    def test_bucket_per_project(self):
+        scheduler = Scheduler(rate=100.0)
+        for project_id in ("dev000", "dev001"):
+            scheduler.call(lambda timeout: response(), "GET", BUCKETS_URL, [("project", project_id)])
+        assert sorted(project_id for _, project_id in scheduler._buckets) == ["dev000", "dev001"]
+
+
+@allure.feature("API scheduler")
+class TestServiceNames:
+
+    @allure.story("Compute and Storage calls to one emulator host are scheduled as separate APIs")
+    def test_emulator(self, monkeypatch):
+        fleet = Fleet(1, 1, 10, 10, violation_rate=0.0)
+        scheduler = Scheduler(rate=100.0)
+        with Emulator(fleet) as emulator:
+            emulated = ClientRegistry()
+            emulated.endpoint = emulator.endpoint
+            monkeypatch.setattr(inventory, "registry", emulated)
+            scheduler.install()
+            try:
+                project_id = fleet.project_ids[0]
+                inventory.list_zone_instances(project_id, fleet.zones[0])
+                inventory.list_project_buckets(project_id)
+            finally:
+                scheduler.uninstall()
+
+        assert sorted(scheduler.stats()) == ["compute", "storage"]
+        assert sorted(service for service, _ in scheduler._buckets) == ["compute", "storage"]
+        assert sorted(scheduler._limiters) == ["compute", "storage"]
+
+
+@allure.feature("API scheduler")
+class TestLibraryRetries:
+
+    @allure.story("While the scheduler is installed the client libraries do not retry on their own")
+    def test_no_library_retries(self, clock, monkeypatch):
+        fleet = Fleet(1, 1, 10, 10, violation_rate=0.0)
+        scheduler = Scheduler(rate=None, max_retries=1)
+        assert scheduler.library_retry("default") == "default"
+        with Emulator(fleet, throttle_rate=1.0) as emulator:
+            emulated = ClientRegistry()
+            emulated.endpoint = emulator.endpoint
+            monkeypatch.setattr(inventory, "registry", emulated)
+            monkeypatch.setattr(inventory, "scheduler", scheduler)
+            scheduler.install()
+            try:
+                assert scheduler.library_retry("default") is None
+                with pytest.raises(TooManyRequests):
+                    inventory.list_project_buckets(fleet.project_ids[0])
+            finally:
+                scheduler.uninstall()
+        # The first attempt and the scheduler's one retry; the library's own retry policy would keep going
+        assert emulator.requests["throttled"] == 2
+
+
+@allure.feature("API scheduler")
+class TestTokenBucket:
+
+    @allure.story("The token bucket refills at its rate, up to its burst")
+    def test_refill(self, clock):
+        bucket = TokenBucket(rate=2.0, burst=2)
+        assert bucket.acquire() == 0 and bucket.acquire() == 0
+        # Empty: the next token takes 1 / rate seconds
+        assert bucket.acquire() == pytest.approx(0.5)
+        assert clock.slept == [pytest.approx(0.5)]
+
+        # A long pause refills the burst, not more
+        clock.sleep(60)
+        clock.slept.clear()
+        assert bucket.acquire() == 0 and bucket.acquire() == 0
+        assert bucket.acquire() == pytest.approx(0.5)
+
+
+@allure.feature("API scheduler")
+class TestAIMDLimiter:
+
+    @allure.story("Throttling halves the concurrency limit, healthy calls raise it by about one per window")
+    def test_decrease_and_recover(self):
+        limiter = AIMDLimiter(8)
+        for expected in (4, 2, 1, 1):
+            limiter.acquire()
+            limiter.release(healthy=False, throttled=True)
+            assert limiter.limit == expected
+
+        # Additive increase: +1 / limit per healthy call, so a full window of calls adds one slot
+        limiter.acquire()
+        limiter.release(healthy=True, throttled=False)
+        assert limiter.limit == 2
+        # 2 -> 2.5 -> 2.9 -> 3.24
+        for _ in range(3):
+            limiter.acquire()
+            limiter.release(healthy=True, throttled=False)
+        assert limiter.limit == 3
+
+        for _ in range(100):
+            limiter.acquire()
+            limiter.release(healthy=True, throttled=False)
+        assert limiter.limit == 8
+
+    @allure.story("A 429 from the API halves the scheduler's concurrency for that API")
+    def test_scheduler_backs_off_on_throttling(self, clock):
+        scheduler = Scheduler(rate=None, max_concurrency=8)
+        send = FakeSend(clock, 429, 503, 200)
+        assert scheduler.call(send, "GET", BUCKETS_URL).status_code == 200
+        stats = scheduler.stats()["storage"]
+        assert (stats["throttled"], stats["retried"], stats["concurrency"]) == (2, 2, 2)
+
+
+@allure.feature("API scheduler")
+class TestRetries:
+
+    @allure.story("A throttled call waits for the Retry-After the API asked for")
+    def test_retry_after(self, clock):
+        scheduler = Scheduler(rate=None)
+        send = FakeSend(clock, response(429, {"Retry-After": "7"}), 200)
+        assert scheduler.call(send, "GET", BUCKETS_URL).status_code == 200
+        assert clock.slept == [7.0]
+
+    @allure.story("Retries stop after --max-retries and the last response is returned")
+    def test_retry_cap(self, clock):
+        scheduler = Scheduler(rate=None, max_retries=3, call_timeout=None)
+        send = FakeSend(clock, 503)
+        assert scheduler.call(send, "GET", BUCKETS_URL).status_code == 503
+        assert len(send.timeouts) == 4
+        stats = scheduler.stats()["storage"]
+        assert (stats["calls"], stats["retried"], stats["failed"]) == (4, 3, 1)
+
+    @allure.story("Calls that are not idempotent are never retried")
+    def test_no_retry_of_writes(self, clock):
+        scheduler = Scheduler(rate=None)
+        send = FakeSend(clock, 503, 200)
+        assert scheduler.call(send, "POST", BUCKETS_URL).status_code == 503
+        assert len(send.timeouts) == 1
+
+
+@allure.feature("API scheduler")
+class TestDeadlines:
+
+    @allure.story("Every attempt gets what is left of the call's deadline, and no retry starts past it")
+    def test_call_deadline(self, clock):
+        scheduler = Scheduler(rate=None, call_timeout=10.0)
+        send = FakeSend(clock, response(503, {"Retry-After": "4"}), latency=0.0)
+        assert scheduler.call(send, "GET", BUCKETS_URL).status_code == 503
+        # Attempts at 0s, 4s and 8s; a retry at 12s would start after the deadline
+        assert send.timeouts == [pytest.approx(10.0), pytest.approx(6.0), pytest.approx(2.0)]
+
+    @allure.story("An attempt that times out at the deadline fails the call with requests.Timeout")
+    def test_call_deadline_expires(self, clock):
+        scheduler = Scheduler(rate=None, call_timeout=10.0)
+        send = FakeSend(clock, requests.Timeout("read timed out"), latency=10.0)
+        with pytest.raises(requests.Timeout):
+            scheduler.call(send, "GET", BUCKETS_URL)
+        assert len(send.timeouts) == 1
+        assert scheduler.stats()["storage"]["timed_out"] == 1
+
+    @allure.story("Once the run budget is spent, calls fail fast without reaching the API")
+    def test_run_budget(self, clock):
+        scheduler = Scheduler(rate=None, call_timeout=None)
+        scheduler.start_budget(5.0)
+        send = FakeSend(clock, 200)
+        assert scheduler.call(send, "GET", BUCKETS_URL).status_code == 200
+        # The budget also caps the deadline of a call started within it
+        assert send.timeouts == [pytest.approx(5.0)]
+
+        clock.sleep(5.0)
+        with pytest.raises(RunBudgetExceeded):
+            scheduler.call(send, "GET", BUCKETS_URL)
+        assert len(send.timeouts) == 1
+
+    @allure.story("A call whose deadline passes before the next rate-limit token fails without waiting for it")
+    def test_deadline_before_token(self, clock):
+        scheduler = Scheduler(rate=1.0, call_timeout=0.5)
+        send = FakeSend(clock, 200, latency=0.0)
+        assert scheduler.call(send, "GET", BUCKETS_URL).status_code == 200
+        # The bucket is empty for another second, past the next call's deadline
+        with pytest.raises(requests.Timeout):
+            scheduler.call(send, "GET", BUCKETS_URL)
+        assert len(send.timeouts) == 1
+        assert not clock.slept
+        assert scheduler.stats()["storage"]["timed_out"] == 1
+
+    @allure.story("A call started within the run budget does not wait for a token past its end")
+    def test_run_budget_before_token(self, clock):
+        scheduler = Scheduler(rate=1.0, call_timeout=None)
+        scheduler.start_budget(0.5)
+        send = FakeSend(clock, 200, latency=0.0)
+        scheduler.call(send, "GET", BUCKETS_URL)
+        with pytest.raises(RunBudgetExceeded):
+            scheduler.call(send, "GET", BUCKETS_URL)
+        assert not clock.slept
+
+
+class RacingSend:
+    # send(timeout) whose n-th request (0: primary, 1: hedge) answers once its event is set
+
+    def __init__(self, *statuses):
+        self.statuses = statuses
+        self.events = [threading.Event() for _ in statuses]
+        self.sent = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, timeout):
+        with self._lock:
+            index, self.sent = self.sent, self.sent + 1
+        self.events[index].wait(5)
+        result = response(self.statuses[index])
+        result.headers["X-Request"] = str(index)
+        return result
+
+
+def hedging_scheduler(**kwargs):
+    # Hedges at once: every recent storage call took 1ms
+    scheduler = Scheduler(hedge=True, **kwargs)
+    scheduler._latencies["storage"].extend([0.001] * 20)
+    return scheduler
+
+
+def call_in_background(scheduler, send):
+    result = {}
+    thread = threading.Thread(target=lambda: result.update(response=scheduler.call(send, "GET", BUCKETS_URL)))
+    thread.start()
+    return thread, result
+
+
+def wait_for(condition):
+    deadline = time.monotonic() + 5
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.005)
+    assert condition()
+
+
+@allure.feature("API scheduler")
+class TestHedging:
+
+    @allure.story("A hedge that answers first wins; the primary keeps its slot until it finishes")
+    def test_hedge_wins(self):
+        scheduler = hedging_scheduler(rate=None)
+        send = RacingSend(200, 200)
+        thread, result = call_in_background(scheduler, send)
+        wait_for(lambda: send.sent == 2)
+        limiter = scheduler._limiter("storage")
+        assert limiter._in_flight == 2
+
+        send.events[1].set()
+        thread.join(5)
+        assert result["response"].headers["X-Request"] == "1"
+        # The primary is still running and holds its slot
+        assert limiter._in_flight == 1
+
+        send.events[0].set()
+        wait_for(lambda: limiter._in_flight == 0)
+        stats = scheduler.stats()["storage"]
+        assert (stats["hedged"], stats["hedge_won"]) == (1, 1)
+
+    @allure.story("A primary that answers first wins; the hedge gives its slot back when it finishes")
+    def test_primary_wins(self):
+        scheduler = hedging_scheduler(rate=None)
+        send = RacingSend(200, 200)
+        thread, result = call_in_background(scheduler, send)
+        wait_for(lambda: send.sent == 2)
+
+        send.events[0].set()
+        thread.join(5)
+        assert result["response"].headers["X-Request"] == "0"
+        send.events[1].set()
+        wait_for(lambda: scheduler._limiter("storage")._in_flight == 0)
+        stats = scheduler.stats()["storage"]
+        assert (stats["hedged"], stats.get("hedge_won", 0)) == (1, 0)
+
+    @allure.story("No hedge is sent while the API is throttling the scheduler")
+    def test_no_hedge_while_backing_off(self):
+        scheduler = hedging_scheduler(rate=None)
+        limiter = scheduler._limiter("storage")
+        limiter.acquire()
+        limiter.release(healthy=False, throttled=True)
+        assert limiter.backing_off
+
+        send = RacingSend(200, 200)
+        thread, _ = call_in_background(scheduler, send)
+        time.sleep(0.05)
+        send.events[0].set()
+        thread.join(5)
+        assert send.sent == 1
+        assert "hedged" not in scheduler.stats()["storage"]
+
+    @allure.story("A hedge needs a rate-limit token to spare")
+    def test_no_hedge_without_token(self):
+        scheduler = hedging_scheduler(rate=0.001)
+        send = RacingSend(200, 200)
+        # The primary takes the only token of the bucket
+        thread, _ = call_in_background(scheduler, send)
+        time.sleep(0.05)
+        send.events[0].set()
+        thread.join(5)
+        assert send.sent == 1
+        assert "hedged" not in scheduler.stats()["storage"]
+
+    @allure.story("A throttled loser still halves the concurrency limit")
+    def test_throttled_loser(self):
+        scheduler = hedging_scheduler(rate=None)
+        send = RacingSend(429, 200)
+        thread, result = call_in_background(scheduler, send)
+        wait_for(lambda: send.sent == 2)
+        send.events[1].set()
+        thread.join(5)
+        assert result["response"].status_code == 200
+
+        send.events[0].set()
+        limiter = scheduler._limiter("storage")
+        wait_for(lambda: limiter._in_flight == 0)
+        assert limiter.backing_off
@@ -0,0 +1,68 @@
+import os
+import socket
+import socketserver
+import stat
+
+import allure
+import pytest
+
+from api_tests.sidecar import Sidecar, SidecarClient
+
+'''
+    ====================
+    Inventory sidecar (api_tests/sidecar.py)
+    ====================
+'''
+
+KEY = ("compute", "dev000", "europe-west3-a", None, None)
+
+
+def unix_sockets():
+    if not hasattr(socket, "AF_UNIX"):
+        pytest.skip("The inventory sidecar needs Unix sockets")
+
+
+@allure.feature("Inventory sidecar")
+class TestSidecar:
+
+    @allure.story("The socket is readable by its owner only from the moment it is bound")
+    def test_socket_permissions(self, tmp_path, monkeypatch):
+        unix_sockets()
+        bound = []
+        server_bind = socketserver.UnixStreamServer.server_bind
+
+        def recording_bind(server):
+            server_bind(server)
+            bound.append(stat.S_IMODE(os.stat(server.server_address).st_mode))
+
+        monkeypatch.setattr(socketserver.UnixStreamServer, "server_bind", recording_bind)
+        umask = os.umask(0o022)
+        try:
+            with Sidecar(str(tmp_path / "inventory.sock"), list_shard=lambda key: []) as sidecar:
+                assert stat.S_IMODE(os.stat(sidecar.path).st_mode) == 0o600
+                # The process umask is left as it was
+                assert os.umask(0o022) == 0o022
+        finally:
+            os.umask(umask)
+        assert bound == [0o600]
+
+    @allure.story("A shard is served to clients listing from the sidecar's endpoint")
+    def test_same_endpoint(self, tmp_path):
+        unix_sockets()
+        listed = []
+        with Sidecar(str(tmp_path / "inventory.sock"), list_shard=lambda key: listed.append(key) or [],
+                     endpoint="localhost:8085") as sidecar:
+            client = SidecarClient(sidecar.path, "localhost:8085")
+            assert client.fetch(KEY, lambda: pytest.fail("listed by the client")) == []
+        assert listed == [KEY]
+
+    @allure.story("A client listing from another endpoint is refused and lists the shard itself")
+    def test_other_endpoint(self, tmp_path):
+        unix_sockets()
+        listed = []
+        with Sidecar(str(tmp_path / "inventory.sock"), list_shard=lambda key: listed.append(key) or [],
+                     endpoint="localhost:8085") as sidecar:
+            for endpoint in (None, "localhost:9090"):
+                assert SidecarClient(sidecar.path, endpoint).fetch(KEY, lambda: ["listed here"]) == ["listed here"]
+            assert not sidecar.keys()
+        assert not listed
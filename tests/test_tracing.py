@@ -0,0 +1,58 @@
+import glob
+import json
+
+import allure
+
+from api_tests.tracing import Tracer
+from tests.test_call_budget import run_suite
+
+'''
+    ====================
+    Trace spans (api_tests/tracing.py)
+    ====================
+'''
+
+
+def chrome_events(trace):
+    return {event["name"]: event for event in trace["traceEvents"] if event["ph"] == "X"}
+
+
+@allure.feature("Tracing")
+class TestTracing:
+
+    @allure.story("A snapshot ends the open spans as of now and leaves them open")
+    def test_snapshot(self):
+        tracer = Tracer()
+        tracer.enabled = True
+        with tracer.span("session", "session"):
+            with tracer.span("test", "test"):
+                with tracer.span("fixture", "fixture"):
+                    pass
+                events = chrome_events(tracer.chrome_trace(tracer.snapshot()))
+                assert set(events) == {"session", "test", "fixture"}
+                assert events["session"]["dur"] >= events["test"]["dur"] >= events["fixture"]["dur"]
+                # Still open: the spans end when their blocks do
+                assert tracer.current().name == "test"
+        assert [span.name for span in tracer.spans] == ["fixture", "test", "session"]
+        assert tracer.folded_stacks().startswith("session")
+
+    @allure.story("The trace attached to the Allure report has the session as its root span")
+    def test_allure_attachment(self, tmp_path):
+        results = tmp_path / "allure-results"
+        run_suite(tmp_path, "api_tests/test_compute_engine.py::TestComputeEngine",
+                  "--trace-dir", str(tmp_path / "trace"), "--alluredir", str(results))
+
+        attached = []
+        for path in glob.glob(str(results / "*-result.json")) + glob.glob(str(results / "*-container.json")):
+            with open(path, "r") as result_file:
+                result = json.load(result_file)
+            for step in [result] + result.get("befores", []) + result.get("afters", []):
+                attached += [a["source"] for a in step.get("attachments", []) if a["name"] == "Chrome trace"]
+        assert len(attached) == 1, attached
+
+        with open(results / attached[0], "r") as trace_file:
+            events = chrome_events(json.load(trace_file))
+        assert "session" in events
+        # The root span covers every other span
+        assert all(event["ts"] + event["dur"] <= events["session"]["ts"] + events["session"]["dur"] + 1
+                   for event in events.values())